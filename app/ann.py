@@ -0,0 +1,491 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+
+from .recommenderhelper import pad_unmatched, similar_movie_rows_batch, top_k_rows
+
+# Bump when the files written by `AnnIndex.save` change
+ANN_FORMAT = 1
+
+
+def unit_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise the rows of a dense array, leaving zero rows as they are."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, sample_size=50000, seed=0):
+    """
+    Cluster unit vectors by cosine similarity with Lloyd iterations.
+
+    Centroids are trained on a random sample, which is plenty to
+    place them and keeps training time independent of the catalogue.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        The L2-normalised vectors, one per row.
+    n_clusters : int
+        The number of clusters.
+    n_iter : int, optional
+        The number of iterations. Default is 10.
+    sample_size : int, optional
+        The number of vectors trained on. Default is 50000.
+    seed : int, optional
+        The random seed. Default is 0.
+
+    Returns
+    -------
+    numpy.ndarray
+        The L2-normalised centroids, shape (n_clusters, dim).
+    """
+    rng = np.random.default_rng(seed)
+    n_vectors = len(vectors)
+    sample_size = min(n_vectors, max(sample_size, n_clusters))
+    sample = np.asarray(vectors[rng.choice(n_vectors, sample_size, replace=False)])
+    centroids = sample[rng.choice(sample_size, n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        membership = sparse.csr_matrix(
+            (np.ones(sample_size), (assignment, np.arange(sample_size))),
+            shape=(n_clusters, sample_size),
+        )
+        sums = np.asarray(membership @ sample)
+        # Restart empty clusters from random points so no list stays empty
+        empty = np.flatnonzero(np.asarray(membership.sum(axis=1)).ravel() == 0)
+        sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        centroids = unit_rows(sums).astype(vectors.dtype)
+    return centroids
+
+
+class AnnIndex:
+    """
+    Approximate nearest-neighbour index over SVD-reduced TF-IDF vectors.
+
+    The TF-IDF matrix is reduced with truncated SVD to dense unit
+    vectors, which are clustered into `n_lists` inverted lists
+    (IVF). A query scores the list centroids, then only the movies
+    in its `nprobe` closest lists, so a query touches about
+    `nprobe / n_lists` of the catalogue. Raising `nprobe` trades
+    speed for recall at query time, up to exact search in the
+    reduced space when `nprobe == n_lists`.
+
+    Vectors are stored grouped by list, so every probed list is one
+    contiguous slice, and everything is plain NumPy arrays that can
+    be memory-mapped. Build it offline with `build`, then `save` it
+    next to the model artifact.
+
+    Attributes
+    ----------
+    components : numpy.ndarray
+        The SVD components, shape (dim, n_terms), to embed new text.
+    centroids : numpy.ndarray
+        The list centroids, shape (n_lists, dim).
+    offsets : numpy.ndarray
+        List i holds positions `offsets[i]:offsets[i + 1]`.
+    vectors : numpy.ndarray
+        The unit vectors in list order, shape (n_movies, dim).
+    rows : numpy.ndarray
+        The engine row of every position.
+    positions : numpy.ndarray
+        The position of every engine row, the inverse of `rows`.
+    """
+
+    def __init__(self, components, centroids, offsets, vectors, rows, positions):
+        self.components = components
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.rows = rows
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, tfidf_matrix, n_components=128, n_lists=None, seed=0):
+        """
+        Reduce a TF-IDF matrix with truncated SVD and index it.
+
+        Parameters
+        ----------
+        tfidf_matrix : scipy.sparse.csr.csr_matrix
+            The L2-normalised TF-IDF matrix, one row per movie.
+        n_components : int, optional
+            The dimension of the reduced vectors. Default is 128.
+        n_lists : int, optional
+            The number of inverted lists. Default is about the
+            square root of the number of movies.
+        seed : int, optional
+            The random seed. Default is 0.
+
+        Returns
+        -------
+        AnnIndex
+            The index.
+        """
+        n_movies, n_terms = tfidf_matrix.shape
+        n_components = max(1, min(n_components, n_terms - 1, n_movies - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=seed)
+        vectors = unit_rows(svd.fit_transform(tfidf_matrix)).astype(np.float32)
+        logging.info(
+            f'SVD kept {svd.explained_variance_ratio_.sum():.1%} of the variance '
+            f'with {n_components} components'
+        )
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_movies))
+        n_lists = max(1, min(n_lists, n_movies))
+        centroids = spherical_kmeans(vectors, n_lists, seed=seed)
+        assignment = np.concatenate([
+            np.argmax(vectors[start:start + 4096] @ centroids.T, axis=1)
+            for start in range(0, n_movies, 4096)
+        ])
+
+        rows = np.argsort(assignment, kind="stable")
+        positions = np.empty(n_movies, dtype=np.int64)
+        positions[rows] = np.arange(n_movies)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+        logging.info(f'ANN index built with {n_movies} movies in {n_lists} lists')
+        return cls(
+            svd.components_.astype(np.float32), centroids, offsets,
+            vectors[rows], rows, positions,
+        )
+
+    def update(self, tfidf_matrix, row_map, changed_rows):
+        """
+        Index the changed movies of an updated catalogue.
+
+        The SVD components and the list centroids are kept, movies
+        whose text is unchanged keep their vector and list, and the
+        changed ones are embedded and added to their closest list.
+        Terms added to the vocabulary since the build are ignored.
+        Rebuild the index once the catalogue drifted far from it.
+
+        Parameters
+        ----------
+        tfidf_matrix : scipy.sparse.csr.csr_matrix
+            The updated L2-normalised TF-IDF matrix, one row per movie.
+        row_map : numpy.ndarray
+            The new row of every row the index was built on, -1 for
+            movies that were removed or whose text changed.
+        changed_rows : numpy.ndarray
+            The new rows of the added or changed movies.
+
+        Returns
+        -------
+        AnnIndex
+            A new index over the updated catalogue, this one is
+            left untouched.
+        """
+        changed_rows = np.asarray(changed_rows, dtype=np.int64)
+        kept = np.flatnonzero(row_map[self.rows] >= 0)
+        vectors = self.embed(tfidf_matrix[changed_rows][:, :self.components.shape[1]])
+        lists = np.concatenate([
+            np.repeat(np.arange(self.n_lists), np.diff(self.offsets))[kept],
+            np.argmax(vectors @ self.centroids.T, axis=1),
+        ])
+
+        order = np.argsort(lists, kind="stable")
+        rows = np.concatenate([row_map[self.rows[kept]], changed_rows])[order]
+        positions = np.empty(len(rows), dtype=np.int64)
+        positions[rows] = np.arange(len(rows))
+        offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=self.n_lists), out=offsets[1:])
+        logging.info(
+            f'ANN index updated with {len(changed_rows)} changed movies, '
+            f'{len(rows)} movies in total'
+        )
+        return type(self)(
+            self.components, self.centroids, offsets,
+            np.concatenate([self.vectors[kept], vectors])[order], rows, positions,
+        )
+
+    def embed(self, tfidf_rows) -> np.ndarray:
+        """
+        Project TF-IDF rows, e.g. of new text, into the reduced space.
+
+        Parameters
+        ----------
+        tfidf_rows : scipy.sparse.csr.csr_matrix
+            TF-IDF rows with the vocabulary the index was built on.
+
+        Returns
+        -------
+        numpy.ndarray
+            The unit vectors, one per row.
+        """
+        return unit_rows(np.asarray(tfidf_rows @ self.components.T, dtype=np.float32))
+
+    def search(self, queries, k, nprobe=8, exclude=None, allowed=None):
+        """
+        Find the approximate top-k movies of each query vector.
+
+        Parameters
+        ----------
+        queries : numpy.ndarray
+            Unit query vectors, one per row.
+        k : int
+            Number of movies per query.
+        nprobe : int, optional
+            Number of lists scanned per query. Default is 8.
+        exclude : array-like, optional
+            One engine row per query that must not be returned,
+            e.g. the query movie itself.
+        allowed : numpy.ndarray, optional
+            Boolean mask over engine rows of the movies that may be
+            returned, e.g. those matching a filter.
+
+        Returns
+        -------
+        rows : list of numpy.ndarray
+            The engine rows of each query, best first. There may be
+            fewer than k if the probed lists are small.
+        scores : list of numpy.ndarray
+            The cosine similarity of each row in the reduced space.
+        """
+        queries = np.atleast_2d(queries)
+        nprobe = max(1, min(nprobe, self.n_lists))
+        lists, _ = top_k_rows(queries @ self.centroids.T, nprobe)
+        rows, scores = [], []
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([
+                np.arange(self.offsets[j], self.offsets[j + 1]) for j in lists[i]
+            ])
+            candidate_scores = np.asarray(self.vectors[candidates] @ query, dtype=np.float64)
+            if exclude is not None:
+                candidate_scores[self.rows[candidates] == exclude[i]] = -np.inf
+            if allowed is not None:
+                candidate_scores[~allowed[self.rows[candidates]]] = -np.inf
+            top, top_scores = top_k_rows(candidate_scores, k)
+            keep = np.isfinite(top_scores[0])
+            rows.append(self.rows[candidates[top[0][keep]]])
+            scores.append(top_scores[0][keep])
+        return rows, scores
+
+    def similar_rows(
+        self, movie_rows, tfidf_matrix, top_n=10, nprobe=8, oversample=10, candidates=None
+    ):
+        """
+        Find the rows most similar to each of several movies.
+
+        The index proposes `oversample * top_n` candidates per movie,
+        which are re-ranked by their exact TF-IDF cosine similarity,
+        so the order matches exact search whenever the true
+        neighbours are among the candidates.
+
+        Parameters
+        ----------
+        movie_rows : array-like
+            The rows of the reference movies.
+        tfidf_matrix : scipy.sparse.csr.csr_matrix
+            The L2-normalised TF-IDF matrix the index was built from.
+        top_n : int, optional
+            Number of similar movies per reference movie. Default is 10.
+        nprobe : int, optional
+            Number of lists scanned per movie. Default is 8.
+        oversample : int, optional
+            Candidates re-ranked per returned movie. The reduced
+            vectors blur fine distinctions, so this matters as much
+            as `nprobe` for recall. Default is 10.
+        candidates : numpy.ndarray, optional
+            Sorted rows the recommendations are restricted to. Movies
+            whose probed lists hold too few of them are scored exactly
+            against the candidates instead.
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Array of shape (len(movie_rows), top_n) with the most
+            similar rows of each reference movie, best first. There
+            are fewer columns if fewer candidates are left, see
+            `similar_movie_rows_batch`.
+        scores : numpy.ndarray
+            The exact cosine similarity of each returned row.
+        """
+        movie_rows = np.asarray(movie_rows, dtype=np.intp)
+        queries = self.vectors[self.positions[movie_rows]]
+        allowed = None
+        if candidates is not None:
+            allowed = np.zeros(len(self), dtype=bool)
+            allowed[candidates] = True
+        found, _ = self.search(
+            queries, top_n * oversample, nprobe, exclude=movie_rows, allowed=allowed
+        )
+        top_n = max(min(top_n, len(self) - 1), 0)
+        if candidates is not None:
+            top_n = min(top_n, len(candidates))
+        rows = np.full((len(movie_rows), top_n), -1, dtype=np.intp)
+        scores = np.full((len(movie_rows), top_n), -np.inf)
+        for i, (row, candidate_rows) in enumerate(zip(movie_rows, found)):
+            wanted = top_n
+            if candidates is not None:
+                # A reference movie among the candidates is never returned
+                wanted = min(top_n, len(candidates) - int(allowed[row]))
+            if len(candidate_rows) < wanted:
+                # Too few candidates in the probed lists, score this one exactly
+                exact_rows, exact_scores = similar_movie_rows_batch(
+                    [row], tfidf_matrix, wanted, candidates=candidates
+                )
+                found_rows = exact_rows[0, :wanted]
+                rows[i, :len(found_rows)] = found_rows
+                scores[i, :len(found_rows)] = exact_scores[0, :wanted]
+                continue
+            exact = (tfidf_matrix[row] @ tfidf_matrix[candidate_rows].T).toarray()
+            top, top_scores = top_k_rows(exact, wanted)
+            rows[i, :wanted], scores[i, :wanted] = candidate_rows[top[0]], top_scores[0]
+        return pad_unmatched(rows, scores)
+
+    def save(self, path: str, report=None) -> str:
+        """
+        Save the index as a directory of NumPy arrays.
+
+        It is written to a temporary directory and renamed into
+        place, like the model artifact.
+
+        Parameters
+        ----------
+        path : str
+            The index directory, usually `ann` inside the artifact.
+        report : list, optional
+            A recall report from `recall_at_k` saved with the index.
+
+        Returns
+        -------
+        str
+            The index directory.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        tmp_path = tempfile.mkdtemp(prefix=".ann-", dir=parent)
+        try:
+            for name in ("components", "centroids", "offsets", "vectors", "rows", "positions"):
+                np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+            manifest = {
+                "format": ANN_FORMAT,
+                "n_movies": len(self),
+                "n_lists": self.n_lists,
+                "dim": int(self.vectors.shape[1]),
+                "recall": report or [],
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+            with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2)
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        logging.info(f'ANN index saved to {path}')
+        return path
+
+    @classmethod
+    def load(cls, path: str, mmap=True):
+        """
+        Load an index saved by `save`, memory-mapped by default.
+
+        Parameters
+        ----------
+        path : str
+            The index directory.
+        mmap : bool, optional
+            Whether to memory-map the arrays. Default is True.
+
+        Returns
+        -------
+        AnnIndex
+            The index.
+        """
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ("components", "centroids", "offsets", "vectors", "rows", "positions")
+        }
+        logging.info(f'ANN index loaded from {path}')
+        return cls(**arrays)
+
+
+def recall_at_k(
+    engine, index, k=10, nprobes=(1, 2, 4, 8, 16, 32), oversample=10,
+    n_queries=200, seed=0,
+):
+    """
+    Measure the recall of the ANN index against exact search.
+
+    Parameters
+    ----------
+    engine : RecommenderEngine
+        The engine the index was built from.
+    index : AnnIndex
+        The index.
+    k : int, optional
+        Number of recommendations compared. Default is 10.
+    nprobes : iterable of int, optional
+        The `nprobe` values to measure.
+    oversample : int, optional
+        Candidates re-ranked per recommendation. Default is 10.
+    n_queries : int, optional
+        Number of random movies queried. Default is 200.
+    seed : int, optional
+        The random seed. Default is 0.
+
+    Returns
+    -------
+    list
+        One dict per `nprobe` with the mean "recall" of the exact
+        top-k and the mean query time in milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(engine), min(n_queries, len(engine)), replace=False)
+    start = time.perf_counter()
+    exact, _ = similar_movie_rows_batch(queries, engine.tfidf_matrix, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        start = time.perf_counter()
+        approximate, _ = index.similar_rows(
+            queries, engine.tfidf_matrix, k, nprobe, oversample
+        )
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = [
+            len(np.intersect1d(found, expected))
+            for found, expected in zip(approximate, exact)
+        ]
+        report.append({
+            "nprobe": nprobe,
+            "oversample": oversample,
+            "recall": round(float(np.sum(hits) / exact.size), 4),
+            "query_ms": round(elapsed_ms, 3),
+            "exact_query_ms": round(exact_ms, 3),
+        })
+        logging.info(f'ANN recall@{k} with nprobe={nprobe}: {report[-1]}')
+    return report
+
+
+if __name__ == "__main__":
+    # Build the ANN index of the current artifact offline, with its recall report
+    from .artifact import load_or_build_engine, find_artifact
+
+    engine = load_or_build_engine()
+    path = find_artifact(engine.source_checksum, engine.stop_words)
+    if path is None:
+        raise SystemExit("No model artifact to index, build one with python -m app.artifact")
+    index = AnnIndex.build(engine.tfidf_matrix)
+    report = recall_at_k(engine, index) + recall_at_k(engine, index, oversample=25)
+    index.save(os.path.join(path, "ann"), report)
+    print(json.dumps(report, indent=2))
@@ -1,10 +1,146 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, field_validator
-from .recommender import get_recommendation
-from fastapi.responses import JSONResponse
-import json
+import asyncio
+import contextlib
+import hmac
+import time
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field, field_validator
+from .artifact import load_or_build_engine
+from .cache import RecommendationCache
+from .database import get_database
+from .config import (
+    ADMIN_TOKEN,
+    CACHE_SIZE,
+    CACHE_TTL,
+    COALESCE_REQUESTS,
+    COMPUTE_QUEUE,
+    COMPUTE_WORKERS,
+    RELOAD_INTERVAL,
+    RETRY_AFTER,
+)
+from .engine import RecommenderEngine
+from .filters import MovieFilter
+from .ranking import HybridWeights
+from .pool import ComputePool, PoolSaturated
+from .recommender import (
+    get_batch_recommendations,
+    get_recommendation,
+    get_text_recommendation,
+    recommendation_key,
+)
+from .reloader import ModelReloader
+from .singleflight import SingleFlight
+from .telemetry import TELEMETRY, start_request_timing, timing_header
+from .schemas import (
+    BatchRecommendationResult,
+    ModelJSONResponse,
+    RecommendationResult,
+    TextRecommendationResult,
+)
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the recommender engine once and share it across requests,
+    swapping in new versions as the reloader builds them.
+    """
+    app.state.engine = load_or_build_engine("english")
+    app.state.reloader = ModelReloader(
+        app.state.engine,
+        "english",
+        on_swap=lambda engine: setattr(app.state, "engine", engine),
+    )
+    app.state.cache = RecommendationCache(CACHE_SIZE, CACHE_TTL or None)
+    app.state.pool = ComputePool(COMPUTE_WORKERS, COMPUTE_QUEUE, RETRY_AFTER)
+    app.state.flights = SingleFlight()
+    watcher = None
+    if RELOAD_INTERVAL > 0:
+        watcher = asyncio.create_task(app.state.reloader.watch(RELOAD_INTERVAL))
+    yield
+    if watcher is not None:
+        watcher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await watcher
+    app.state.pool.shutdown()
+    get_database().close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def get_engine(request: Request, response: Response) -> RecommenderEngine:
+    """
+    Dependency returning the serving engine.
+
+    The request keeps this engine even if a reload swaps in a new
+    one meanwhile, and its version is sent in X-Model-Version.
+    """
+    engine = request.app.state.engine
+    response.headers["X-Model-Version"] = engine.version
+    return engine
+
+
+def version_header(engine: RecommenderEngine) -> dict:
+    """X-Model-Version header for endpoints that build their own response."""
+    return {"X-Model-Version": engine.version}
+
+
+async def get_cache(request: Request) -> RecommendationCache:
+    """Dependency returning the shared recommendation cache."""
+    return request.app.state.cache
+
+
+async def get_pool(request: Request) -> ComputePool:
+    """Dependency returning the pool that runs the scoring work."""
+    return request.app.state.pool
+
+
+async def get_flights(request: Request) -> SingleFlight:
+    """Dependency returning the recommendations being computed."""
+    return request.app.state.flights
+
+
+async def coalesced(flights: SingleFlight, key, factory):
+    """
+    Await `factory()`, sharing it with concurrent requests of the same
+    key unless coalescing is turned off.
+    """
+    if not COALESCE_REQUESTS:
+        return await factory()
+    return await flights.run(key, factory)
+
+
+@app.middleware("http")
+async def record_timing(request: Request, call_next):
+    """
+    Count requests and time them per endpoint. Clients sending an
+    X-Timing request header get the time spent in every stage of
+    their request back in an X-Timing response header.
+    """
+    timings = start_request_timing()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    # The route template keeps the endpoint label bounded, unlike the raw path
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", "unmatched")
+    TELEMETRY.inc("movie_rec_requests_total", endpoint=endpoint, status=response.status_code)
+    TELEMETRY.observe("movie_rec_request_seconds", elapsed, endpoint=endpoint)
+    if "x-timing" in request.headers:
+        response.headers["X-Timing"] = timing_header(timings, elapsed)
+    return response
+
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    """Ask clients to back off while all workers and queue slots are busy."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many recommendation requests in flight, retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 @app.get("/")
 async def root():
@@ -12,9 +148,26 @@ async def root():
         "message": "Welcome! You can use this API to get movie recommendations based on viewers' votes. Visit /docs for more information and to try it out!"  # noqa E501
     }
 
-class RecommendationRequest(BaseModel):
+class RecommendationFilters(BaseModel):
+    genres: list[str] | None = None
+    year_min: int | None = None
+    year_max: int | None = None
+    min_votes: int | None = None
+    languages: list[str] | None = None
+    hybrid: HybridWeights | None = None
+
+    def movie_filter(self) -> MovieFilter:
+        """The filter the recommendations are restricted to."""
+        return MovieFilter.create(
+            self.genres, self.year_min, self.year_max, self.min_votes, self.languages
+        )
+
+
+class RecommendationRequest(RecommendationFilters):
     movie: str
-    num_rec: int = 10
+    num_rec: int = Field(10, gt=0)
+    movie_id: int | None = None
+    nprobe: int | None = Field(None, gt=0)
 
     @field_validator("movie")
     def format_movie_name(cls, movie_name):
@@ -23,31 +176,355 @@ class RecommendationRequest(BaseModel):
         return movie_name.title()  # Convert to title case e.g. 'star wars' = 'Star Wars'
 
 
-@app.post("/recommendations/")
-def get_movie_recommendations(recommendation_request: RecommendationRequest):
+@app.get("/health")
+async def health(engine: RecommenderEngine = Depends(get_engine)):
+    """
+    Liveness check that never waits on the compute pool.
+
+    Returns:
+    JSON with the status and the number of movies in the catalogue.
+    """
+    return {"status": "ok", "movies": len(engine)}
+
+
+@app.post(
+    "/recommendations/",
+    response_model=RecommendationResult,
+    response_class=ModelJSONResponse,
+    responses={404: {"description": "Movie not found"}, 429: {"description": "Server at capacity"}},
+)
+async def get_movie_recommendations(
+    recommendation_request: RecommendationRequest,
+    engine: RecommenderEngine = Depends(get_engine),
+    cache: RecommendationCache = Depends(get_cache),
+    pool: ComputePool = Depends(get_pool),
+    flights: SingleFlight = Depends(get_flights),
+):
     """
     Get movie recommendations for a given movie.
 
     Parameters:
     - movie: The name of the movie for which you want recommendations.
     - num_rec: The number of movie recommendations you want. Default is 10.
+    - movie_id: Optional id of the movie, to pick one of several movies sharing a title (see /titles/search).
+    - genres: Optional genres, recommend only movies with at least one of them.
+    - year_min, year_max: Optional inclusive range of release years.
+    - min_votes: Optional minimum vote count.
+    - languages: Optional original language codes, e.g. ["en", "fr"].
+    - hybrid: Optional weights to re-rank the most similar movies by a blend of
+      "similarity", "popularity", "quality" (smoothed vote average) and "votes"
+      (closeness of vote count), e.g. {"similarity": 1, "quality": 0.5}.
+    - nprobe: Optional number of index lists scanned when the server searches an
+      approximate nearest-neighbour index, higher is slower and closer to exact.
+      Defaults to MOVIE_REC_ANN_NPROBE; ignored when recommendations are exact.
 
     Returns:
-    JSON containing recommended movies and metrics.
+    JSON containing recommended movies and metrics. Responds with 429 and
+    a Retry-After header while the server is at capacity. Identical
+    requests arriving while one is computed wait for its result.
     """
-    recommendations = get_recommendation(
-        recommendation_request.movie,
+    movie_filter = recommendation_request.movie_filter()
+    key = (
+        "recommendations",
+        engine.version,
+        recommendation_key(
+            recommendation_request.movie,
+            recommendation_request.movie_id,
+            movie_filter,
+            recommendation_request.hybrid,
+            recommendation_request.nprobe,
+        ),
         recommendation_request.num_rec,
-        "english",
+    )
+    result = await coalesced(
+        flights,
+        key,
+        lambda: pool.run(
+            get_recommendation,
+            recommendation_request.movie,
+            recommendation_request.num_rec,
+            "english",
+            engine=engine,
+            cache=cache,
+            movie_id=recommendation_request.movie_id,
+            movie_filter=movie_filter,
+            weights=recommendation_request.hybrid,
+            nprobe=recommendation_request.nprobe,
+        ),
     )
 
-    if isinstance(recommendations, str):
-        recommendations = json.loads(recommendations)
-
-    if not recommendations:
+    if result is None:
         raise HTTPException(
             status_code=404,
             detail="Movie not found or no recommendations available",  # noqa E501
         )
 
-    return JSONResponse(content=recommendations)
\ No newline at end of file
+    # Returned as a response so the result is serialised exactly once
+    return ModelJSONResponse(result, headers=version_header(engine))
+
+
+class BatchRecommendationRequest(RecommendationFilters):
+    movies: list[str]
+    num_rec: int = Field(10, gt=0)
+    nprobe: int | None = Field(None, gt=0)
+
+    @field_validator("movies")
+    def format_movie_names(cls, movie_names):
+        """Ensure every movie name is formatted with the
+        first letter capitalized."""
+        return [movie_name.title() for movie_name in movie_names]
+
+
+@app.post(
+    "/recommendations/batch",
+    response_model=BatchRecommendationResult,
+    response_model_exclude_none=True,
+    response_class=ModelJSONResponse,
+    responses={429: {"description": "Server at capacity"}},
+)
+async def get_batch_movie_recommendations(
+    batch_request: BatchRecommendationRequest,
+    engine: RecommenderEngine = Depends(get_engine),
+    pool: ComputePool = Depends(get_pool),
+    flights: SingleFlight = Depends(get_flights),
+):
+    """
+    Get movie recommendations for many movies in one request.
+
+    Parameters:
+    - movies: The names of the movies for which you want recommendations.
+    - num_rec: The number of movie recommendations you want per movie. Default is 10.
+    - genres, year_min, year_max, min_votes, languages: Optional filters, see /recommendations/.
+    - hybrid: Optional ranking weights, see /recommendations/.
+    - nprobe: Optional index lists scanned per movie, see /recommendations/.
+
+    Returns:
+    JSON with one result per movie, in request order. Movies that are
+    not found, or left without recommendations by the filters, get an
+    "error" instead of recommendations and metrics.
+    Responds with 429 and a Retry-After header while the server is at capacity.
+    """
+    movie_filter = batch_request.movie_filter()
+    key = (
+        "batch",
+        engine.version,
+        tuple(recommendation_key(movie) for movie in batch_request.movies),
+        movie_filter.key(),
+        batch_request.hybrid.key() if batch_request.hybrid else "",
+        batch_request.nprobe,
+        batch_request.num_rec,
+    )
+    result = await coalesced(
+        flights,
+        key,
+        lambda: pool.run(
+            get_batch_recommendations,
+            batch_request.movies,
+            batch_request.num_rec,
+            "english",
+            engine=engine,
+            movie_filter=movie_filter,
+            weights=batch_request.hybrid,
+            nprobe=batch_request.nprobe,
+        ),
+    )
+
+    return ModelJSONResponse(result, headers=version_header(engine))
+
+
+class TextRecommendationRequest(RecommendationFilters):
+    query: str
+    num_rec: int = Field(10, gt=0)
+
+
+@app.post(
+    "/recommendations/text",
+    response_model=TextRecommendationResult,
+    response_class=ModelJSONResponse,
+    responses={
+        404: {"description": "No movie matches the query"},
+        429: {"description": "Server at capacity"},
+    },
+)
+async def get_text_movie_recommendations(
+    text_request: TextRecommendationRequest,
+    engine: RecommenderEngine = Depends(get_engine),
+    pool: ComputePool = Depends(get_pool),
+    flights: SingleFlight = Depends(get_flights),
+):
+    """
+    Get movie recommendations for a free-text description instead of a movie.
+
+    Parameters:
+    - query: What you want to watch, e.g. "heist movies with a twist".
+    - num_rec: The number of movie recommendations you want. Default is 10.
+    - genres, year_min, year_max, min_votes, languages: Optional filters, see /recommendations/.
+    - hybrid: Optional ranking weights, see /recommendations/. Only "similarity",
+      "popularity" and "quality" apply, as there is no movie to compare votes with.
+
+    Returns:
+    JSON with the recommended movies and their similarity to the query.
+    Responds with 404 if no movie shares a word with the query, and with
+    429 and a Retry-After header while the server is at capacity.
+    """
+    if text_request.hybrid and text_request.hybrid.votes:
+        raise HTTPException(
+            status_code=422, detail="The votes weight needs a movie, use /recommendations/"
+        )
+    movie_filter = text_request.movie_filter()
+    key = (
+        "text",
+        engine.version,
+        text_request.query,
+        movie_filter.key(),
+        text_request.hybrid.key() if text_request.hybrid else "",
+        text_request.num_rec,
+    )
+    result = await coalesced(
+        flights,
+        key,
+        lambda: pool.run(
+            get_text_recommendation,
+            text_request.query,
+            text_request.num_rec,
+            "english",
+            engine=engine,
+            movie_filter=movie_filter,
+            weights=text_request.hybrid,
+        ),
+    )
+
+    if result is None:
+        raise HTTPException(status_code=404, detail="No movie matches the query")
+
+    return ModelJSONResponse(result, headers=version_header(engine))
+
+
+@app.get("/titles/search")
+def search_titles(
+    q: str,
+    limit: int = Query(10, ge=1, le=100),
+    engine: RecommenderEngine = Depends(get_engine),
+):
+    """
+    Search movie titles for autocomplete and typo correction.
+
+    Parameters:
+    - q: The full, partial or misspelt movie title.
+    - limit: The maximum number of titles to return, from 1 to 100. Default is 10.
+
+    Returns:
+    JSON with the matching titles. Each match says whether it is an exact,
+    prefix or fuzzy match and lists the ids of every movie with that title,
+    so remakes can be told apart by passing movie_id to /recommendations/.
+    """
+    return {"query": q, "matches": engine.search_titles(q, limit)}
+
+
+@app.get("/model/version")
+async def model_version(request: Request):
+    """
+    Get the model version serving requests.
+
+    Returns:
+    JSON with the version, its number of movies and changelog run, when it
+    was loaded, whether a reload is running and how previous reloads went.
+    """
+    return request.app.state.reloader.status()
+
+
+@app.post("/model/reload", status_code=202)
+async def reload_model(
+    request: Request,
+    force: bool = False,
+    x_admin_token: str | None = Header(default=None),
+):
+    """
+    Announce a new data or model version.
+
+    The new engine is built in the background and swapped in once it passes
+    smoke queries; requests keep being served by the current one meanwhile.
+
+    Parameters:
+    - force: Rebuild even if the database did not change. Default is False.
+    - X-Admin-Token header: Must match MOVIE_REC_ADMIN_TOKEN. Reloads are
+      refused while no token is configured.
+
+    Returns:
+    JSON saying whether a reload was started, with the current status.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=403,
+            detail="Model reloads are disabled, set MOVIE_REC_ADMIN_TOKEN to enable them",
+        )
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    reloader = request.app.state.reloader
+    started = reloader.reload(force=force)
+    return {"started": started, **reloader.status()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """
+    Expose request, stage, cache and model metrics to Prometheus.
+
+    Returns:
+    The metrics in the Prometheus text exposition format.
+    """
+    state = request.app.state
+    engine = state.engine
+    reloader_status = state.reloader.status()
+    cache_stats = state.cache.stats()
+    flight_stats = state.flights.stats()
+    gauges = {
+        "movie_rec_model_info": (
+            "gauge", "The model version serving requests.", [({"version": engine.version}, 1)]
+        ),
+        "movie_rec_catalogue_movies": (
+            "gauge", "Movies in the serving catalogue.", [({}, len(engine))]
+        ),
+        "movie_rec_model_run_id": (
+            "gauge", "Last changelog run applied to the model.", [({}, engine.run_id)]
+        ),
+        "movie_rec_model_reloads_total": (
+            "counter", "Model versions swapped in.", [({}, reloader_status["reloads"])]
+        ),
+        "movie_rec_model_reload_failures_total": (
+            "counter", "Model reloads that failed.", [({}, reloader_status["failures"])]
+        ),
+        "movie_rec_cache_entries": (
+            "gauge", "Entries in the recommendation cache.", [({}, cache_stats["size"])]
+        ),
+        "movie_rec_cache_hits_total": (
+            "counter", "Recommendation cache hits.", [({}, cache_stats["hits"])]
+        ),
+        "movie_rec_cache_misses_total": (
+            "counter", "Recommendation cache misses.", [({}, cache_stats["misses"])]
+        ),
+        "movie_rec_cache_evictions_total": (
+            "counter", "Recommendation cache evictions.", [({}, cache_stats["evictions"])]
+        ),
+        "movie_rec_pool_pending": (
+            "gauge", "Jobs running or waiting in the compute pool.", [({}, state.pool.pending)]
+        ),
+        "movie_rec_pool_rejected_total": (
+            "counter", "Jobs rejected by the saturated compute pool.", [({}, state.pool.rejected)]
+        ),
+        "movie_rec_coalesce_leaders_total": (
+            "counter", "Recommendation computations run for coalescable requests.",
+            [({}, flight_stats["leaders"])],
+        ),
+        "movie_rec_coalesced_requests_total": (
+            "counter", "Requests served by waiting on an identical request in flight.",
+            [({}, flight_stats["coalesced"])],
+        ),
+        "movie_rec_coalesce_in_flight": (
+            "gauge", "Distinct recommendation requests being computed.",
+            [({}, flight_stats["in_flight"])],
+        ),
+    }
+    return PlainTextResponse(
+        TELEMETRY.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,385 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .ann import AnnIndex
+from .catalogue import Catalogue, StringColumn
+from .config import ANN_NPROBE, ANN_OVERSAMPLE, ARTIFACT_DIR
+from .engine import RecommenderEngine
+from .filters import Facets
+from .telemetry import span
+from .textmodel import IncrementalTfidf
+from .recommenderhelper import get_source_checksum
+
+# Bump when the files written by `save_artifact` change
+ARTIFACT_FORMAT = 4
+
+
+def artifact_version(source_checksum: str, stop_words="english", run_id=0) -> str:
+    """
+    Derive the artifact version from what the model is built from.
+
+    Parameters
+    ----------
+    source_checksum : str
+        The checksum of the source table, see `get_source_checksum`.
+
+    stop_words : str, optional
+        The language of stop words of the vectorizer.
+        Default is "english".
+
+    run_id : int, optional
+        The last changelog run applied on top of the source table,
+        see `RecommenderEngine.refresh`. Default is 0, none.
+
+    Returns
+    -------
+    str
+        A short version string that changes whenever the
+        source data, the stop words or the artifact format change,
+        suffixed with "+run<run_id>" once changelog runs are applied.
+    """
+    key = f"{ARTIFACT_FORMAT}:{stop_words}:{source_checksum}"
+    version = f"v{ARTIFACT_FORMAT}-{hashlib.sha256(key.encode()).hexdigest()[:16]}"
+    return f"{version}+run{run_id}" if run_id else version
+
+
+def save_artifact(engine, source_checksum: str, root=ARTIFACT_DIR) -> str:
+    """
+    Save a fitted engine as a versioned artifact directory.
+
+    The directory holds the vectorizer vocabulary and IDF weights,
+    the CSR TF-IDF matrix and its transpose as raw arrays, the term
+    counts of the text model if any, the titles, ids, metric and
+    filter columns, the precomputed neighbours and the ANN index if
+    any, and a manifest tagged with the checksum of the source table
+    and the changelog run of the engine, which are both part of the
+    version. It is written to a temporary directory first
+    and renamed into place, so concurrent writers never expose a
+    half-written artifact.
+
+    Parameters
+    ----------
+    engine : RecommenderEngine
+        The fitted engine to save.
+
+    source_checksum : str
+        The checksum of the source table the engine was built from.
+
+    root : str, optional
+        The directory holding all artifact versions.
+
+    Returns
+    -------
+    str
+        The path of the artifact directory.
+    """
+    version = artifact_version(source_checksum, engine.stop_words, engine.run_id)
+    path = os.path.join(root, version)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(root, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f".{version}-", dir=root)
+    try:
+        matrix = sparse.csr_matrix(engine.tfidf_matrix)
+        np.save(os.path.join(tmp_path, "tfidf_data.npy"), matrix.data)
+        np.save(os.path.join(tmp_path, "tfidf_indices.npy"), matrix.indices)
+        np.save(os.path.join(tmp_path, "tfidf_indptr.npy"), matrix.indptr)
+        # Exact scoring reads the matrix by term, shared between workers too
+        term_matrix = engine.term_matrix
+        np.save(os.path.join(tmp_path, "term_data.npy"), term_matrix.data)
+        np.save(os.path.join(tmp_path, "term_indices.npy"), term_matrix.indices)
+        np.save(os.path.join(tmp_path, "term_indptr.npy"), term_matrix.indptr)
+        np.save(
+            os.path.join(tmp_path, "idf.npy"), engine.vectorizer.idf_
+        )
+        if engine.text_model is not None:
+            # Same rows and sparsity as the TF-IDF matrix, so only the values
+            np.save(
+                os.path.join(tmp_path, "tfidf_counts.npy"),
+                engine.text_model.counts.data,
+            )
+
+        catalogue = engine.catalogue
+        np.save(os.path.join(tmp_path, "titles.npy"), catalogue.titles.buffer)
+        np.save(os.path.join(tmp_path, "title_offsets.npy"), catalogue.titles.offsets)
+        np.save(os.path.join(tmp_path, "ids.npy"), catalogue.ids)
+        np.save(os.path.join(tmp_path, "metrics.npy"), catalogue.metrics)
+        facets = catalogue.facets
+        np.save(os.path.join(tmp_path, "genres.npy"), facets.genres)
+        np.save(os.path.join(tmp_path, "years.npy"), facets.years)
+        np.save(os.path.join(tmp_path, "languages.npy"), facets.languages)
+        if engine.neighbors is not None:
+            np.save(os.path.join(tmp_path, "neighbors.npy"), engine.neighbors)
+            np.save(
+                os.path.join(tmp_path, "neighbor_scores.npy"),
+                engine.neighbor_scores,
+            )
+        if engine.ann_index is not None:
+            engine.ann_index.save(os.path.join(tmp_path, "ann"))
+
+        vocabulary = engine.vectorizer.get_feature_names_out().tolist()
+        with open(os.path.join(tmp_path, "vocabulary.json"), "w") as f:
+            json.dump(vocabulary, f)
+
+        manifest = {
+            "version": version,
+            "format": ARTIFACT_FORMAT,
+            "source_checksum": source_checksum,
+            "run_id": int(engine.run_id),
+            "stop_words": engine.stop_words,
+            "n_movies": len(engine),
+            "n_terms": len(vocabulary),
+            "shape": list(matrix.shape),
+            "genre_names": facets.genre_names,
+            "language_names": facets.language_names,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        os.rename(tmp_path, path)
+        logging.info(f'Model artifact saved to {path}')
+    except OSError as e:
+        # Another worker may have renamed the same version into place first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.exists(path):
+            raise
+        logging.info(f'Model artifact {version} already saved: {e}')
+    return path
+
+
+def read_manifest(path: str) -> dict:
+    """
+    Read the manifest of an artifact directory.
+
+    Parameters
+    ----------
+    path : str
+        The artifact directory.
+
+    Returns
+    -------
+    dict
+        The manifest, or an empty dict if it is missing or unreadable.
+    """
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_artifact(path: str, mmap=True, nprobe=ANN_NPROBE) -> RecommenderEngine:
+    """
+    Load an engine saved by `save_artifact`.
+
+    The NumPy arrays are memory-mapped read-only by default, so every
+    worker on a host shares the same pages and nothing is refitted.
+    The engine keeps the changelog run it was saved at and, if the
+    artifact has term counts, an updatable text model, so it can
+    catch up with later runs, see `RecommenderEngine.refresh`.
+
+    Parameters
+    ----------
+    path : str
+        The artifact directory.
+
+    mmap : bool, optional
+        Whether to memory-map the arrays. Default is True.
+
+    nprobe : int, optional
+        If positive and the artifact has an ANN index built by
+        `python -m app.ann`, search it scanning `nprobe` lists per
+        query instead of scoring every movie. The index is attached
+        either way, so incremental updates carry it over to the next
+        artifact. Default is ANN_NPROBE.
+
+    Returns
+    -------
+    RecommenderEngine
+        The engine stored in the artifact.
+    """
+    manifest = read_manifest(path)
+    mmap_mode = "r" if mmap else None
+
+    def load(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    tfidf_matrix = sparse.csr_matrix(
+        (load("tfidf_data"), load("tfidf_indices"), load("tfidf_indptr")),
+        shape=tuple(manifest["shape"]),
+        copy=False,
+    )
+    term_matrix = sparse.csr_matrix(
+        (load("term_data"), load("term_indices"), load("term_indptr")),
+        shape=tfidf_matrix.shape[::-1],
+        copy=False,
+    )
+
+    with open(os.path.join(path, "vocabulary.json")) as f:
+        vocabulary = json.load(f)
+    vocabulary = {term: column for column, term in enumerate(vocabulary)}
+    vectorizer = TfidfVectorizer(stop_words=manifest["stop_words"], vocabulary=vocabulary)
+    vectorizer.idf_ = np.asarray(load("idf"))
+
+    # The titles stay encoded, so nothing is copied out of the mapping
+    catalogue = Catalogue(
+        load("ids"),
+        StringColumn(load("titles"), load("title_offsets")),
+        load("metrics"),
+        Facets(
+            load("genres"), manifest["genre_names"], load("years"),
+            load("languages"), manifest["language_names"],
+        ),
+    )
+    engine = RecommenderEngine(
+        catalogue, vectorizer, tfidf_matrix, manifest["stop_words"], normalize=False
+    )
+    engine.term_matrix = term_matrix
+    engine.source_checksum = manifest["source_checksum"]
+    engine.version = manifest["version"]
+    engine.run_id = manifest.get("run_id", 0)
+    if os.path.exists(os.path.join(path, "tfidf_counts.npy")):
+        counts = sparse.csr_matrix(
+            (load("tfidf_counts"), tfidf_matrix.indices, tfidf_matrix.indptr),
+            shape=tfidf_matrix.shape,
+            copy=False,
+        )
+        engine.text_model = IncrementalTfidf(manifest["stop_words"], vocabulary).restore(
+            counts, catalogue.ids, weights=tfidf_matrix.data, idf=vectorizer.idf_
+        )
+    if os.path.exists(os.path.join(path, "neighbors.npy")):
+        engine.neighbors = load("neighbors")
+        engine.neighbor_scores = load("neighbor_scores")
+    ann_path = os.path.join(path, "ann")
+    if os.path.exists(os.path.join(ann_path, "manifest.json")):
+        engine.ann_index = AnnIndex.load(ann_path, mmap)
+        engine.nprobe = nprobe
+        engine.ann_oversample = ANN_OVERSAMPLE
+    logging.info(f'Model artifact loaded from {path}')
+    return engine
+
+
+def find_artifact(source_checksum: str, stop_words="english", root=ARTIFACT_DIR):
+    """
+    Find the artifact built from the current source table, the one
+    with the most changelog runs applied if there are several.
+
+    Parameters
+    ----------
+    source_checksum : str
+        The checksum of the current source table.
+
+    stop_words : str, optional
+        The language of stop words of the vectorizer.
+        Default is "english".
+
+    root : str, optional
+        The directory holding all artifact versions.
+
+    Returns
+    -------
+    str or None
+        The artifact directory, or None if there is no
+        artifact for this checksum, i.e. all artifacts are stale.
+    """
+    version = artifact_version(source_checksum, stop_words)
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return None
+    found, found_run = None, -1
+    for name in names:
+        if name != version and not name.startswith(f"{version}+run"):
+            continue
+        path = os.path.join(root, name)
+        manifest = read_manifest(path)
+        run_id = manifest.get("run_id", 0)
+        if (
+            manifest.get("source_checksum") == source_checksum
+            and name == artifact_version(source_checksum, stop_words, run_id)
+            and run_id > found_run
+        ):
+            found, found_run = path, run_id
+    return found
+
+
+def load_or_build_engine(stop_words="english", root=ARTIFACT_DIR, nprobe=ANN_NPROBE):
+    """
+    Load the engine from a fresh artifact, or build and save one,
+    then apply the changelog runs the artifact or the source table
+    do not reflect yet, so incremental updates survive a restart.
+    The updated engine is saved as an artifact of its run too and
+    served from it, so the next start does not replay the same runs.
+
+    Parameters
+    ----------
+    stop_words : str, optional
+        The language of stop words of the vectorizer.
+        Default is "english".
+
+    root : str, optional
+        The directory holding all artifact versions.
+
+    nprobe : int, optional
+        Lists scanned per query if the artifact has an ANN index,
+        see `load_artifact`. Default is ANN_NPROBE.
+
+    Returns
+    -------
+    RecommenderEngine
+        The engine for the current source table.
+    """
+    source_checksum = get_source_checksum()
+    path = find_artifact(source_checksum, stop_words, root) if source_checksum else None
+    engine = None
+    if path is not None:
+        try:
+            with span("artifact_load"):
+                engine = load_artifact(path, nprobe=nprobe)
+        except Exception as e:
+            logging.error(f"An error occurred while loading {path}: {e}")
+
+    if engine is None:
+        engine = RecommenderEngine.from_database(stop_words)
+        if source_checksum:
+            engine.source_checksum = source_checksum
+            engine.version = artifact_version(source_checksum, stop_words)
+        if source_checksum and len(engine):
+            try:
+                save_artifact(engine, source_checksum, root)
+            except Exception as e:
+                logging.error(f"An error occurred while saving the artifact: {e}")
+
+    if engine.text_model is None:
+        return engine
+    try:
+        refreshed = engine.refresh()
+    except Exception as e:
+        logging.error(f"An error occurred while applying movie changes: {e}")
+        return engine
+    if refreshed is engine or not source_checksum:
+        return refreshed
+    try:
+        # Serve from the saved arrays, which are shared between workers
+        path = save_artifact(refreshed, source_checksum, root)
+        with span("artifact_load"):
+            return load_artifact(path, nprobe=nprobe)
+    except Exception as e:
+        logging.error(f"An error occurred while saving the updated artifact: {e}")
+    return refreshed
+
+
+if __name__ == "__main__":
+    # Build the artifact ahead of time so serving processes start fast
+    load_or_build_engine()
@@ -0,0 +1,150 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+class RecommendationCache:
+    """
+    Bounded in-process cache for recommendation results.
+
+    Entries are keyed on (title, stop_words) and remember the
+    `num_rec` they were computed for, so a cached top-20 also
+    answers requests for the top-5. Least recently used entries
+    are evicted once `maxsize` is reached and, if `ttl` is set,
+    entries expire `ttl` seconds after they were stored.
+
+    The cache is bound to one recommender engine at a time and is
+    cleared whenever a different engine is bound, so results never
+    outlive the model or data they were computed from.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of entries. Default is 1024.
+
+    ttl : float, optional
+        Seconds an entry stays valid. Default is None, no expiry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._engine_ref = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bind(self, engine):
+        """
+        Bind the cache to an engine, clearing it if the engine changed.
+
+        Parameters
+        ----------
+        engine : RecommenderEngine
+            The engine the cached results are computed with.
+        """
+        with self._lock:
+            if self._engine_ref is not None and self._engine_ref() is engine:
+                return
+            if self._engine_ref is not None:
+                self._clear()
+            self._engine_ref = weakref.ref(engine)
+
+    def invalidate(self):
+        """Drop all entries, e.g. after the model or data is reloaded."""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self.invalidations += 1
+
+    def get(self, title: str, num_rec: int, stop_words="english"):
+        """
+        Get a cached result covering at least `num_rec` recommendations.
+
+        Parameters
+        ----------
+        title : str
+            The normalised movie title.
+        num_rec : int
+            The number of recommendations needed.
+        stop_words : str, optional
+            The language of stop words. Default is "english".
+
+        Returns
+        -------
+        object or None
+            The cached value, which may hold more than `num_rec`
+            recommendations, or None on a miss.
+        """
+        key = (title, stop_words)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_num_rec, value, expires_at = entry
+                if expires_at is not None and expires_at <= time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                elif cached_num_rec >= num_rec:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, title: str, num_rec: int, value, stop_words="english"):
+        """
+        Store a result for `num_rec` recommendations.
+
+        An existing entry for more recommendations is kept.
+
+        Parameters
+        ----------
+        title : str
+            The normalised movie title.
+        num_rec : int
+            The number of recommendations `value` holds.
+        value : object
+            The result to cache.
+        stop_words : str, optional
+            The language of stop words. Default is "english".
+        """
+        key = (title, stop_words)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > num_rec:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (num_rec, value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        Returns
+        -------
+        dict
+            The size, hits, misses, evictions and invalidations.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,377 @@
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .filters import Facets
+from .recommenderhelper import METRIC_COLUMNS
+
+
+def encode_strings(values):
+    """
+    Pack strings into one contiguous UTF-8 buffer with offsets,
+    which unlike an object array can be memory-mapped.
+
+    Parameters
+    ----------
+    values : iterable of str
+        The strings to pack.
+
+    Returns
+    -------
+    buffer : numpy.ndarray
+        The concatenated UTF-8 bytes as uint8.
+
+    offsets : numpy.ndarray
+        String i is `buffer[offsets[i]:offsets[i + 1]]`.
+    """
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return buffer, offsets
+
+
+def decode_strings(buffer, offsets) -> list:
+    """
+    Unpack strings packed by `encode_strings`.
+
+    Parameters
+    ----------
+    buffer : numpy.ndarray
+        The concatenated UTF-8 bytes.
+
+    offsets : numpy.ndarray
+        The start of every string plus the end of the last one.
+
+    Returns
+    -------
+    list
+        The unpacked strings.
+    """
+    raw = bytes(buffer)
+    return [
+        raw[start:stop].decode("utf-8")
+        for start, stop in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+class StringColumn:
+    """
+    Read-only column of strings stored as one UTF-8 buffer with offsets.
+
+    Indexing decodes only the strings asked for: an integer gives a
+    `str`, a slice or an array of rows gives an object array, so it
+    can stand in for the object array of titles it replaces.
+
+    Parameters
+    ----------
+    buffer : numpy.ndarray
+        The concatenated UTF-8 bytes, see `encode_strings`.
+
+    offsets : numpy.ndarray
+        The start of every string plus the end of the last one.
+    """
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_values(cls, values):
+        return cls(*encode_strings(values))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, row) -> str:
+        return bytes(self.buffer[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def __getitem__(self, rows):
+        if isinstance(rows, (int, np.integer)):
+            if rows < 0:
+                rows += len(self)
+            if not 0 <= rows < len(self):
+                raise IndexError(f"row {rows} is out of range")
+            return self._decode(rows)
+        if isinstance(rows, slice):
+            rows = range(*rows.indices(len(self)))
+        rows = np.asarray(rows, dtype=np.intp)
+        values = np.empty(rows.shape, dtype=object)
+        for i, row in enumerate(rows.ravel()):
+            values.flat[i] = self._decode(row)
+        return values
+
+    def __iter__(self):
+        return iter(decode_strings(self.buffer, self.offsets))
+
+    def take(self, rows):
+        """Get a new column holding the given rows, without decoding them."""
+        rows = np.asarray(rows, dtype=np.intp)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return StringColumn(np.asarray(self.buffer)[positions], offsets)
+
+    @property
+    def nbytes(self) -> int:
+        return self.buffer.nbytes + self.offsets.nbytes
+
+
+class Catalogue:
+    """
+    Compact per-movie data needed to serve recommendations.
+
+    Holds the movie ids, the titles as a `StringColumn`, the
+    metrics as float32 and the `Facets` recommendations can be
+    filtered on, in TF-IDF matrix row order. Overviews and the
+    "combined" text are only needed to vectorize the movies and
+    are not kept.
+
+    Parameters
+    ----------
+    ids : numpy.ndarray
+        The movie id of every row.
+
+    titles : StringColumn
+        The lowercase title of every row.
+
+    metrics : numpy.ndarray
+        The popularity, vote average and vote count of every row,
+        shape (n_movies, 3).
+
+    facets : Facets, optional
+        The genres, release years and languages of every row.
+        Default is all unknown.
+    """
+
+    def __init__(self, ids, titles, metrics, facets=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.titles = titles
+        self.metrics = np.asarray(metrics, dtype=np.float32)
+        if facets is None:
+            facets = Facets.from_frame(pd.DataFrame(index=range(len(self.ids))))
+        self.facets = facets
+        self._id_order = None
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        """
+        Build a catalogue from movie data.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The movies, with "id", "title" and metric columns,
+            and the optional columns of `Facets.from_frame`.
+
+        Returns
+        -------
+        Catalogue
+            The catalogue, empty if `df` has no movies.
+        """
+        if df.empty:
+            return cls(
+                np.empty(0, dtype=np.int64),
+                StringColumn.from_values([]),
+                np.empty((0, len(METRIC_COLUMNS)), dtype=np.float32),
+            )
+        return cls(
+            df["id"].to_numpy(np.int64),
+            StringColumn.from_values(df["title"]),
+            df[METRIC_COLUMNS].to_numpy(np.float32),
+            Facets.from_frame(df),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_of(self, ids) -> np.ndarray:
+        """
+        Get the rows of some movie ids without a hash map of all ids.
+
+        Parameters
+        ----------
+        ids : array-like
+            The movie ids.
+
+        Returns
+        -------
+        numpy.ndarray
+            The row of every id, -1 for unknown ids. If an id
+            appears more than once, its first row is returned.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype=np.intp)
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind="stable")
+        sorted_ids = self.ids[self._id_order]
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        found = sorted_ids[positions] == ids
+        return np.where(found, self._id_order[positions], -1).astype(np.intp)
+
+    def take(self, rows):
+        """Get a new catalogue holding the given rows."""
+        rows = np.asarray(rows, dtype=np.intp)
+        return Catalogue(
+            self.ids[rows], self.titles.take(rows), self.metrics[rows], self.facets.take(rows)
+        )
+
+    def upsert(self, other, ids):
+        """
+        Merge in new or updated movies and order the result by `ids`.
+
+        Parameters
+        ----------
+        other : Catalogue
+            The new or updated movies, which win over existing ones.
+        ids : array-like
+            The ids of the merged catalogue, in row order.
+
+        Returns
+        -------
+        Catalogue
+            The merged catalogue.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        from_other = other.rows_of(ids)
+        from_self = self.rows_of(ids)
+        if ((from_other < 0) & (from_self < 0)).any():
+            raise ValueError("Every id must be in one of the catalogues")
+        # Rows of `other` come after the rows of this catalogue
+        rows = np.where(from_other >= 0, len(self) + from_other, from_self)
+        return Catalogue.concat([self, other]).take(rows)
+
+    @classmethod
+    def concat(cls, catalogues):
+        """
+        Join catalogues of different movies, e.g. built batch by batch.
+
+        Parameters
+        ----------
+        catalogues : list of Catalogue
+            The catalogues, at least one.
+
+        Returns
+        -------
+        Catalogue
+            The rows of all of them, in order.
+        """
+        if len(catalogues) == 1:
+            return catalogues[0]
+        # Every title offset is shifted by the bytes of the titles before it
+        shifts = np.cumsum([0] + [int(catalogue.titles.offsets[-1]) for catalogue in catalogues])
+        return cls(
+            np.concatenate([catalogue.ids for catalogue in catalogues]),
+            StringColumn(
+                np.concatenate([catalogue.titles.buffer for catalogue in catalogues]),
+                np.concatenate([
+                    *(catalogue.titles.offsets[:-1] + shift
+                      for catalogue, shift in zip(catalogues, shifts)),
+                    [shifts[-1]],
+                ]),
+            ),
+            np.concatenate([catalogue.metrics for catalogue in catalogues]),
+            catalogues[0].facets.concat(*(catalogue.facets for catalogue in catalogues[1:])),
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """Decode the catalogue into a DataFrame, e.g. for inspection."""
+        return pd.DataFrame({
+            "id": self.ids,
+            "title": list(self.titles),
+            **{
+                column: self.metrics[:, i]
+                for i, column in enumerate(METRIC_COLUMNS)
+            },
+        })
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.ids.nbytes + self.titles.nbytes + self.metrics.nbytes + self.facets.nbytes
+        )
+
+
+def sparse_nbytes(matrix) -> int:
+    """Bytes held by the arrays of a sparse matrix."""
+    if matrix is None:
+        return 0
+    return sum(
+        getattr(matrix, name).nbytes
+        for name in ("data", "indices", "indptr")
+        if hasattr(matrix, name)
+    )
+
+
+def title_index_nbytes(title_index) -> int:
+    """Approximate bytes held by a `TitleIndex`, including its strings."""
+    total = sys.getsizeof(title_index.exact) + sys.getsizeof(title_index.sorted_titles)
+    for title, rows in title_index.exact.items():
+        total += sys.getsizeof(title) + sys.getsizeof(rows) + 28 * len(rows)
+    total += sum(postings.nbytes for postings in title_index.postings.values())
+    total += title_index.title_lengths.nbytes
+    return total
+
+
+def memory_report(engine, frame=None) -> dict:
+    """
+    Report the memory held by a recommender engine, per component.
+
+    Parameters
+    ----------
+    engine : RecommenderEngine
+        The engine to measure.
+
+    frame : pd.DataFrame, optional
+        The full movie DataFrame the engine used to keep, to
+        compare against the compact catalogue.
+
+    Returns
+    -------
+    dict
+        Bytes per component and their total. Memory-mapped arrays
+        count fully although their pages are shared between workers,
+        and the transposed TF-IDF matrix counts even before the first
+        exact search builds it.
+    """
+    report = {
+        "catalogue": engine.catalogue.nbytes,
+        "tfidf_matrix": sparse_nbytes(engine.tfidf_matrix),
+        "term_matrix": sparse_nbytes(engine.term_matrix),
+        "title_index": title_index_nbytes(engine.title_index),
+        "neighbors": sum(
+            array.nbytes for array in (engine.neighbors, engine.neighbor_scores)
+            if array is not None
+        ),
+        "text_model": (
+            engine.text_model.memory_bytes() if engine.text_model is not None else 0
+        ),
+    }
+    report["total"] = sum(report.values())
+    if frame is not None:
+        report["dataframe"] = int(frame.memory_usage(deep=True).sum())
+    return report
+
+
+if __name__ == "__main__":
+    # Compare the DataFrame the engine used to keep with the compact catalogue
+    import json
+
+    from .database import get_database
+    from .engine import RecommenderEngine
+    from .recommenderhelper import create_combined, fetch_frame
+
+    # What the engine used to keep: every column plus the combined text
+    with get_database().cursor() as cursor:
+        frame = fetch_frame(cursor, "SELECT * FROM movie_genre_data")
+    frame["title"] = frame["title"].str.lower()
+    frame = create_combined(frame)
+    engine = RecommenderEngine.from_database()
+    report = memory_report(engine, frame)
+    logging.info(f'Memory report: {report}')
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,39 @@
+import os
+
+# DuckDB database the model is built from
+DATABASE_PATH = os.getenv("MOVIE_REC_DATABASE", "movies_data.duckdb")
+# Seconds an idle read-only connection stays open before the file is released
+DATABASE_LINGER = float(os.getenv("MOVIE_REC_DATABASE_LINGER", "5"))
+
+# Movies read and vectorized per batch when building the model (0 = all at once)
+BUILD_BATCH_SIZE = int(os.getenv("MOVIE_REC_BUILD_BATCH_SIZE", "0"))
+# Processes counting the terms of those batches (1 = in the building process)
+BUILD_WORKERS = int(os.getenv("MOVIE_REC_BUILD_WORKERS", "1"))
+
+# Directory holding the versioned model artifacts
+ARTIFACT_DIR = os.getenv("MOVIE_REC_ARTIFACT_DIR", "artifacts")
+
+# Index lists scanned per query when the artifact has an ANN index (0 = exact search)
+ANN_NPROBE = int(os.getenv("MOVIE_REC_ANN_NPROBE", "0"))
+# ANN candidates re-ranked exactly per recommendation, higher is slower and closer to exact
+ANN_OVERSAMPLE = int(os.getenv("MOVIE_REC_ANN_OVERSAMPLE", "10"))
+
+# Recommendation cache size and entry lifetime in seconds (0 = no expiry)
+CACHE_SIZE = int(os.getenv("MOVIE_REC_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("MOVIE_REC_CACHE_TTL", "0"))
+
+# Threads scoring recommendations, and requests allowed to wait for one
+COMPUTE_WORKERS = int(os.getenv("MOVIE_REC_WORKERS", str(min(4, os.cpu_count() or 1))))
+COMPUTE_QUEUE = int(os.getenv("MOVIE_REC_QUEUE", "32"))
+# Share one computation between concurrent identical requests (0 = off)
+COALESCE_REQUESTS = os.getenv("MOVIE_REC_COALESCE", "1") != "0"
+# Seconds clients are asked to wait when all workers and queue slots are taken
+RETRY_AFTER = int(os.getenv("MOVIE_REC_RETRY_AFTER", "1"))
+
+# Seconds between checks of the database for a new model version (0 = never)
+RELOAD_INTERVAL = float(os.getenv("MOVIE_REC_RELOAD_INTERVAL", "0"))
+# Token required by POST /model/reload in the X-Admin-Token header (empty = disabled)
+ADMIN_TOKEN = os.getenv("MOVIE_REC_ADMIN_TOKEN", "")
+
+# Most similar movies re-ranked per request when hybrid weights are given
+HYBRID_CANDIDATES = int(os.getenv("MOVIE_REC_HYBRID_CANDIDATES", "200"))
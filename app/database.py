@@ -0,0 +1,166 @@
+import contextlib
+import logging
+import os
+import threading
+
+import duckdb
+
+from .config import DATABASE_PATH, DATABASE_LINGER
+
+
+class Database:
+    """
+    Process-wide read-only access to the DuckDB movie database.
+
+    One read-only connection is shared by all threads, each of which
+    gets its own cursor, as DuckDB cursors must not be shared between
+    threads. The connection is opened on first use and closed once it
+    has been idle for `linger` seconds, so the file is not kept locked
+    against the pipeline writing a new version of it. If the file was
+    replaced in the meantime, the next use opens the new one.
+
+    Parameters
+    ----------
+    path : str
+        The database file.
+
+    linger : float, optional
+        Seconds an idle connection stays open. Default is 5.
+    """
+
+    def __init__(self, path, linger=5.0):
+        self.path = path
+        self.linger = linger
+        self.opens = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connection = None
+        self._cursors = []
+        self._signature = None
+        self._active = 0
+        self._timer = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _open(self):
+        signature = self._file_signature()
+        if self._connection is not None and signature == self._signature:
+            return
+        self._close()
+        self._connection = duckdb.connect(self.path, read_only=True)
+        self._signature = signature
+        self.opens += 1
+        logging.info('Connection opened')
+
+    def _close(self):
+        for cursor in self._cursors:
+            cursor.close()
+        self._cursors = []
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            logging.info('Connection closed')
+
+    def _close_if_idle(self):
+        with self._lock:
+            if self._active == 0:
+                self._close()
+
+    @contextlib.contextmanager
+    def cursor(self):
+        """
+        Borrow this thread's cursor on the shared connection.
+
+        Yields
+        ------
+        duckdb.DuckDBPyConnection
+            A cursor for this thread, valid inside the block only.
+
+        Raises
+        ------
+        duckdb.Error
+            If the database cannot be opened, e.g. it does not exist.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            # Only switch files when nobody is using the current one
+            if self._active == 0:
+                self._open()
+            connection = self._connection
+            cursor = getattr(self._local, "cursor", None)
+            if cursor is None or self._local.connection is not connection:
+                cursor = connection.cursor()
+                self._cursors.append(cursor)
+                self._local.cursor = cursor
+                self._local.connection = connection
+            self._active += 1
+        try:
+            yield cursor
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    self._timer = threading.Timer(self.linger, self._close_if_idle)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def signature(self):
+        """
+        Fingerprint the file and its write-ahead log without opening them.
+
+        Returns
+        -------
+        tuple
+            The inode, modification time and size of both files, None
+            for a missing one. It changes whenever the pipeline writes.
+        """
+        signature = []
+        for path in (self.path, self.path + ".wal"):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append(None)
+                continue
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def close(self):
+        """Close the connection and every cursor now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._close()
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path=None) -> Database:
+    """
+    Get the shared `Database` of a file.
+
+    Parameters
+    ----------
+    path : str, optional
+        The database file. Default is DATABASE_PATH, which is set
+        with the MOVIE_REC_DATABASE environment variable.
+
+    Returns
+    -------
+    Database
+        The one `Database` of this process for that file.
+    """
+    path = os.path.abspath(path or DATABASE_PATH)
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = Database(path, DATABASE_LINGER)
+        return _databases[path]
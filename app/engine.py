@@ -0,0 +1,674 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .catalogue import Catalogue
+from .config import BUILD_BATCH_SIZE, BUILD_WORKERS, HYBRID_CANDIDATES
+from .ranking import RankingFeatures
+from .telemetry import span
+from .textmodel import IncrementalTfidf
+from .titleindex import TitleIndex
+from .recommenderhelper import (
+    get_movie_changes,
+    get_neighbors,
+    retrieve_and_transform_batches,
+    retrieve_and_transform_data,
+    normalize_rows,
+    pad_unmatched,
+    similar_movie_rows_batch,
+    similar_query_rows,
+    update_top_k_neighbors,
+)
+
+
+class RecommenderEngine:
+    """
+    Long-lived recommendation model shared by all requests.
+
+    The engine is built once (e.g. in the FastAPI lifespan hook)
+    and holds everything that used to be recomputed on every
+    call to `get_recommendation`: a compact catalogue of the
+    movies, the fitted TF-IDF vectorizer, the TF-IDF matrix and
+    an index from movie title to matrix row. The movie overviews
+    and genres are only needed to fit the matrix and are not kept.
+
+    Attributes
+    ----------
+    catalogue : Catalogue
+        The ids, titles and metrics of the movies in matrix row order.
+
+    vectorizer : TfidfVectorizer
+        The vectorizer fitted on the "combined" column.
+
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The L2-normalised TF-IDF vectorization of the "combined"
+        column, one row per movie in `catalogue`. The dot product of two
+        rows is their cosine similarity.
+
+    stop_words : str
+        The language of stop words the vectorizer was fitted with.
+
+    movie_list : StringColumn
+        The lowercase movie titles in matrix row order, decoded
+        from one UTF-8 buffer when indexed.
+
+    title_index : TitleIndex
+        Resolves titles to rows in `tfidf_matrix` by exact, prefix
+        or fuzzy match, preferring the most voted of duplicate titles.
+
+    metrics : numpy.ndarray
+        The popularity, vote average and vote count of every movie,
+        float32 of shape (n_movies, 3), indexed by row.
+
+    neighbors : numpy.ndarray or None
+        Precomputed top-K neighbour rows of every movie, best first,
+        loaded from the `movie_neighbors` table if it is available.
+
+    neighbor_scores : numpy.ndarray or None
+        The cosine similarity of each precomputed neighbour.
+
+    text_model : IncrementalTfidf or None
+        The updatable model behind `tfidf_matrix`, kept by engines
+        built from the database so `apply_changes` can update them.
+
+    run_id : int
+        The last `movies_changelog` run reflected in the engine.
+        Engines built from `movie_genre_data` start at 0, since the
+        table is not rebuilt by incremental extractions.
+
+    source_checksum : str
+        The checksum of the `movie_genre_data` table the engine
+        was built from, empty if unknown.
+
+    version : str
+        The model version reported to clients, the artifact version
+        plus the changelog run of any incremental update.
+
+    ann_index : AnnIndex or None
+        Approximate nearest-neighbour index used instead of exact
+        scoring when set and `nprobe` is positive, see `app/ann.py`.
+
+    nprobe : int
+        Number of index lists scanned per query, higher is slower
+        and closer to exact, 0 to score exactly. Default is 8.
+
+    ann_oversample : int
+        Index candidates re-ranked exactly per recommendation.
+        Default is 10.
+
+    hybrid_candidates : int
+        Most similar movies re-ranked by hybrid scoring, see
+        `similar_rows`. Default is HYBRID_CANDIDATES.
+
+    term_matrix : scipy.sparse.csr.csr_matrix
+        `tfidf_matrix` transposed to one row per term, so exact scoring
+        only visits the movies sharing a term with the query. Memory-
+        mapped from the artifact like `tfidf_matrix`, or else built
+        on first use.
+    """
+
+    def __init__(
+        self, df, vectorizer, tfidf_matrix, stop_words="english", normalize=True
+    ):
+        self.catalogue = df if isinstance(df, Catalogue) else Catalogue.from_frame(df)
+        self.vectorizer = vectorizer
+        if tfidf_matrix is not None and normalize:
+            tfidf_matrix = normalize_rows(tfidf_matrix)
+        self.tfidf_matrix = tfidf_matrix
+        self.stop_words = stop_words
+        self.movie_list = self.catalogue.titles
+        self.metrics = self.catalogue.metrics
+        self.title_index = TitleIndex(self.movie_list, self.metrics[:, 2])
+        self.neighbors = None
+        self.neighbor_scores = None
+        self.text_model = None
+        self.run_id = 0
+        self.source_checksum = ""
+        self.version = "unversioned"
+        self.ann_index = None
+        self.nprobe = 8
+        self.ann_oversample = 10
+        self.hybrid_candidates = HYBRID_CANDIDATES
+        self._ranking_features = None
+        self._term_matrix = None
+
+    @classmethod
+    def from_database(
+        cls, stop_words="english", use_neighbors=True, batch_size=None, workers=None
+    ):
+        """
+        Build the engine from the movies in DuckDB.
+
+        `movie_genre_data` is created once from the extracted movies
+        and not rebuilt by incremental extractions, so the changelog
+        run it reflects is unknown and the engine gets run 0. Calling
+        `refresh` then applies every logged change, which is safe for
+        changes the table already has: movies are upserted with their
+        latest content.
+
+        Parameters
+        ----------
+        stop_words : str, optional
+            The language of stop words to be
+            used when vectorizing the "combined" column.
+            Default is "english".
+
+        use_neighbors : bool, optional
+            Whether to load the precomputed `movie_neighbors` table.
+            Default is True.
+
+        batch_size : int, optional
+            Read and vectorize the movies this many at a time, so
+            their text is never all in memory, see
+            `IncrementalTfidf.fit_batches`. The engine is the same.
+            0 reads them all at once. Default is BUILD_BATCH_SIZE.
+
+        workers : int, optional
+            Processes counting the terms of the batches.
+            Default is BUILD_WORKERS.
+
+        Returns
+        -------
+        RecommenderEngine
+            The fitted engine.
+        """
+        batch_size = BUILD_BATCH_SIZE if batch_size is None else batch_size
+        workers = BUILD_WORKERS if workers is None else workers
+        if batch_size > 0:
+            catalogue, text_model = cls._fit_batches(stop_words, batch_size, workers)
+        else:
+            with span("data_load"):
+                df = retrieve_and_transform_data()
+            catalogue = df
+            if not df.empty:
+                with span("vectorize"):
+                    text_model = IncrementalTfidf(stop_words).fit(df["combined"], df["id"])
+        if not len(catalogue):
+            logging.error('No movie data available, engine is empty')
+            return cls(pd.DataFrame(), None, None, stop_words)
+
+        logging.info(f'Recommender engine built with {len(catalogue)} movies')
+        engine = cls(
+            catalogue, text_model.to_vectorizer(), text_model.matrix, stop_words,
+            normalize=False,
+        )
+        engine.text_model = text_model
+        if use_neighbors:
+            with span("attach_neighbors"):
+                engine.attach_neighbors(get_neighbors())
+        return engine
+
+    @staticmethod
+    def _fit_batches(stop_words, batch_size, workers):
+        catalogues = []
+
+        def documents():
+            batches = iter(retrieve_and_transform_batches(batch_size))
+            while True:
+                with span("data_load"):
+                    df = next(batches, None)
+                if df is None:
+                    return
+                # Only the compact catalogue of a batch outlives it
+                catalogues.append(Catalogue.from_frame(df))
+                yield df["combined"].tolist(), df["id"].to_numpy()
+
+        with span("vectorize"):
+            text_model = IncrementalTfidf(stop_words).fit_batches(documents(), workers)
+        if not catalogues:
+            return Catalogue.from_frame(pd.DataFrame()), text_model
+        return Catalogue.concat(catalogues), text_model
+
+    def apply_changes(self, changed: pd.DataFrame, removed_ids=()):
+        """
+        Build a new engine with some movies added, replaced or removed.
+
+        Only the changed movies are re-vectorized, see `IncrementalTfidf`.
+        This engine is left untouched so it can keep serving requests
+        until the new one is swapped in. Precomputed neighbours and the
+        ANN index are carried over and updated for the changed movies,
+        see `update_top_k_neighbors` and `AnnIndex.update`.
+
+        Parameters
+        ----------
+        changed : pd.DataFrame
+            The new or updated movies, with "id", "title", "combined"
+            and metric columns.
+        removed_ids : array-like, optional
+            The ids of the movies to remove.
+
+        Returns
+        -------
+        RecommenderEngine
+            The updated engine.
+
+        Raises
+        ------
+        ValueError
+            If the engine has no text model, e.g. because it was
+            loaded from an artifact, and must be rebuilt instead.
+        """
+        if self.text_model is None:
+            raise ValueError("Engine has no updatable text model, rebuild it instead")
+
+        text_model = self.text_model.copy()
+        text_model.remove(removed_ids)
+        if len(changed):
+            text_model.upsert(changed["id"], changed["combined"])
+
+        catalogue = self.catalogue.upsert(Catalogue.from_frame(changed), text_model.ids)
+        engine = type(self)(
+            catalogue, text_model.to_vectorizer(), text_model.matrix, self.stop_words,
+            normalize=False,
+        )
+        engine.text_model = text_model
+        engine.run_id = self.run_id
+        engine.source_checksum = self.source_checksum
+        engine.version = self.version
+        if self.neighbors is not None or self.ann_index is not None:
+            # New row of every old row whose vector is unchanged, -1 otherwise
+            changed_ids = changed["id"].values if len(changed) else []
+            row_map = catalogue.rows_of(self.catalogue.ids)
+            old_rows = self.catalogue.rows_of(changed_ids)
+            row_map[old_rows[old_rows >= 0]] = -1
+            changed_rows = np.unique(catalogue.rows_of(changed_ids))
+            changed_rows = changed_rows[changed_rows >= 0]
+            if text_model.stale_rows < self.text_model.stale_rows + len(changed_rows):
+                # Every row was reweighted, so none of them is unchanged
+                row_map[:] = -1
+                changed_rows = np.arange(len(catalogue))
+            with span("update_neighbors"):
+                if self.neighbors is not None:
+                    engine.neighbors, engine.neighbor_scores = update_top_k_neighbors(
+                        engine.tfidf_matrix, self.neighbors, self.neighbor_scores,
+                        row_map, changed_rows, term_matrix=engine.term_matrix,
+                    )
+                if self.ann_index is not None:
+                    engine.ann_index = self.ann_index.update(
+                        engine.tfidf_matrix, row_map, changed_rows
+                    )
+                    engine.nprobe = self.nprobe
+                    engine.ann_oversample = self.ann_oversample
+        logging.info(
+            f'Recommender engine updated with {len(changed)} changed movies, '
+            f'{len(engine)} movies in total'
+        )
+        return engine
+
+    def refresh(self):
+        """
+        Apply the changes logged by incremental extractions since
+        this engine was built, see `get_movie_changes`.
+
+        Returns
+        -------
+        RecommenderEngine
+            The updated engine, or this one if nothing changed.
+        """
+        with span("data_load"):
+            changed, removed_ids, run_id = get_movie_changes(self.run_id)
+        if run_id == self.run_id:
+            return self
+        with span("incremental_update"):
+            engine = self.apply_changes(changed, removed_ids)
+        engine.run_id = run_id
+        engine.version = f"{self.version.split('+')[0]}+run{run_id}"
+        return engine
+
+    def __len__(self):
+        return len(self.movie_list)
+
+    def lookup(self, movie: str, movie_id=None):
+        """
+        Get the matrix row of a movie.
+
+        Parameters
+        ----------
+        movie : str
+            The movie title. Exact matches after normalisation win,
+            otherwise an unambiguous close match is used. When several
+            movies share the title the most voted one is returned.
+        movie_id : int, optional
+            The movie id, which takes precedence over the title
+            and disambiguates movies sharing a title.
+
+        Returns
+        -------
+        int or None
+            The row of the movie, or None if it is not in the catalogue.
+        """
+        if movie_id is not None:
+            row = self.catalogue.rows_of([movie_id])[0]
+            return int(row) if row >= 0 else None
+        return self.title_index.resolve(movie)
+
+    def search_titles(self, query: str, limit=10) -> list:
+        """
+        Search catalogue titles by exact, prefix or fuzzy match.
+
+        Parameters
+        ----------
+        query : str
+            The partial or misspelt title.
+        limit : int, optional
+            The maximum number of titles. Default is 10.
+
+        Returns
+        -------
+        list
+            One dict per matching title with the kind of "match",
+            its edit "distance" and the "ids" of every movie with that
+            title, most voted first.
+        """
+        ids = self.catalogue.ids
+        return [
+            {
+                "title": match["title"],
+                "match": match["match"],
+                "distance": match["distance"],
+                "ids": [int(ids[row]) for row in match["rows"]],
+            }
+            for match in self.title_index.search(query, limit)
+        ]
+
+    def attach_neighbors(self, table: pd.DataFrame) -> bool:
+        """
+        Use a precomputed neighbour table for lookups.
+
+        The table is ignored if it does not cover exactly the movies
+        in this engine, e.g. because it was built from older data.
+
+        Parameters
+        ----------
+        table : pd.DataFrame
+            Columns movie_id, rank, neighbor_id and score
+            as written by the `etl/neighbors.py` pipeline stage.
+
+        Returns
+        -------
+        bool
+            Whether the neighbours were attached.
+        """
+        n_movies = len(self)
+        if table.empty or n_movies == 0:
+            return False
+
+        ids = pd.Index(self.catalogue.ids)
+        movie_rows = ids.get_indexer(table["movie_id"].values)
+        neighbor_rows = ids.get_indexer(table["neighbor_id"].values)
+        k = len(table) // n_movies
+        counts = np.bincount(movie_rows[movie_rows >= 0], minlength=n_movies)
+        if (
+            not ids.is_unique
+            or (movie_rows < 0).any()
+            or (neighbor_rows < 0).any()
+            or k == 0
+            or (counts != k).any()
+        ):
+            logging.warning('Neighbour table does not match the catalogue, ignoring it')
+            return False
+
+        order = np.lexsort((table["rank"].values, movie_rows))
+        self.neighbors = neighbor_rows[order].reshape(n_movies, k)
+        self.neighbor_scores = (
+            table["score"].values[order].reshape(n_movies, k)
+        )
+        logging.info(f'Attached {k} precomputed neighbours per movie')
+        return True
+
+    def precomputed_neighbors(self, row: int, top_n: int, live_fallback=True):
+        """
+        Get the precomputed neighbours of a movie.
+
+        Parameters
+        ----------
+        row : int
+            The row of the reference movie.
+        top_n : int
+            Number of similar movies to output.
+        live_fallback : bool, optional
+            If True, return None when more than the K precomputed
+            neighbours are requested so the caller scores live.
+            If False, return at most K neighbours. Default is True.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            The neighbour rows, best first, or None if they
+            have to be scored live.
+        """
+        if self.neighbors is None:
+            return None
+        if top_n > self.neighbors.shape[1] and live_fallback:
+            return None
+        return self.neighbors[row, :top_n]
+
+    def filter_rows(self, movie_filter):
+        """
+        Get the sorted rows of the movies matching a filter.
+
+        Parameters
+        ----------
+        movie_filter : MovieFilter or None
+            The filter.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            The matching rows, or None if nothing is filtered out.
+        """
+        if not movie_filter:
+            return None
+        return self.catalogue.facets.rows(movie_filter, self.metrics[:, 2])
+
+    @property
+    def ranking_features(self) -> RankingFeatures:
+        """The scaled signals of the hybrid ranking, computed on first use."""
+        if self._ranking_features is None:
+            self._ranking_features = RankingFeatures(self.metrics)
+        return self._ranking_features
+
+    @property
+    def term_matrix(self):
+        """
+        The TF-IDF matrix transposed to CSR, loaded with the artifact
+        or computed on first use.
+        """
+        if self._term_matrix is None:
+            self._term_matrix = self.tfidf_matrix.T.tocsr()
+        return self._term_matrix
+
+    @term_matrix.setter
+    def term_matrix(self, term_matrix):
+        self._term_matrix = term_matrix
+
+    def query_vectors(self, texts):
+        """
+        Vectorize free-text queries with the fitted vocabulary and IDF,
+        without refitting anything.
+
+        Parameters
+        ----------
+        texts : list of str
+            The queries.
+
+        Returns
+        -------
+        scipy.sparse.csr.csr_matrix
+            Their L2-normalised TF-IDF rows, comparable to the rows of
+            `tfidf_matrix`. Terms unknown to the model are ignored.
+        """
+        if self.text_model is not None:
+            return self.text_model.transform(texts)
+        return normalize_rows(self.vectorizer.transform(texts))
+
+    def text_rows(self, text: str, top_n: int, movie_filter=None, weights=None):
+        """
+        Get the rows of the movies most similar to a free-text query.
+
+        The query is vectorized with `query_vectors` and scored
+        exactly against all movies with the sparse top-k of title
+        queries. Movies sharing no term with the query are left out.
+
+        Parameters
+        ----------
+        text : str
+            The query, e.g. "heist with a twist".
+        top_n : int
+            Number of movies to output.
+        movie_filter : MovieFilter, optional
+            Only return movies matching this filter.
+        weights : HybridWeights, optional
+            Re-rank the `hybrid_candidates` most similar movies by
+            popularity and quality as well, see `similar_rows`. The
+            votes weight needs a reference movie and is rejected.
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            The matching rows, best first, at most `top_n`.
+        scores : numpy.ndarray
+            Their cosine similarity to the query, or blended score
+            with hybrid weights.
+        """
+        if weights and weights.votes:
+            raise ValueError("The votes weight needs a reference movie")
+        with span("query_vectorize"):
+            query = self.query_vectors([text])
+        with span("filter"):
+            candidates = self.filter_rows(movie_filter)
+        pool = max(top_n, self.hybrid_candidates) if weights else top_n
+        with span("exact_scoring"):
+            rows, scores = similar_query_rows(
+                query, self.tfidf_matrix, pool, candidates=candidates,
+                term_matrix=self.term_matrix,
+            )
+        matching = scores[0] > 0
+        rows, scores = rows[:, matching], scores[:, matching]
+        if weights and rows.shape[1]:
+            with span("rerank"):
+                rows, scores = self.ranking_features.rerank(
+                    None, rows, scores, weights, top_n
+                )
+        return rows[0, :top_n], scores[0, :top_n]
+
+    def similar_rows(
+        self, rows, top_n: int, live_fallback=True, movie_filter=None, weights=None,
+        nprobe=None,
+    ):
+        """
+        Get the recommended rows of several movies at once.
+
+        Ranks by similarity, see `scored_rows`, unless hybrid `weights`
+        are given. Then the `hybrid_candidates` most similar movies, or
+        all precomputed neighbours when they cover `top_n`, are
+        re-ranked by a blend of similarity, popularity and votes.
+
+        Parameters
+        ----------
+        rows : array-like
+            The rows of the reference movies.
+        top_n : int
+            Number of movies to output per reference movie.
+        live_fallback : bool, optional
+            See `precomputed_neighbors`. Default is True.
+        movie_filter : MovieFilter, optional
+            Only recommend movies matching this filter.
+        weights : HybridWeights, optional
+            The weights of the hybrid ranking.
+        nprobe : int, optional
+            See `scored_rows`.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (len(rows), top_n) with the recommended
+            rows, best first. There are fewer columns if fewer
+            movies match the filter, and -1 pads the movies left with
+            fewer matches than others, see `scored_rows`.
+        """
+        if not weights:
+            return self.scored_rows(rows, top_n, live_fallback, movie_filter, nprobe)[0]
+        rows = np.asarray(rows, dtype=np.intp)
+        pool = max(top_n, self.hybrid_candidates)
+        if self.neighbors is not None and top_n <= self.neighbors.shape[1]:
+            pool = max(top_n, min(pool, self.neighbors.shape[1]))
+        candidates, similarities = self.scored_rows(
+            rows, pool, live_fallback, movie_filter, nprobe
+        )
+        with span("rerank"):
+            ranked, _ = self.ranking_features.rerank(
+                rows, candidates, similarities, weights, top_n
+            )
+        return ranked
+
+    def scored_rows(
+        self, rows, top_n: int, live_fallback=True, movie_filter=None, nprobe=None
+    ):
+        """
+        Get the most similar rows of several movies at once.
+
+        Uses the precomputed neighbours when they cover `top_n`,
+        then the ANN index if there is one, otherwise scores all
+        movies in batched sparse products. A filter is applied
+        before the top-k selection, so it never leaves fewer
+        recommendations than there are matching movies. Precomputed
+        neighbours are only used if enough of them match it.
+
+        Parameters
+        ----------
+        rows : array-like
+            The rows of the reference movies.
+        top_n : int
+            Number of similar movies to output per reference movie.
+        live_fallback : bool, optional
+            See `precomputed_neighbors`. Default is True.
+        movie_filter : MovieFilter, optional
+            Only recommend movies matching this filter.
+        nprobe : int, optional
+            Index lists scanned per movie when the ANN index is used,
+            to trade speed for recall per call. Default is `nprobe`.
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Array of shape (len(rows), top_n) with the similar rows,
+            best first. There are fewer columns if fewer movies match
+            the filter, and movies left with fewer matches than others
+            are padded with -1, see `pad_unmatched`.
+        scores : numpy.ndarray
+            The cosine similarity of each returned row, -inf for padding.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        with span("filter"):
+            candidates = self.filter_rows(movie_filter)
+        if self.neighbors is not None and (
+            top_n <= self.neighbors.shape[1] or not live_fallback
+        ):
+            with span("precomputed"):
+                if candidates is None:
+                    return self.neighbors[rows, :top_n], self.neighbor_scores[rows, :top_n]
+                neighbors = self.neighbors[rows]
+                matching = np.isin(neighbors, candidates, assume_unique=True)
+                if (matching.sum(axis=1) >= top_n).all() or not live_fallback:
+                    # Stable sort moves the matching neighbours first, best first
+                    order = np.argsort(~matching, axis=1, kind="stable")[:, :top_n]
+                    scores = np.where(
+                        np.take_along_axis(matching, order, axis=1),
+                        np.take_along_axis(self.neighbor_scores[rows], order, axis=1),
+                        -np.inf,
+                    )
+                    return pad_unmatched(np.take_along_axis(neighbors, order, axis=1), scores)
+        if self.ann_index is not None and self.nprobe > 0:
+            with span("ann_search"):
+                return self.ann_index.similar_rows(
+                    rows, self.tfidf_matrix, top_n,
+                    self.nprobe if nprobe is None else nprobe, self.ann_oversample,
+                    candidates=candidates,
+                )
+        with span("exact_scoring"):
+            return similar_movie_rows_batch(
+                rows, self.tfidf_matrix, top_n, candidates=candidates,
+                term_matrix=self.term_matrix,
+            )
@@ -0,0 +1,276 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Bits of the per-movie genre mask, i.e. the most distinct genres supported
+MAX_GENRES = 64
+
+
+@dataclass(frozen=True)
+class MovieFilter:
+    """
+    Restriction of the recommendations to movies with some metadata.
+
+    Every condition that is set must hold. Movies with an unknown
+    release date never match a year range.
+
+    Parameters
+    ----------
+    genres : tuple of str, optional
+        Genre names, a movie must have at least one of them.
+        Matched case-insensitively, unknown names match no movie.
+    year_min, year_max : int, optional
+        Inclusive range of release years.
+    min_votes : int, optional
+        Smallest vote count.
+    languages : tuple of str, optional
+        Original language codes, e.g. ("en", "fr").
+    """
+
+    genres: tuple = ()
+    year_min: int | None = None
+    year_max: int | None = None
+    min_votes: int | None = None
+    languages: tuple = ()
+
+    @classmethod
+    def create(cls, genres=None, year_min=None, year_max=None, min_votes=None, languages=None):
+        """Build a filter from request fields, normalising the name lists."""
+        return cls(
+            genres=tuple(sorted({genre.strip().lower() for genre in genres or ()})),
+            year_min=year_min,
+            year_max=year_max,
+            min_votes=min_votes,
+            languages=tuple(sorted({language.strip().lower() for language in languages or ()})),
+        )
+
+    def __bool__(self):
+        return bool(
+            self.genres or self.languages
+            or self.year_min is not None or self.year_max is not None
+            or self.min_votes is not None
+        )
+
+    def key(self) -> str:
+        """A string identifying the filter, e.g. in cache keys."""
+        return (
+            f"g={','.join(self.genres)};y={self.year_min}-{self.year_max};"
+            f"v={self.min_votes};l={','.join(self.languages)}"
+        )
+
+
+def encode_codes(values):
+    """Encode strings as small integer codes into a sorted list of names."""
+    codes, names = pd.factorize(pd.Series(values, dtype=object).fillna(""), sort=True)
+    return codes.astype(np.uint16), [str(name) for name in names]
+
+
+class Facets:
+    """
+    Per-movie metadata the recommendations can be filtered on.
+
+    Genres are held as one bitmask per movie, so the movies having any
+    of several genres are found with one bitwise AND over the catalogue.
+    Release years and language codes are small integer columns, and the
+    rows matching a filter are computed once and kept in a small LRU
+    cache, so a filtered query only adds a lookup to an unfiltered one.
+
+    Parameters
+    ----------
+    genres : numpy.ndarray
+        The genre bitmask of every movie, bit i set for `genre_names[i]`.
+    genre_names : list of str
+        The lowercase genre names.
+    years : numpy.ndarray
+        The release year of every movie, 0 if unknown.
+    languages : numpy.ndarray
+        The index of the original language of every movie in `language_names`.
+    language_names : list of str
+        The sorted language codes.
+    cache_size : int, optional
+        Number of filters whose matching rows are kept. Default is 64.
+    """
+
+    def __init__(self, genres, genre_names, years, languages, language_names, cache_size=64):
+        self.genres = np.asarray(genres, dtype=np.uint64)
+        self.genre_names = list(genre_names)
+        self.years = np.asarray(years, dtype=np.int16)
+        self.languages = np.asarray(languages, dtype=np.uint16)
+        self.language_names = list(language_names)
+        self.cache_size = cache_size
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        """
+        Extract the facets of the movies of a DataFrame.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The movies, with optional "genre_names" (comma separated),
+            "release_date" and "original_language" columns. Missing
+            columns leave every movie's value unknown.
+
+        Returns
+        -------
+        Facets
+            The facets, in the row order of `df`.
+
+        Raises
+        ------
+        ValueError
+            If the movies have more than MAX_GENRES distinct genres.
+        """
+        n_movies = len(df)
+        genres = np.zeros(n_movies, dtype=np.uint64)
+        genre_names = []
+        if "genre_names" in df:
+            # One (row, genre) pair per genre of every movie
+            pairs = (
+                df["genre_names"].fillna("").str.lower().str.split(", ")
+                .reset_index(drop=True).explode()
+            )
+            pairs = pairs[pairs.notna() & (pairs != "")]
+            codes, names = pd.factorize(pairs, sort=True)
+            genre_names = [str(name) for name in names]
+            if len(genre_names) > MAX_GENRES:
+                raise ValueError(
+                    f"At most {MAX_GENRES} genres are supported, got {len(genre_names)}"
+                )
+            bits = np.left_shift(np.uint64(1), codes.astype(np.uint64))
+            np.bitwise_or.at(genres, pairs.index.to_numpy(), bits)
+
+        years = np.zeros(n_movies, dtype=np.int16)
+        if "release_date" in df:
+            dates = pd.to_datetime(df["release_date"], errors="coerce")
+            years = dates.dt.year.fillna(0).to_numpy(np.int16)
+
+        languages = df["original_language"] if "original_language" in df else [""] * n_movies
+        language_codes, language_names = encode_codes(languages)
+        return cls(genres, genre_names, years, language_codes, language_names)
+
+    def __len__(self):
+        return len(self.genres)
+
+    def take(self, rows):
+        """Get the facets of the given rows."""
+        rows = np.asarray(rows, dtype=np.intp)
+        return Facets(
+            self.genres[rows], self.genre_names, self.years[rows],
+            self.languages[rows], self.language_names, self.cache_size,
+        )
+
+    def concat(self, *others):
+        """
+        Append the facets of other movies, merging the genre and
+        language names of all of them.
+
+        Parameters
+        ----------
+        *others : Facets
+            The facets to append, in order.
+
+        Returns
+        -------
+        Facets
+            The facets of the movies of all of them, this one's first.
+        """
+        parts = [self, *others]
+        genre_names = sorted(set().union(*(facets.genre_names for facets in parts)))
+        if len(genre_names) > MAX_GENRES:
+            raise ValueError(f"At most {MAX_GENRES} genres are supported, got {len(genre_names)}")
+        language_names = sorted(set().union(*(facets.language_names for facets in parts)))
+
+        def remap_genres(facets):
+            genres = np.zeros(len(facets), dtype=np.uint64)
+            for i, name in enumerate(facets.genre_names):
+                has_genre = (facets.genres >> np.uint64(i)) & np.uint64(1)
+                genres |= has_genre << np.uint64(genre_names.index(name))
+            return genres
+
+        def remap_languages(facets):
+            lookup = np.searchsorted(language_names, facets.language_names).astype(np.uint16)
+            return lookup[facets.languages] if len(lookup) else facets.languages
+
+        return Facets(
+            np.concatenate([remap_genres(facets) for facets in parts]),
+            genre_names,
+            np.concatenate([facets.years for facets in parts]),
+            np.concatenate([remap_languages(facets) for facets in parts]),
+            language_names,
+            self.cache_size,
+        )
+
+    def mask(self, movie_filter: MovieFilter, vote_counts) -> np.ndarray:
+        """
+        Get the movies matching a filter as a boolean mask.
+
+        Parameters
+        ----------
+        movie_filter : MovieFilter
+            The filter.
+        vote_counts : numpy.ndarray
+            The vote count of every movie, for `min_votes`.
+
+        Returns
+        -------
+        numpy.ndarray
+            True for every matching movie.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if movie_filter.genres:
+            wanted = np.uint64(0)
+            for genre in movie_filter.genres:
+                if genre in self.genre_names:
+                    wanted |= np.uint64(1) << np.uint64(self.genre_names.index(genre))
+            mask &= (self.genres & wanted) != 0
+        if movie_filter.year_min is not None:
+            mask &= self.years >= movie_filter.year_min
+        if movie_filter.year_max is not None:
+            mask &= (self.years <= movie_filter.year_max) & (self.years > 0)
+        if movie_filter.min_votes is not None:
+            mask &= np.asarray(vote_counts) >= movie_filter.min_votes
+        if movie_filter.languages:
+            allowed = np.isin(self.language_names, movie_filter.languages)
+            mask &= allowed[self.languages] if len(allowed) else False
+        return mask
+
+    def rows(self, movie_filter: MovieFilter, vote_counts) -> np.ndarray:
+        """
+        Get the sorted rows of the movies matching a filter,
+        from the cache if the filter was used recently.
+
+        Parameters
+        ----------
+        movie_filter : MovieFilter
+            The filter.
+        vote_counts : numpy.ndarray
+            The vote count of every movie, for `min_votes`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The matching rows, read-only as they are shared.
+        """
+        key = movie_filter.key()
+        with self._lock:
+            rows = self._rows.get(key)
+            if rows is not None:
+                self._rows.move_to_end(key)
+                return rows
+        rows = np.flatnonzero(self.mask(movie_filter, vote_counts))
+        rows.flags.writeable = False
+        with self._lock:
+            self._rows[key] = rows
+            while len(self._rows) > self.cache_size:
+                self._rows.popitem(last=False)
+        return rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.genres.nbytes + self.years.nbytes + self.languages.nbytes
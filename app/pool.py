@@ -0,0 +1,122 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .telemetry import TELEMETRY
+
+
+class PoolSaturated(Exception):
+    """Raised when the compute pool has no free worker or queue slot."""
+
+    def __init__(self, retry_after=1):
+        super().__init__("Compute pool is saturated, retry later")
+        self.retry_after = retry_after
+
+
+class ComputePool:
+    """
+    Dedicated, bounded thread pool for CPU-heavy recommendation work.
+
+    At most `max_workers` jobs run at once and at most `max_queue`
+    more wait for a worker. Further submissions fail immediately with
+    `PoolSaturated` instead of piling up, so bursts are turned into
+    backpressure rather than memory growth, and the event loop stays
+    free to answer cheap endpoints.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of worker threads. Default is 4.
+
+    max_queue : int, optional
+        Number of jobs allowed to wait for a worker. Default is 32.
+
+    retry_after : int, optional
+        Seconds clients are asked to wait when the pool is saturated.
+        Default is 1.
+    """
+
+    def __init__(self, max_workers=4, max_queue=32, retry_after=1):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="recommender"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs running or waiting for a worker."""
+        return self._pending
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Submit a job, failing fast if the pool is saturated.
+
+        The job runs in a copy of the caller's context, so context
+        variables set by the request are visible to it.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future of the job.
+
+        Raises
+        ------
+        PoolSaturated
+            If all workers are busy and the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            logging.warning('Compute pool saturated, rejecting request')
+            raise PoolSaturated(self.retry_after)
+
+        with self._lock:
+            self._pending += 1
+        context = contextvars.copy_context()
+        try:
+            future = self._executor.submit(context.run, fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        # Free the slot when the job finishes, even if the caller
+        # stopped waiting for it, so the bound always holds
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a job in the pool and wait for it without blocking the event loop.
+
+        The time the job waits for a worker is recorded as the "queue" stage.
+
+        Raises
+        ------
+        PoolSaturated
+            If all workers are busy and the queue is full.
+        """
+        submitted = time.perf_counter()
+
+        def job():
+            TELEMETRY.record("queue", time.perf_counter() - submitted)
+            return fn(*args, **kwargs)
+
+        future = self.submit(job)
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def shutdown(self):
+        """Wait for running jobs and stop the worker threads."""
+        self._executor.shutdown(wait=True)
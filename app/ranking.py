@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from .recommenderhelper import pad_unmatched, top_k_rows
+
+
+@dataclass(frozen=True)
+class HybridWeights:
+    """
+    Weights blending content similarity with popularity and votes.
+
+    Every signal is scaled to [0, 1] before weighting, so the weights
+    are comparable. With the defaults the ranking is by similarity only.
+
+    Parameters
+    ----------
+    similarity : float, optional
+        Weight of the TF-IDF cosine similarity to the movie. Default is 1.
+    popularity : float, optional
+        Weight of the log-scaled popularity. Default is 0.
+    quality : float, optional
+        Weight of the Bayesian-smoothed vote average, which pulls the
+        average of movies with few votes towards the catalogue mean.
+        Default is 0.
+    votes : float, optional
+        Weight of how close the vote count is to the movie's, on a log
+        scale, favouring movies about as well known. Default is 0.
+    """
+
+    similarity: float = 1.0
+    popularity: float = 0.0
+    quality: float = 0.0
+    votes: float = 0.0
+
+    def __post_init__(self):
+        if min(self.similarity, self.popularity, self.quality, self.votes) < 0:
+            raise ValueError("Hybrid weights must not be negative")
+
+    def __bool__(self):
+        # Only the similarity weighted ranks like plain similarity
+        return bool(self.popularity or self.quality or self.votes)
+
+    def key(self) -> str:
+        """A string identifying the weights, e.g. in cache keys."""
+        return f"s={self.similarity:g};p={self.popularity:g};q={self.quality:g};v={self.votes:g}"
+
+
+class RankingFeatures:
+    """
+    Per-movie signals of the hybrid ranking, scaled to [0, 1] once per
+    engine so re-ranking only gathers and combines them.
+
+    Parameters
+    ----------
+    metrics : numpy.ndarray
+        The popularity, vote average and vote count of every movie.
+    prior_votes : float, optional
+        Votes the Bayesian average gives the catalogue mean vote. Default
+        is the median vote count.
+    """
+
+    def __init__(self, metrics, prior_votes=None):
+        metrics = np.asarray(metrics, dtype=np.float64)
+        popularity = np.log1p(np.maximum(np.nan_to_num(metrics[:, 0]), 0))
+        vote_average = np.nan_to_num(metrics[:, 1])
+        vote_count = np.maximum(np.nan_to_num(metrics[:, 2]), 0)
+
+        if prior_votes is None:
+            prior_votes = float(np.median(vote_count)) if len(vote_count) else 0.0
+        total_votes = vote_count.sum()
+        mean_vote = (vote_average * vote_count).sum() / total_votes if total_votes else 0.0
+        smoothed = (vote_count * vote_average + prior_votes * mean_vote) / np.maximum(
+            vote_count + prior_votes, 1e-12
+        )
+
+        log_votes = np.log1p(vote_count)
+        self.popularity = (popularity / max(popularity.max(initial=0), 1e-12)).astype(np.float32)
+        self.quality = (smoothed / 10).astype(np.float32)
+        self.log_votes = log_votes.astype(np.float32)
+        self.log_votes_range = float(max(log_votes.max(initial=0), 1e-12))
+
+    def rerank(self, movie_rows, candidate_rows, similarities, weights, top_n):
+        """
+        Re-rank candidate movies by a weighted blend of their signals.
+
+        The blend is computed for all candidates of all movies at once
+        as one expression over (n_movies, n_candidates) arrays.
+
+        Parameters
+        ----------
+        movie_rows : numpy.ndarray or None
+            The rows of the reference movies, None for queries without
+            one, e.g. free text, which cannot weight `votes`.
+        candidate_rows : numpy.ndarray
+            The candidate rows of each reference movie, shape
+            (n_movies, n_candidates), -1 for padding.
+        similarities : numpy.ndarray
+            The cosine similarity of each candidate.
+        weights : HybridWeights
+            The weights of the signals.
+        top_n : int
+            Number of movies to keep per reference movie.
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            The top `top_n` candidate rows of each movie, best first,
+            padded with -1 like `candidate_rows`.
+        scores : numpy.ndarray
+            Their blended scores, -inf for padding.
+        """
+        candidate_rows = np.asarray(candidate_rows, dtype=np.intp)
+        padding = candidate_rows < 0
+        scores = (
+            weights.similarity * np.where(padding, 0, similarities).astype(np.float32)
+            + weights.popularity * self.popularity[candidate_rows]
+            + weights.quality * self.quality[candidate_rows]
+        )
+        if weights.votes:
+            if movie_rows is None:
+                raise ValueError("The votes weight needs a reference movie")
+            movie_rows = np.asarray(movie_rows, dtype=np.intp)
+            vote_distance = np.abs(
+                self.log_votes[candidate_rows] - self.log_votes[movie_rows, None]
+            )
+            scores = scores + weights.votes * (1 - vote_distance / self.log_votes_range)
+        scores = np.where(padding, -np.inf, scores)
+        order, top_scores = top_k_rows(scores, top_n)
+        return pad_unmatched(np.take_along_axis(candidate_rows, order, axis=1), top_scores)
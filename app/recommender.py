@@ -1,25 +1,74 @@
-import json
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 
-
-from .recommenderhelper import (
-    content_movie_recommender,
-    compute_metrics,
-    retrieve_and_transform_data,
-    compute_tfidf_vectorization,
+from .engine import RecommenderEngine
+from .titleindex import normalize_title
+from .recommenderhelper import compute_metrics_from_rows
+from .telemetry import span
+from .schemas import (
+    BatchRecommendationItem,
+    BatchRecommendationResult,
+    Metrics,
+    RecommendationResult,
+    TextRecommendationResult,
 )
 
-def get_recommendation(movie: str, num_rec: int = 10, stop_words="english"):
+def recommendation_key(
+    movie, movie_id=None, movie_filter=None, weights=None, nprobe=None
+) -> str:
+    """
+    Key identifying the recommendations for a movie and its options,
+    shared by the recommendation cache and request coalescing.
+
+    Parameters
+    ----------
+    movie : str
+        The title of the movie.
+    movie_id : int, optional
+        The id of the movie, takes precedence over `movie`.
+    movie_filter : MovieFilter, optional
+        The filter of the recommendations.
+    weights : HybridWeights, optional
+        The ranking weights.
+    nprobe : int, optional
+        The index lists scanned per query.
+
+    Returns
+    -------
+    str
+        The key, e.g. "star wars|g=action;y=None-None;v=None;l=".
+    """
+    key = normalize_title(movie) if movie_id is None else f"#{movie_id}"
+    if movie_filter:
+        key = f"{key}|{movie_filter.key()}"
+    if weights:
+        key = f"{key}|{weights.key()}"
+    if nprobe is not None:
+        key = f"{key}|p={nprobe}"
+    return key
+
+
+def get_recommendation(
+    movie: str,
+    num_rec: int = 10,
+    stop_words="english",
+    engine=None,
+    live_fallback=True,
+    cache=None,
+    movie_id=None,
+    movie_filter=None,
+    weights=None,
+    nprobe=None,
+):
     """
     Generate movie recommendations based on
     content similarity and computes associated metrics.
 
-    This function retrieves movie data,
-    calculates cosine similarity between movies using
-    TF-IDF vectorization of their combined overview
-    and genre, and returns a list of recommended
-    movies along with certain metrics
+    This function looks up the movie in a prebuilt
+    recommender engine, uses its precomputed neighbours
+    when available or else calculates cosine similarity between
+    that movie and all others as one sparse row product over
+    the L2-normalised TF-IDF vectorization of their combined
+    overview and genre, and returns a list
+    of recommended movies along with certain metrics
     (popularity, vote average, and vote count RMSE).
 
     Parameters
@@ -37,20 +86,54 @@ def get_recommendation(movie: str, num_rec: int = 10, stop_words="english"):
         used when vectorizing the "combined" column.
         Default is "english".
 
+    engine : RecommenderEngine, optional
+        The prebuilt engine to recommend from. If not given,
+        or if it was fitted with other stop words, a new
+        engine is built from DuckDB for this call.
+
+    live_fallback : bool, optional
+        When the engine has precomputed neighbours but `num_rec`
+        is larger than the number stored per movie, score live
+        if True, or return only the stored neighbours if False.
+        Default is True.
+
+    cache : RecommendationCache, optional
+        Cache of ranked recommendations. A cached answer for at
+        least `num_rec` recommendations is sliced instead of
+        scoring the movie again, or for exactly `num_rec` with
+        hybrid `weights`.
+
+    movie_id : int, optional
+        The id of the movie, to pick one of several movies
+        sharing a title. Takes precedence over `movie`.
+
+    movie_filter : MovieFilter, optional
+        Only recommend movies with these genres, release years,
+        vote counts or languages.
+
+    weights : HybridWeights, optional
+        Re-rank the most similar movies by a blend of similarity,
+        popularity and votes instead of by similarity alone.
+
+    nprobe : int, optional
+        Index lists scanned for this call when the engine
+        searches an ANN index, higher is slower and closer
+        to exact. Default is the engine's `nprobe`.
+
     Returns
     -------
-    str
-        A JSON-formatted string containing
-        the original movie, a list of recommendations,
+    RecommendationResult or None
+        The resolved movie title, a list of recommendations,
         and associated metrics
-        (popularity, vote average, and vote count RMSE).
+        (popularity, vote average, and vote count RMSE),
+        or None if the movie is not found.
 
     Examples
     --------
     >>> result = get_recommendation("Inception", num_rec=5)
-    >>> print(json.loads(result))
+    >>> print(result.model_dump())
     {
-        "movie": "Inception",
+        "movie": "inception",
         "recommendations": [...],
         "metrics": {
             "popularity": ...,
@@ -63,39 +146,237 @@ def get_recommendation(movie: str, num_rec: int = 10, stop_words="english"):
     # Assertions to check input types and values
     assert isinstance(movie, str), 'movie must be a string'
     assert num_rec > 0, 'num_rec must be greater than 0'
-    
 
-    movie = movie.lower()
-    df = retrieve_and_transform_data()
 
-    tfidf_matrix = compute_tfidf_vectorization(df, stop_words)
-    similarity = cosine_similarity(tfidf_matrix)
+    if engine is None or engine.stop_words != stop_words:
+        engine = RecommenderEngine.from_database(stop_words)
 
+    with span("lookup"):
+        row = engine.lookup(movie, movie_id)
+    if row is None:
+        return None
+    movie = engine.movie_list[row]
 
-    similarity_df = pd.DataFrame(
-        similarity, index=df.title.values, columns=df.title.values # type: ignore
-    )
-    movie_list = similarity_df.columns.values
-    recommendations = content_movie_recommender(
-        movie, similarity_df, movie_list, num_rec # type: ignore
+    rows = None
+    cache_key = recommendation_key(movie, movie_id, movie_filter, weights, nprobe)
+    if weights:
+        # The re-ranked pool grows with num_rec, so a longer answer is no prefix
+        cache_key = f"{cache_key}|n={num_rec}"
+    if cache is not None:
+        with span("cache"):
+            cache.bind(engine)
+            rows = cache.get(cache_key, num_rec, stop_words)
+    if rows is None:
+        rows = engine.similar_rows(
+            [row], num_rec, live_fallback, movie_filter, weights, nprobe
+        )[0]
+        rows = rows[rows >= 0]
+        if cache is not None and len(rows):
+            cache.put(cache_key, num_rec, rows, stop_words)
+    rows = rows[:num_rec]
+    if not len(rows):
+        return None
+
+    recommendations = list(engine.movie_list[rows])
+    with span("metrics"):
+        popularity_rmse, vote_avg_rmse, vote_count_rmse = compute_metrics_from_rows(
+            engine.metrics, row, rows
+        )[0]
+
+    return RecommendationResult(
+        movie=movie,
+        recommendations=recommendations,
+        metrics=Metrics(
+            popularity=popularity_rmse,
+            vote_avg=vote_avg_rmse,
+            vote_count=vote_count_rmse,
+        ),
     )
 
-    if not recommendations:
-        return None
 
-    popularity_rmse, vote_avg_rmse, vote_count_rmse = compute_metrics(
-        df, movie, recommendations
+def get_text_recommendation(
+    query: str,
+    num_rec: int = 10,
+    stop_words="english",
+    engine=None,
+    movie_filter=None,
+    weights=None,
+):
+    """
+    Recommend movies matching a free-text description
+    instead of a seed movie.
+
+    The query is vectorized with the vocabulary and IDF the
+    engine was fitted with, so nothing is refitted per query,
+    and scored against the TF-IDF matrix like a movie title.
+
+    Parameters
+    ----------
+    query : str
+        The description, e.g. "heist movies with a twist".
+
+    num_rec : int, optional
+        The number of movie recommendations
+        to generate. Default is 10.
+
+    stop_words : str, optional
+        See `get_recommendation`.
+
+    engine : RecommenderEngine, optional
+        The prebuilt engine to recommend from, see `get_recommendation`.
+
+    movie_filter : MovieFilter, optional
+        See `get_recommendation`.
+
+    weights : HybridWeights, optional
+        Re-rank by popularity and quality as well, see
+        `get_recommendation`. The votes weight is not supported.
+
+    Returns
+    -------
+    TextRecommendationResult or None
+        The query, the recommended movies and their similarity
+        to it, or None if no movie shares a term with the query.
+
+    Examples
+    --------
+    >>> result = get_text_recommendation("heist with a twist", num_rec=5)
+    >>> print(result.model_dump())
+    {"query": "heist with a twist", "recommendations": [...], "scores": [...]}
+
+    """
+    # Assertions to check input types and values
+    assert isinstance(query, str), 'query must be a string'
+    assert num_rec > 0, 'num_rec must be greater than 0'
+
+    if engine is None or engine.stop_words != stop_words:
+        engine = RecommenderEngine.from_database(stop_words)
+
+    rows, scores = engine.text_rows(query, num_rec, movie_filter, weights)
+    if not len(rows):
+        return None
+    return TextRecommendationResult(
+        query=query,
+        recommendations=list(engine.movie_list[rows]),
+        scores=[float(score) for score in scores],
     )
 
-    result = {
-        "movie": movie,
-        "recommendations": recommendations,
-        "metrics": {
-            "popularity": popularity_rmse,
-            "vote_avg": vote_avg_rmse,
-            "vote_count": vote_count_rmse,
-        },
+
+def get_batch_recommendations(
+    movies: list,
+    num_rec: int = 10,
+    stop_words="english",
+    engine=None,
+    live_fallback=True,
+    movie_filter=None,
+    weights=None,
+    nprobe=None,
+):
+    """
+    Generate movie recommendations for many movies at once.
+
+    All known movies are scored together with batched sparse
+    matrix-matrix products and a vectorized top-k, instead of
+    one call to `get_recommendation` per movie. Movies that are
+    not in the catalogue are reported individually and do not
+    fail the rest of the batch.
+
+    Parameters
+    ----------
+    movies : list
+        The titles of the movies for which
+        recommendations are to be generated.
+
+    num_rec : int, optional
+        The number of movie recommendations
+        to generate per movie. Default is 10.
+
+    stop_words : str, optional
+        The language of stop words to be
+        used when vectorizing the "combined" column.
+        Default is "english".
+
+    engine : RecommenderEngine, optional
+        The prebuilt engine to recommend from, see `get_recommendation`.
+
+    live_fallback : bool, optional
+        See `get_recommendation`. Default is True.
+
+    movie_filter : MovieFilter, optional
+        See `get_recommendation`.
+
+    weights : HybridWeights, optional
+        See `get_recommendation`.
+
+    nprobe : int, optional
+        See `get_recommendation`.
+
+    Returns
+    -------
+    BatchRecommendationResult
+        One result per input movie, in input order. Each result
+        either has recommendations and metrics or an "error".
+
+    Examples
+    --------
+    >>> result = get_batch_recommendations(["Inception", "Nope"], num_rec=5)
+    >>> print(result.model_dump(exclude_none=True))
+    {
+        "results": [
+            {"movie": "inception", "recommendations": [...], "metrics": {...}},
+            {"movie": "nope", "error": "Movie not found"}
+        ]
     }
 
-    result_json = json.dumps(result)
-    return result_json
\ No newline at end of file
+    """
+    # Assertions to check input types and values
+    assert all(isinstance(movie, str) for movie in movies), 'movies must be strings'
+    assert num_rec > 0, 'num_rec must be greater than 0'
+
+    movies = [movie.lower() for movie in movies]
+    if engine is None or engine.stop_words != stop_words:
+        engine = RecommenderEngine.from_database(stop_words)
+
+    with span("lookup"):
+        rows = [engine.lookup(movie) for movie in movies]
+    found = [i for i, row in enumerate(rows) if row is not None]
+    found_results = {}
+    if found:
+        similar = engine.similar_rows(
+            [rows[i] for i in found], num_rec, live_fallback, movie_filter, weights,
+            nprobe,
+        )
+        with span("metrics"):
+            metrics = compute_metrics_from_rows(
+                engine.metrics, [rows[i] for i in found], similar
+            )
+        # Movies with fewer matches than others are padded with -1
+        similar = [movie_rows[movie_rows >= 0] for movie_rows in similar]
+        found_results = dict(zip(found, zip(similar, metrics)))
+
+    results = []
+    for i, movie in enumerate(movies):
+        if i not in found_results:
+            results.append(
+                BatchRecommendationItem(movie=movie, error="Movie not found")
+            )
+            continue
+        if not len(found_results[i][0]):
+            results.append(BatchRecommendationItem(
+                movie=engine.movie_list[rows[i]],
+                error="No recommendations match the filter",
+            ))
+            continue
+
+        similar_rows, (popularity_rmse, vote_avg_rmse, vote_count_rmse) = found_results[i]
+        results.append(BatchRecommendationItem(
+            movie=engine.movie_list[rows[i]],
+            recommendations=list(engine.movie_list[similar_rows]),
+            metrics=Metrics(
+                popularity=popularity_rmse,
+                vote_avg=vote_avg_rmse,
+                vote_count=vote_count_rmse,
+            ),
+        ))
+
+    return BatchRecommendationResult(results=results)
@@ -1,33 +1,256 @@
-import duckdb
+import contextlib
+import hashlib
 import logging
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from .database import get_database
 
 logging.basicConfig(filename='app.log', level=logging.INFO)
 
+# Metric columns compared between a movie and its recommendations
+METRIC_COLUMNS = ["popularity", "vote_average", "vote_count"]
+
+# Columns of movie_genre_data the model is built from
+MODEL_COLUMNS = [
+    "id", "title", "overview", "genre_names", "release_date", "original_language",
+    *METRIC_COLUMNS,
+]
 
-def get_data() -> pd.DataFrame:
+
+def fetch_frame(cursor, query, parameters=None) -> pd.DataFrame:
+    """
+    Run a query and build a DataFrame straight from its NumPy columns,
+    skipping the row-wise conversion of `fetchdf`.
     """
-    Function that automatically connects
-    to duckdb as a GET call upon launch
-    of FastAPI
+    columns = cursor.execute(query, parameters or []).fetchnumpy()
+    for name, column in columns.items():
+        if isinstance(column, np.ma.MaskedArray):
+            # NULLs become NaN in numeric columns and None otherwise
+            numeric = column.dtype.kind in "iuf"
+            columns[name] = (
+                column.astype(np.float64).filled(np.nan) if numeric else column.filled(None)
+            )
+    return pd.DataFrame(columns)
+
+
+def get_data(conn=None) -> pd.DataFrame:
+    """
+    Function that reads the columns the model needs
+    from the movie_genre_data table, through the shared
+    read-only connection of `app/database.py`.
+
+    Parameters
+    ----------
+    conn : duckdb.DuckDBPyConnection, optional
+        A connection to read with instead, e.g. the read-write
+        connection of a pipeline stage, since DuckDB does not
+        open one file both read-only and read-write in a process.
     """
 
-    con = duckdb.connect("movies_data.duckdb")
-    logging.info('Connection opened')
     try:
-        query = "SELECT * FROM movie_genre_data"
-        df = con.execute(query).fetchdf()
+        session = contextlib.nullcontext(conn) if conn else get_database().cursor()
+        with session as cursor:
+            df = fetch_frame(cursor, f"""
+                SELECT {", ".join(MODEL_COLUMNS)}
+                FROM movie_genre_data
+            """)
         logging.info('Data retrieved')
         return df
     except Exception as e:
         logging.error(f"An error occurred during fetching data: {e}")
         return pd.DataFrame()
-    finally:
-        con.close()
-        logging.info('Connection closed')
+
+
+def iter_data(batch_size, conn=None):
+    """
+    Read the columns the model needs from the movie_genre_data
+    table in batches of rows, in the order `get_data` returns them.
+
+    Batches are ranges of the table's row ids, read one query at a
+    time through the shared read-only connection of
+    `app/database.py`, so only one batch is held at once.
+
+    Parameters
+    ----------
+    batch_size : int
+        Rows per batch. Batches can be smaller if rows were deleted.
+    conn : duckdb.DuckDBPyConnection, optional
+        A connection to read with instead, see `get_data`.
+
+    Yields
+    ------
+    pd.DataFrame
+        The movies of every non-empty batch.
+    """
+    query = f"""
+        SELECT {", ".join(MODEL_COLUMNS)}
+        FROM movie_genre_data
+        WHERE rowid >= ? AND rowid < ?
+    """
+    try:
+        session = contextlib.nullcontext(conn) if conn else get_database().cursor()
+        with session as cursor:
+            last_row = cursor.execute("SELECT max(rowid) FROM movie_genre_data").fetchone()[0]
+            for start in range(0, (last_row if last_row is not None else -1) + 1, batch_size):
+                df = fetch_frame(cursor, query, [start, start + batch_size])
+                if not df.empty:
+                    yield df
+        logging.info('Data retrieved in batches')
+    except Exception as e:
+        # A partial read must not pass for the whole table
+        logging.error(f"An error occurred during fetching data: {e}")
+        raise
+
+
+def get_neighbors() -> pd.DataFrame:
+    """
+    Function that reads the precomputed neighbour table
+    written by the `etl/neighbors.py` pipeline stage.
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns movie_id, rank, neighbor_id and score,
+        or an empty DataFrame if the table is missing.
+    """
+
+    try:
+        with get_database().cursor() as cursor:
+            df = fetch_frame(cursor, """
+                SELECT movie_id, rank, neighbor_id, score
+                FROM movie_neighbors
+                ORDER BY movie_id, rank
+            """)
+        logging.info('Neighbours retrieved')
+        return df
+    except Exception as e:
+        logging.info(f"No precomputed neighbours available: {e}")
+        return pd.DataFrame()
+
+
+def get_source_checksum() -> str:
+    """
+    Function that fingerprints the movie_genre_data table
+    so that model artifacts built from it can be checked
+    for staleness without reading the whole table into pandas.
+
+    Returns
+    -------
+    str
+        A checksum of the columns the model is built from,
+        or an empty string if the table cannot be read.
+    """
+
+    try:
+        with get_database().cursor() as cursor:
+            count, total = cursor.execute("""
+                SELECT count(*), sum(hash(
+                    id, title, overview, genre_names, release_date,
+                    original_language, popularity, vote_average, vote_count
+                )::HUGEINT)
+                FROM movie_genre_data
+            """).fetchone()
+        return hashlib.sha256(f"{count}:{total}".encode()).hexdigest()
+    except Exception as e:
+        logging.error(f"An error occurred during checksumming data: {e}")
+        return ""
+
+
+def get_latest_run_id() -> int:
+    """
+    Function that reads the last run logged in movies_changelog
+    by incremental extractions, see `etl/extract.py`.
+
+    Returns
+    -------
+    int
+        The last run id, or 0 if there is no changelog.
+    """
+
+    try:
+        with get_database().cursor() as cursor:
+            query = "SELECT coalesce(max(run_id), 0) FROM movies_changelog"
+            return cursor.execute(query).fetchone()[0]
+    except Exception as e:
+        logging.info(f"No movie changelog available: {e}")
+        return 0
+
+
+def get_movie_changes(since_run_id=0):
+    """
+    Function that reads the movies changed by incremental
+    extractions after a changelog run, in the same shape as
+    `retrieve_and_transform_data`, so a model can be updated
+    without reading the whole catalogue.
+
+    Parameters
+    ----------
+    since_run_id : int, optional
+        The last run already applied. Default is 0, every run.
+
+    Returns
+    -------
+    changed : pd.DataFrame
+        The inserted or updated movies, with lowercase titles
+        and a "combined" column.
+
+    removed_ids : numpy.ndarray
+        The ids of deleted movies and of changed movies that are
+        no longer recommendable, e.g. because they lost all votes.
+
+    run_id : int
+        The last run read, `since_run_id` if there is none.
+    """
+
+    latest_changes = """
+        SELECT movie_id, change FROM movies_changelog
+        WHERE run_id > ? AND run_id <= ?
+        QUALIFY row_number() OVER (PARTITION BY movie_id ORDER BY run_id DESC) = 1
+    """
+    try:
+        with get_database().cursor() as cursor:
+            run_id = cursor.execute(
+                "SELECT coalesce(max(run_id), ?) FROM movies_changelog", [since_run_id]
+            ).fetchone()[0]
+            # Same columns and filter as movie_genre_data in etl/eda.ipynb
+            changed = fetch_frame(cursor, f"""
+                WITH latest_changes AS ({latest_changes}),
+                genre_names AS (
+                    SELECT mg.id AS movie_id, STRING_AGG(g.name, ', ') AS genre_names
+                    FROM (
+                        SELECT id, UNNEST(genre_ids) AS movie_genre_id FROM movies
+                        WHERE id IN (
+                            SELECT movie_id FROM latest_changes WHERE change != 'deleted'
+                        )
+                    ) AS mg
+                    JOIN genres g ON mg.movie_genre_id = g.id
+                    GROUP BY mg.id
+                )
+                SELECT {", ".join(f"m.{column}" for column in MODEL_COLUMNS if column != "genre_names")},
+                       gn.genre_names
+                FROM genre_names gn
+                JOIN movies m
+                ON gn.movie_id = m.id
+                WHERE m.vote_count != 0
+            """, [since_run_id, run_id])
+            changed_ids = cursor.execute(
+                latest_changes, [since_run_id, run_id]
+            ).fetchnumpy()["movie_id"]
+        removed_ids = np.setdiff1d(changed_ids, changed["id"].values)
+        changed["title"] = changed["title"].str.lower()
+        changed = create_combined(changed)
+        logging.info(
+            f'Read {len(changed)} changed and {len(removed_ids)} removed movies '
+            f'up to run {run_id}'
+        )
+        return changed, removed_ids, run_id
+    except Exception as e:
+        logging.info(f"No movie changes available: {e}")
+        return pd.DataFrame(), np.empty(0, dtype=np.int64), since_run_id
 
 
 def create_combined(df: pd.DataFrame, weight=2):
@@ -36,24 +259,81 @@ def create_combined(df: pd.DataFrame, weight=2):
     return df
 
 
-def retrieve_and_transform_data() -> pd.DataFrame:
+def retrieve_and_transform_data(conn=None) -> pd.DataFrame:
     """
     Retrieve data from duckdb and transform it
     into a format that can be used for generating
     movie recommendations.
 
+    Parameters
+    ----------
+    conn : duckdb.DuckDBPyConnection, optional
+        A connection to read with, see `get_data`.
+
     Returns
     -------
     pd.DataFrame
         The transformed DataFrame with an additional "combined" column.
     """
-    df = get_data()
+    df = get_data(conn)
     df["title"] = df["title"].str.lower()
     df = create_combined(df)
     logging.info('Data sucesfully retrieved and transformed')
     return df
 
 
+def retrieve_and_transform_batches(batch_size, conn=None):
+    """
+    Retrieve and transform the movies like `retrieve_and_transform_data`,
+    one batch of rows at a time, see `iter_data`.
+
+    Parameters
+    ----------
+    batch_size : int
+        Rows per batch.
+    conn : duckdb.DuckDBPyConnection, optional
+        A connection to read with, see `get_data`.
+
+    Yields
+    ------
+    pd.DataFrame
+        The movies of every batch, with the "combined" column.
+    """
+    for df in iter_data(batch_size, conn):
+        df["title"] = df["title"].str.lower()
+        yield create_combined(df)
+
+
+def fit_tfidf_vectorizer(df, stop_words="english"):
+    """
+    Fit a TF-IDF vectorizer on the "combined" column
+    in the provided DataFrame and keep the fitted model.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The input DataFrame which must contain
+        a "combined" column.
+
+    stop_words : str, optional
+        The language of stop words to be
+        used when vectorizing the "combined" column.
+        Default is "english".
+
+    Returns
+    -------
+    tfidf : TfidfVectorizer
+        The fitted vectorizer.
+
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The TF-IDF vectorization of the "combined" column.
+    """
+    tfidf = TfidfVectorizer(stop_words=stop_words)
+    tfidf_matrix = tfidf.fit_transform(df['combined'])
+    logging.info('TFID vectorizer sucessfully fitted')
+    return tfidf, tfidf_matrix
+
+
 def compute_tfidf_vectorization(df, stop_words="english"):
     """
     Compute TF-IDF vectorization of the "combined" column
@@ -75,8 +355,7 @@ def compute_tfidf_vectorization(df, stop_words="english"):
     tfidf_matrix:    scipy.sparse.csr.csr_matrix
         The TF-IDF vectorization of the "combined" column."""
     try:
-        tfidf = TfidfVectorizer(stop_words=stop_words)
-        tfidf_matrix = tfidf.fit_transform(df['combined'])
+        _, tfidf_matrix = fit_tfidf_vectorizer(df, stop_words)
         logging.info('TFID matrix sucessfully created')
         return tfidf_matrix
     except Exception as e:
@@ -84,164 +363,436 @@ def compute_tfidf_vectorization(df, stop_words="english"):
         return np.array([])
 
 
-def content_movie_recommender(
-    input_movie: str,
-    similarity_database: pd.DataFrame,
-    movie_database_list: list,
-    top_n=10,
-) -> list:
+def normalize_rows(tfidf_matrix):
     """
-    Function that uses a similarity matrix to find similar movies
+    L2-normalise the rows of a TF-IDF matrix so that the
+    dot product of two rows is their cosine similarity.
 
     Parameters
     ----------
-    input_movie : str
-        reference movie to find similarities
-    similarity_database : pandas.DataFrame
-        similarity matrix of movies
-    movie_database_list : numpy.ndarray
-        movies in our similarity matrix
-    top_n : int
-        number of similar movies to output
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The TF-IDF matrix, one row per movie.
+
+    Returns
+    -------
+    scipy.sparse.csr.csr_matrix
+        The row-normalised matrix in CSR format.
     """
-    try:
-        # Get movie similarity
-        movie_sim = similarity_database[similarity_database.index ==
-                                        input_movie].values[0]
-        # Get movies sorted by similarity
-        # [::-1] to sort in descending order
-        sorted_movies_ids = np.argsort(movie_sim)[::-1]
-        # Get top n movies
-        # [1:top_n+1] to exclude the input movie
-        recommended_movies = movie_database_list[sorted_movies_ids][1:top_n+1]
-        return list(recommended_movies)
-    except IndexError:
-        return []
+    return normalize(sparse.csr_matrix(tfidf_matrix), norm="l2", copy=False)
+
 
-def get_popularity_rmse(
-    df: pd.DataFrame, sample_movie: str, recommendations: list
-) -> float:
+def top_k_rows(scores: np.ndarray, k: int, exclude=None):
     """
-    Compute RMSE for popularity, vote average, and vote count
-    for the provided movie and recommendations.
-    
+    Get the columns of the k highest scores in every row, best first.
+
+    Uses `np.argpartition` along the rows so only the k selected
+    scores per row are sorted, and ties keep their column order.
+
     Parameters
     ----------
-    df : pd.DataFrame
-        The input DataFrame which must contain
-        a "title" column.
-    
-    sample_movie : str
-        The title of the movie for which
-        recommendations are to be generated.
-        
-    recommendations : list
-        A list of recommended movies.
-        
+    scores : numpy.ndarray
+        Dense 2-D array with one row of scores per query.
+    k : int
+        Number of columns to return per row.
+    exclude : array-like, optional
+        One column per row that must not be returned,
+        e.g. the query movie itself, or -1 for none.
+        If only some rows exclude one and all columns are
+        asked for, theirs end with an excluded -inf score.
+
     Returns
     -------
-    popularity_rmse : float
-        The RMSE for popularity.
-        """
-    # Convert titles in dataframe and sample_movie to lowercase
-    df["title"] = df["title"].str.lower()
-    sample_movie = sample_movie.lower()
+    columns : numpy.ndarray
+        Array of shape (n_rows, k) with the selected columns.
+    top_scores : numpy.ndarray
+        The scores of the selected columns.
+    """
+    scores = np.array(scores, dtype=np.float64, ndmin=2)
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if exclude is not None:
+        exclude = np.asarray(exclude)
+        excluded = exclude >= 0
+        scores[np.flatnonzero(excluded), exclude[excluded]] = -np.inf
+        # Rows that exclude nothing keep k columns, the others get -inf last
+        k = min(k, n_cols - bool(excluded.all()))
+    if k <= 0:
+        return (
+            np.empty((n_rows, 0), dtype=np.intp),
+            np.empty((n_rows, 0), dtype=np.float64),
+        )
+
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.lexsort((top, -top_scores), axis=-1)
+    return (
+        np.take_along_axis(top, order, axis=1),
+        np.take_along_axis(top_scores, order, axis=1),
+    )
+
+
+def pad_unmatched(rows: np.ndarray, scores: np.ndarray):
+    """
+    Mark the results of a batched top-k that matched nothing.
 
-    filtered_df = df[df["title"] == sample_movie]
+    A filter or an excluded reference movie can leave some queries of
+    a batch with fewer results than others. Their missing results have
+    a score of -inf and are replaced by row -1, at the end of each row
+    since results are sorted. Only columns that are missing for every
+    query are dropped, so no query loses results to another one.
 
-    if not filtered_df.empty:
-        sample_movie_popularity = filtered_df.popularity.iloc[0]
-        recommendations_popularity = df[
-            df["title"].isin(recommendations)
-        ].popularity.values
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        The result rows, shape (n_queries, k), best first.
+    scores : numpy.ndarray
+        Their scores, -inf for masked rows.
 
-        squared_diffs = (
-            sample_movie_popularity - recommendations_popularity
-        ) ** 2  # noqa E501
-        rmse = np.sqrt(squared_diffs.mean())
+    Returns
+    -------
+    rows : numpy.ndarray
+        The rows, -1 where a query has no further result.
+    scores : numpy.ndarray
+        The scores, -inf where a query has no further result.
+    """
+    matched = np.isfinite(scores)
+    keep = matched.any(axis=0)
+    return np.where(matched, rows, -1)[:, keep], scores[:, keep]
 
-        return round(float(rmse), 3)
-    else:
-        return float("nan")
-    
 
-def get_vote_avg_rmse(
-    df: pd.DataFrame, sample_movie: str, recommendations: list
-) -> float:
+def top_k_indices(scores: np.ndarray, k: int, exclude=None) -> np.ndarray:
     """
-    Compute RMSE for popularity, vote average, and vote count
-    for the provided movie and recommendations.
-    
+    Get the indices of the k highest scores, best first.
+
     Parameters
     ----------
-    df : pd.DataFrame
-        The input DataFrame which must contain
-        a "title" column.
-        
-    sample_movie : str
-        The title of the movie for which
-        recommendations are to be generated.
-        
-    recommendations : list
-        A list of recommended movies.
-        
+    scores : numpy.ndarray
+        One score per movie.
+    k : int
+        Number of indices to return.
+    exclude : int, optional
+        An index that must not be returned, e.g. the query movie.
+
     Returns
     -------
-    popularity_rmse : float
-        The RMSE for popularity."""
-    sample_movie_vote_average = df[
-        df["title"] == sample_movie
-    ].vote_average.iloc[  # noqa E501
-        0
-    ]
-    recommendations_vote_average = df[
-        df["title"].isin(recommendations)
-    ].vote_average.values
+    numpy.ndarray
+        Up to k indices sorted by descending score.
+    """
+    columns, _ = top_k_rows(
+        np.ravel(scores), k, exclude=None if exclude is None else [exclude]
+    )
+    return columns[0]
 
-    squared_diffs = (
-        sample_movie_vote_average - recommendations_vote_average
-    ) ** 2  # noqa E501
-    rmse = np.sqrt(squared_diffs.mean())
 
-    return round(float(rmse), 3)
+def compute_top_k_neighbors(tfidf_matrix, k=50, chunk_size=1000):
+    """
+    Compute every movie's top-k most similar movies.
+
+    Similarities are computed in blocks of `chunk_size` rows, so
+    peak memory is about `chunk_size * n_movies * 8` bytes for the
+    dense block plus the output, whatever the catalogue size.
 
-def get_vote_count_rmse(
-    df: pd.DataFrame, sample_movie: str, recommendations: list
-) -> float:
+    Parameters
+    ----------
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The L2-normalised TF-IDF matrix, one row per movie.
+    k : int, optional
+        Number of neighbours per movie. Default is 50.
+    chunk_size : int, optional
+        Number of movies scored per block. Default is 1000.
+
+    Yields
+    ------
+    start : int
+        The first row of the block.
+    neighbors : numpy.ndarray
+        Array of shape (block_size, k) with the neighbour rows,
+        best first, never including the movie itself.
+    scores : numpy.ndarray
+        The cosine similarity of each neighbour.
     """
-    
-    Compute RMSE for popularity, vote average, and vote count
-    for the provided movie and recommendations.
-    
+    n_movies = tfidf_matrix.shape[0]
+    matrix_t = tfidf_matrix.T.tocsc()
+    for start in range(0, n_movies, chunk_size):
+        stop = min(start + chunk_size, n_movies)
+        block = (tfidf_matrix[start:stop] @ matrix_t).toarray()
+        neighbors, scores = top_k_rows(block, k, exclude=np.arange(start, stop))
+        logging.info(f'Computed neighbours for movies {start} to {stop}')
+        yield start, neighbors, scores
+
+
+def update_top_k_neighbors(
+    tfidf_matrix, neighbors, scores, row_map, changed_rows, chunk_size=1000, term_matrix=None
+):
+    """
+    Update precomputed top-k neighbours after some movies changed.
+
+    Scores between unchanged movies stay the same, so a movie whose
+    stored neighbours are all unchanged only has to be compared with
+    the changed movies. The changed movies, and those that lost a
+    neighbour and may now need one beyond the stored k, are scored
+    against the whole catalogue again.
+
     Parameters
     ----------
-    df : pd.DataFrame
-        The input DataFrame which must contain
-        a "title" column.
-        
-    sample_movie : str
-        The title of the movie for which
-        recommendations are to be generated.
-        
-    recommendations : list
-        A list of recommended movies.
-        
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The updated L2-normalised TF-IDF matrix, one row per movie.
+    neighbors : numpy.ndarray
+        The old neighbour rows, shape (n_old_movies, k), best first.
+    scores : numpy.ndarray
+        The cosine similarity of each old neighbour.
+    row_map : numpy.ndarray
+        The new row of every old row, -1 for movies that were
+        removed or whose text changed.
+    changed_rows : numpy.ndarray
+        The new rows of the added or changed movies.
+    chunk_size : int, optional
+        Number of movies scored per block. Default is 1000.
+    term_matrix : scipy.sparse.csr.csr_matrix, optional
+        `tfidf_matrix` transposed to CSR, see `similar_movie_rows_batch`.
+
     Returns
     -------
-        popularity_rmse : float
-        The RMSE for popularity.
+    neighbors : numpy.ndarray
+        Array of shape (n_movies, k) with the neighbour rows, best
+        first, fewer columns if the catalogue shrank below k + 1.
+    scores : numpy.ndarray
+        The cosine similarity of each neighbour.
+    """
+    n_movies = tfidf_matrix.shape[0]
+    k = min(neighbors.shape[1], max(n_movies - 1, 0))
+    new_neighbors = np.empty((n_movies, k), dtype=neighbors.dtype)
+    new_scores = np.empty((n_movies, k), dtype=scores.dtype)
+    changed_rows = np.asarray(changed_rows, dtype=np.intp)
+
+    kept = np.flatnonzero(row_map >= 0)
+    kept_neighbors = row_map[neighbors[kept]]
+    intact = (kept_neighbors >= 0).all(axis=1)
+    intact_rows = row_map[kept[intact]]
+    kept_neighbors, kept_scores = kept_neighbors[intact], scores[kept[intact]]
+    changed_t = tfidf_matrix[changed_rows].T.tocsc()
+    for start in range(0, len(intact_rows), chunk_size):
+        block = slice(start, start + chunk_size)
+        candidates = np.hstack([
+            kept_neighbors[block],
+            np.broadcast_to(changed_rows, (len(intact_rows[block]), len(changed_rows))),
+        ])
+        candidate_scores = np.hstack([
+            kept_scores[block], (tfidf_matrix[intact_rows[block]] @ changed_t).toarray()
+        ])
+        top, top_scores = top_k_rows(candidate_scores, k)
+        new_neighbors[intact_rows[block]] = np.take_along_axis(candidates, top, axis=1)
+        new_scores[intact_rows[block]] = top_scores
+
+    stale_rows = np.union1d(changed_rows, row_map[kept[~intact]])
+    if len(stale_rows):
+        rows, rows_scores = similar_movie_rows_batch(
+            stale_rows, tfidf_matrix, k, chunk_size, term_matrix=term_matrix
+        )
+        new_neighbors[stale_rows], new_scores[stale_rows] = rows, rows_scores
+    logging.info(
+        f'Updated neighbours: {len(intact_rows)} movies merged, '
+        f'{len(stale_rows)} scored again'
+    )
+    return new_neighbors, new_scores
+
+
+def similar_movie_rows(movie_row: int, tfidf_matrix, top_n=10):
+    """
+    Find the rows most similar to a movie with sparse row-wise scoring.
+
+    Only the query row's similarities are computed: one sparse row
+    times the L2-normalised TF-IDF matrix, so memory grows linearly
+    with the catalogue instead of with its square.
+
+    Parameters
+    ----------
+    movie_row : int
+        The row of the reference movie.
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The L2-normalised TF-IDF matrix, one row per movie.
+    top_n : int
+        Number of similar movies to output.
+
+    Returns
+    -------
+    rows : numpy.ndarray
+        The rows of the most similar movies, best first,
+        excluding the reference movie.
+    scores : numpy.ndarray
+        The cosine similarity of each returned row.
+    """
+    scores = (tfidf_matrix[movie_row] @ tfidf_matrix.T).toarray().ravel()
+    rows = top_k_indices(scores, top_n, exclude=movie_row)
+    return rows, scores[rows]
+
+
+def similar_movie_rows_batch(
+    movie_rows, tfidf_matrix, top_n=10, chunk_size=512, candidates=None, term_matrix=None
+):
+    """
+    Find the rows most similar to each of several movies at once.
+
+    The similarities of up to `chunk_size` movies are computed in one
+    sparse matrix-matrix product followed by a vectorized top-k, which
+    keeps the dense score block at `chunk_size * n_movies` floats.
+
+    When the recommendations are restricted to `candidates`, the other
+    rows are masked out before the top-k. If the candidates are fewer
+    than half the movies, only they are scored, so a selective filter
+    makes the query cheaper rather than more expensive.
+
+    Parameters
+    ----------
+    movie_rows : array-like
+        The rows of the reference movies.
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The L2-normalised TF-IDF matrix, one row per movie.
+    top_n : int
+        Number of similar movies to output per reference movie.
+    chunk_size : int, optional
+        Number of reference movies scored per product. Default is 512.
+    candidates : numpy.ndarray, optional
+        Sorted rows the recommendations are restricted to, e.g. the
+        movies matching a filter. Default is all rows.
+    term_matrix : scipy.sparse.csr.csr_matrix, optional
+        `tfidf_matrix` transposed to CSR, see `similar_query_rows`.
+
+    Returns
+    -------
+    rows : numpy.ndarray
+        Array of shape (len(movie_rows), top_n) with the most similar
+        rows of each reference movie, best first, excluding itself.
+        There are fewer columns if fewer candidates are left, and
+        padding -1 for movies left with fewer than the others.
+    scores : numpy.ndarray
+        The cosine similarity of each returned row, -inf for padding.
+    """
+    movie_rows = np.asarray(movie_rows, dtype=np.intp)
+    return similar_query_rows(
+        tfidf_matrix[movie_rows], tfidf_matrix, top_n, chunk_size, candidates,
+        exclude=movie_rows, term_matrix=term_matrix,
+    )
+
+
+def similar_query_rows(
+    queries, tfidf_matrix, top_n=10, chunk_size=512, candidates=None, exclude=None,
+    term_matrix=None,
+):
     """
-    sample_movie_popularity = df[df["title"] == sample_movie].vote_count.iloc[
-        0
-    ]  # noqa E501
-    recommendations_popularity = df[
-        df["title"].isin(recommendations)
-    ].vote_count.values  # noqa E501
+    Find the rows most similar to each of several TF-IDF vectors,
+    e.g. movies of the matrix or vectorized free-text queries.
 
-    squared_diffs = (recommendations_popularity - sample_movie_popularity) ** 2
-    rmse = np.sqrt(squared_diffs.mean())
+    See `similar_movie_rows_batch`, which calls this with the rows of
+    the reference movies.
 
-    return round(float(rmse), 3)
+    Parameters
+    ----------
+    queries : scipy.sparse.csr.csr_matrix
+        The L2-normalised TF-IDF vectors, one row per query, in the
+        vocabulary of `tfidf_matrix`.
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        The L2-normalised TF-IDF matrix, one row per movie.
+    top_n : int
+        Number of similar movies to output per query.
+    chunk_size : int, optional
+        Number of queries scored per product. Default is 512.
+    candidates : numpy.ndarray, optional
+        Sorted rows the results are restricted to. Default is all rows.
+    exclude : numpy.ndarray, optional
+        A row to leave out per query, -1 for none. Default is None.
+    term_matrix : scipy.sparse.csr.csr_matrix, optional
+        `tfidf_matrix` transposed to CSR, one row per term. Scoring with
+        it only visits the movies sharing a term with the queries,
+        instead of converting the whole matrix for every product.
+
+    Returns
+    -------
+    rows : numpy.ndarray
+        Array of shape (n_queries, top_n) with the most similar rows
+        of each query, best first. There are fewer columns if fewer
+        candidates are left, and a query left with fewer candidates
+        than the others is padded with -1, see `pad_unmatched`.
+    scores : numpy.ndarray
+        The cosine similarity of each returned row, -inf for padding.
+    """
+    n_queries = queries.shape[0]
+    n_movies = tfidf_matrix.shape[0]
+    if exclude is not None:
+        exclude = np.asarray(exclude, dtype=np.intp)
+    columns = None
+    penalty = None
+    if candidates is not None and 2 * len(candidates) < n_movies:
+        columns = np.asarray(candidates, dtype=np.intp)
+        matrix_t = tfidf_matrix[columns].T.tocsr()
+    else:
+        matrix_t = term_matrix if term_matrix is not None else tfidf_matrix.T.tocsr()
+        if candidates is not None:
+            penalty = np.full(n_movies, -np.inf)
+            penalty[candidates] = 0.0
+    if matrix_t.shape[1] == 0:
+        return np.empty((n_queries, 0), dtype=np.intp), np.empty((n_queries, 0))
+    if candidates is not None:
+        top_n = min(top_n, len(candidates))
+
+    rows, scores = [], []
+    for start in range(0, n_queries, chunk_size):
+        block = (queries[start:start + chunk_size] @ matrix_t).toarray()
+        block_exclude = None if exclude is None else exclude[start:start + chunk_size]
+        if penalty is not None:
+            block += penalty
+        if columns is not None and block_exclude is not None:
+            # The excluded rows are only left out where they are candidates
+            positions = np.minimum(np.searchsorted(columns, block_exclude), len(columns) - 1)
+            block_exclude = np.where(columns[positions] == block_exclude, positions, -1)
+        block_top, block_scores = top_k_rows(block, top_n, exclude=block_exclude)
+        if columns is not None:
+            block_top = columns[block_top]
+        rows.append(block_top)
+        scores.append(block_scores)
+    if not rows:
+        return np.empty((0, 0), dtype=np.intp), np.empty((0, 0))
+    rows, scores = np.vstack(rows), np.vstack(scores)
+    if candidates is not None:
+        # Fewer candidates than asked for leave masked or excluded rows at the end
+        rows, scores = pad_unmatched(rows, scores)
+    return rows, scores
+
+
+def content_movie_recommender(
+    movie_row: int,
+    tfidf_matrix,
+    movie_database_list,
+    top_n=10,
+    ann_index=None,
+    nprobe=8,
+) -> list:
+    """
+    Function that uses the TF-IDF matrix to find similar movies
+
+    Parameters
+    ----------
+    movie_row : int
+        row of the reference movie to find similarities
+    tfidf_matrix : scipy.sparse.csr.csr_matrix
+        L2-normalised TF-IDF matrix of movies
+    movie_database_list : numpy.ndarray
+        movies in our TF-IDF matrix, in row order
+    top_n : int
+        number of similar movies to output
+    ann_index : AnnIndex, optional
+        approximate index to search instead of scoring every movie
+    nprobe : int, optional
+        number of index lists scanned, see `AnnIndex.search`
+    """
+    try:
+        if ann_index is not None:
+            rows, _ = ann_index.similar_rows([movie_row], tfidf_matrix, top_n, nprobe)
+            return list(movie_database_list[rows[0]])
+        rows, _ = similar_movie_rows(movie_row, tfidf_matrix, top_n)
+        return list(movie_database_list[rows])
+    except IndexError:
+        return []
 
 def compute_metrics(df, movie, recommendations):
     """
@@ -272,7 +823,79 @@ def compute_metrics(df, movie, recommendations):
         ote_count_rmse : float
         The RMSE for vote count.
     """
-    popularity_rmse = get_popularity_rmse(df, movie, recommendations)
-    vote_avg_rmse = get_vote_avg_rmse(df, movie, recommendations)
-    vote_count_rmse = get_vote_count_rmse(df, movie, recommendations)
+    titles = df["title"].str.lower()
+    movie_rows = np.flatnonzero(titles.values == movie.lower())
+    if not len(movie_rows):
+        return float("nan"), float("nan"), float("nan")
+
+    recommended_rows = np.flatnonzero(titles.isin(recommendations).values)
+    popularity_rmse, vote_avg_rmse, vote_count_rmse = compute_metrics_from_rows(
+        metric_matrix(df), movie_rows[0], recommended_rows
+    )[0]
     return popularity_rmse, vote_avg_rmse, vote_count_rmse
+
+
+def metric_matrix(df: pd.DataFrame) -> np.ndarray:
+    """
+    Stack the metric columns into one matrix indexed by row.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The input DataFrame which must contain
+        the columns in `METRIC_COLUMNS`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n_movies, 3) with the popularity,
+        vote average and vote count of every movie.
+    """
+    return df[METRIC_COLUMNS].to_numpy(dtype=np.float64)
+
+
+def compute_metrics_from_rows(metrics, movie_rows, recommended_rows) -> list:
+    """
+    Compute RMSE for popularity, vote average, and vote count
+    from row indices in one vectorized operation.
+
+    Parameters
+    ----------
+    metrics : numpy.ndarray
+        Array of shape (n_movies, 3) from `metric_matrix`.
+
+    movie_rows : int or array-like
+        The row of each reference movie.
+
+    recommended_rows : array-like
+        The recommended rows, with one row of
+        recommendations per reference movie.
+        Padding rows of -1 are left out.
+
+    Returns
+    -------
+    list
+        One (popularity_rmse, vote_avg_rmse, vote_count_rmse)
+        tuple per reference movie, rounded to 3 decimals.
+    """
+    movie_rows = np.atleast_1d(movie_rows)
+    if not len(movie_rows):
+        return []
+    recommended_rows = np.asarray(recommended_rows, dtype=np.intp).reshape(
+        len(movie_rows), -1
+    )
+    if not recommended_rows.shape[1]:
+        return [(float("nan"),) * len(METRIC_COLUMNS)] * len(movie_rows)
+    # (n_movies, n_recommendations, 3) - (n_movies, 1, 3)
+    # Metrics may be stored as float32, compute in float64
+    squared_diffs = (
+        metrics[recommended_rows].astype(np.float64)
+        - metrics[movie_rows][:, np.newaxis, :].astype(np.float64)
+    ) ** 2
+    recommended = recommended_rows >= 0
+    squared_diffs[~recommended] = 0.0
+    with np.errstate(invalid="ignore"):
+        rmse = np.sqrt(
+            squared_diffs.sum(axis=1) / recommended.sum(axis=1)[:, np.newaxis]
+        )
+    return [tuple(round(float(value), 3) for value in row) for row in rmse]
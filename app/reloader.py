@@ -0,0 +1,256 @@
+import asyncio
+import gc
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .artifact import load_or_build_engine
+from .config import ARTIFACT_DIR
+from .database import get_database
+from .recommenderhelper import get_latest_run_id, get_source_checksum
+from .titleindex import normalize_title
+
+
+def validate_engine(engine, reference=None, top_n=5, min_ratio=0.5):
+    """
+    Run smoke queries against a freshly built engine before it serves.
+
+    A few movies spread over the catalogue must resolve by their own
+    title and get `top_n` valid recommendations.
+
+    Parameters
+    ----------
+    engine : RecommenderEngine
+        The engine to check.
+    reference : RecommenderEngine, optional
+        The engine currently serving. The new catalogue must hold at
+        least `min_ratio` times as many movies, so a half-written
+        database is not swapped in.
+    top_n : int, optional
+        Number of recommendations asked for. Default is 5.
+    min_ratio : float, optional
+        Smallest allowed size relative to `reference`. Default is 0.5.
+
+    Raises
+    ------
+    ValueError
+        If a check fails.
+    """
+    n_movies = len(engine)
+    if n_movies == 0:
+        raise ValueError("Engine has no movies")
+    if engine.tfidf_matrix.shape[0] != n_movies or len(engine.metrics) != n_movies:
+        raise ValueError("Engine arrays do not match its catalogue")
+    if reference is not None and n_movies < min_ratio * len(reference):
+        raise ValueError(
+            f"Engine has {n_movies} movies, the serving one has {len(reference)}"
+        )
+
+    rows = np.unique(np.linspace(0, n_movies - 1, num=min(n_movies, 5)).astype(int))
+    for row in rows:
+        title = engine.movie_list[row]
+        found = engine.lookup(title)
+        if found is None or normalize_title(engine.movie_list[found]) != normalize_title(title):
+            raise ValueError(f"Title {title!r} does not resolve to itself")
+
+    top_n = min(top_n, n_movies - 1)
+    similar = engine.similar_rows(rows, top_n)
+    if similar.shape != (len(rows), top_n):
+        raise ValueError(f"Expected {top_n} recommendations, got {similar.shape[1]}")
+    if ((similar < 0) | (similar >= n_movies)).any() or (similar == rows[:, None]).any():
+        raise ValueError("Recommendations point outside the catalogue")
+
+
+class ModelReloader:
+    """
+    Replace the serving engine when the data or model changes,
+    without restarting the API.
+
+    A new engine is built on a background thread while the current
+    one keeps serving, checked with `validate_engine` and then
+    swapped in with a single reference assignment. Requests hold on
+    to the engine they started with, so in-flight requests finish on
+    the old version, which is freed once the last of them is done.
+
+    Only one engine is built at a time and a reload requested during
+    a build is dropped, so at most two engines are ever in memory.
+    Artifacts are memory-mapped, which keeps the second one small.
+
+    Parameters
+    ----------
+    engine : RecommenderEngine
+        The engine serving now.
+
+    stop_words : str, optional
+        The language of stop words of the vectorizer.
+        Default is "english".
+
+    root : str, optional
+        The directory holding all artifact versions.
+
+    on_swap : callable, optional
+        Called with the new engine right after it is swapped in,
+        e.g. to publish it on the FastAPI app state.
+    """
+
+    def __init__(self, engine, stop_words="english", root=ARTIFACT_DIR, on_swap=None):
+        self.engine = engine
+        self.stop_words = stop_words
+        self.root = root
+        self.on_swap = on_swap
+        self.loaded_at = time.time()
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self._building = threading.Lock()
+        self._thread = None
+        self._signature = None
+
+    @property
+    def reloading(self) -> bool:
+        """Whether a new engine is being built."""
+        return self._building.locked()
+
+    def pending_change(self, probe=False):
+        """
+        Check the database for a newer version than the serving engine.
+
+        Parameters
+        ----------
+        probe : bool, optional
+            Answer None without reading the database if its files did
+            not change since the last check that could read them, so
+            polling does not checksum the source table every time.
+            Default is False.
+
+        Returns
+        -------
+        str or None
+            "full" if the source table changed, "incremental" if only
+            new changelog runs need applying, or None if up to date.
+        """
+        signature = get_database().signature()
+        if probe and signature == self._signature:
+            return None
+        checksum = get_source_checksum()
+        # An empty checksum means the database is unreadable, e.g. locked
+        # by a running pipeline, so try again later
+        if not checksum:
+            return None
+        self._signature = signature
+        if checksum != self.engine.source_checksum:
+            return "full"
+        if self.engine.text_model is not None and get_latest_run_id() > self.engine.run_id:
+            return "incremental"
+        return None
+
+    def reload(self, force=False) -> bool:
+        """
+        Start building a new engine in the background.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Rebuild even if the database did not change.
+            Default is False.
+
+        Returns
+        -------
+        bool
+            False if a build is already running, True otherwise.
+        """
+        if not self._building.acquire(blocking=False):
+            logging.info('Model reload already running, ignoring request')
+            return False
+        self._thread = threading.Thread(
+            target=self._reload, args=(force,), name="model-reload", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        """Wait for the running reload, if any, to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _reload(self, force):
+        try:
+            change = "full" if force else self.pending_change()
+            if change is None:
+                logging.info('Model is up to date, nothing to reload')
+                return
+            current = self.engine
+            if change == "incremental":
+                engine = current.refresh()
+            else:
+                engine = load_or_build_engine(self.stop_words, self.root)
+            validate_engine(engine, reference=current)
+            del current
+            self._swap(engine)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            # Check the database again at the next poll
+            self._signature = None
+            logging.error(f"Model reload failed, keeping the serving engine: {e}")
+        finally:
+            self._building.release()
+
+    def _swap(self, engine):
+        previous = self.engine.version
+        self.engine = engine
+        if self.on_swap is not None:
+            self.on_swap(engine)
+        self.loaded_at = time.time()
+        self.reloads += 1
+        self.last_error = None
+        # Free the old engine's arrays now rather than at the next collection
+        gc.collect()
+        logging.info(f'Model swapped from {previous} to {engine.version}')
+
+    def status(self) -> dict:
+        """
+        Get the serving version and the reload counters.
+
+        Returns
+        -------
+        dict
+            The version, the movies it holds, its changelog run,
+            when it was loaded and how reloads went.
+        """
+        engine = self.engine
+        return {
+            "version": engine.version,
+            "movies": len(engine),
+            "run_id": engine.run_id,
+            "loaded_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.loaded_at)
+            ),
+            "reloading": self.reloading,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    async def watch(self, interval: float):
+        """
+        Poll the database every `interval` seconds and reload
+        when it changed. Runs until cancelled.
+
+        Polls only stat the database files until they change,
+        see `pending_change`.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                change = await asyncio.to_thread(self.pending_change, True)
+            except Exception as e:
+                logging.error(f"An error occurred while checking for a new model: {e}")
+                continue
+            if change is not None:
+                logging.info(f'New {change} model version available, reloading')
+                if not self.reload():
+                    # A build is running, check again once it is done
+                    self._signature = None
@@ -0,0 +1,62 @@
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from .telemetry import span
+
+
+class Metrics(BaseModel):
+    """RMSE between a movie and its recommendations."""
+
+    popularity: float
+    vote_avg: float
+    vote_count: float
+
+
+class RecommendationResult(BaseModel):
+    """Recommendations for one movie, as returned by `get_recommendation`."""
+
+    movie: str
+    recommendations: list[str]
+    metrics: Metrics
+
+
+class TextRecommendationResult(BaseModel):
+    """Movies matching a free-text query, as returned by `get_text_recommendation`."""
+
+    query: str
+    recommendations: list[str]
+    scores: list[float]
+
+
+class BatchRecommendationItem(BaseModel):
+    """
+    Recommendations for one movie of a batch.
+
+    Movies that are not found only have an `error`.
+    """
+
+    movie: str
+    recommendations: list[str] | None = None
+    metrics: Metrics | None = None
+    error: str | None = None
+
+
+class BatchRecommendationResult(BaseModel):
+    """Recommendations for every movie of a batch, in request order."""
+
+    results: list[BatchRecommendationItem]
+
+
+class ModelJSONResponse(JSONResponse):
+    """
+    JSON response rendered straight from a pydantic model.
+
+    `model_dump_json` serialises the model in one pass in pydantic-core,
+    without first converting it to dicts of Python objects as
+    `JSONResponse` does. NaN metrics are written as null. Fields that are
+    None are left out, so batch items carry either results or an error.
+    """
+
+    def render(self, content: BaseModel) -> bytes:
+        with span("serialize"):
+            return content.model_dump_json(exclude_none=True).encode("utf-8")
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent computations of the same key.
+
+    The first caller of a key runs the computation, callers arriving
+    while it is in flight wait for it and share its result or
+    exception. Nothing is kept once it finishes, so later callers
+    compute again; caching finished results is left to
+    `RecommendationCache`.
+
+    Works from threads with `do` and from the event loop with `run`,
+    which share one table of in-flight keys, so a synchronous and an
+    asynchronous caller of the same key are coalesced as well.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of keys being computed."""
+        return len(self._flights)
+
+    def _join(self, key):
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._flights[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        # Forget the key first, so callers arriving now compute again
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call `fn(*args, **kwargs)`, or wait for the call in flight for `key`.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the computation, callers with equal keys share it.
+        fn : callable
+            The computation.
+
+        Returns
+        -------
+        object
+            The result of the computation.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def run(self, key, factory):
+        """
+        Await `factory()`, or the awaitable in flight for `key`.
+
+        The computation runs as a task of its own, so a cancelled
+        caller, e.g. a client that disconnected, does not cancel it
+        for the others waiting on it.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the computation, callers with equal keys share it.
+        factory : callable
+            Returns the awaitable doing the computation.
+
+        Returns
+        -------
+        object
+            The result of the computation.
+        """
+        future, leader = self._join(key)
+        if leader:
+            try:
+                task = asyncio.ensure_future(factory())
+            except BaseException as e:
+                self._finish(key, future, error=e)
+                raise
+
+            def done(task):
+                if task.cancelled():
+                    self._finish(key, future, error=asyncio.CancelledError())
+                elif task.exception() is not None:
+                    self._finish(key, future, error=task.exception())
+                else:
+                    self._finish(key, future, task.result())
+
+            task.add_done_callback(done)
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def stats(self) -> dict:
+        """
+        Get the coalescing counters.
+
+        Returns
+        -------
+        dict
+            The computations run, the calls that shared one instead,
+            and the keys in flight.
+        """
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+            }
@@ -0,0 +1,194 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# Help text of every metric, also fixes the order they are rendered in
+DESCRIPTIONS = {
+    "movie_rec_requests_total": ("counter", "HTTP requests by endpoint and status code."),
+    "movie_rec_request_seconds": ("histogram", "HTTP request latency by endpoint."),
+    "movie_rec_stage_seconds": ("histogram", "Time spent in each stage of serving or building the model."),
+}
+
+# Per-request stage timings, set for requests that asked for X-Timing
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _label_string(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Telemetry:
+    """
+    Thread-safe counters and latency histograms of the API.
+
+    Stages of serving and building the model are timed with `span`,
+    which feeds the `movie_rec_stage_seconds` histogram and, for
+    requests that asked for it, the per-request breakdown sent in
+    the X-Timing header. Everything is rendered in the Prometheus
+    text format by `render`, without a client library.
+
+    Parameters
+    ----------
+    buckets : tuple, optional
+        Upper bounds in seconds of the histogram buckets.
+        Default is LATENCY_BUCKETS.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value=1, **labels):
+        """Add `value` to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Record a duration in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def record(self, stage: str, seconds: float):
+        """
+        Record the duration of a stage, in the stage histogram
+        and in the timings of the current request if it has any.
+        """
+        self.observe("movie_rec_stage_seconds", seconds, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        """Time the enclosed block as `stage`, see `record`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def counter(self, name: str, **labels):
+        """Get the value of a counter, 0 if it was never incremented."""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram_count(self, name: str, **labels) -> int:
+        """Get the number of durations recorded in a histogram."""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return histogram[2] if histogram is not None else 0
+
+    def render(self, gauges=None) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Parameters
+        ----------
+        gauges : dict, optional
+            Extra values read at scrape time, e.g. the catalogue size.
+            Keys are metric names, values are (type, help, samples)
+            where samples is a list of (labels dict, value).
+
+        Returns
+        -------
+        str
+            The exposition text.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._histograms.items()
+            }
+
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append((labels, value))
+        for (name, labels), value in histograms.items():
+            families.setdefault(name, []).append((labels, value))
+        descriptions = dict(DESCRIPTIONS)
+        for name, (kind, help_text, samples) in (gauges or {}).items():
+            descriptions[name] = (kind, help_text)
+            families[name] = [(tuple(sorted(labels.items())), value) for labels, value in samples]
+
+        lines = []
+        names = [name for name in descriptions if name in families]
+        names += sorted(name for name in families if name not in descriptions)
+        for name in names:
+            kind, help_text = descriptions.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(families[name], key=lambda sample: sample[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{_label_string(labels)} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += bucket_count
+                    bucket_labels = (*labels, ("le", bound if bound == "+Inf" else repr(bound)))
+                    lines.append(f"{name}_bucket{_label_string(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_label_string(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_label_string(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Telemetry of this process, shared by the API and the model code
+TELEMETRY = Telemetry()
+
+
+def span(stage: str):
+    """Time the enclosed block as a stage of the shared `TELEMETRY`."""
+    return TELEMETRY.span(stage)
+
+
+def start_request_timing() -> dict:
+    """
+    Collect the stage timings of the current request.
+
+    Returns
+    -------
+    dict
+        Seconds per stage, filled in as the request runs. Work run in
+        the compute pool is included as it runs in a copy of the context.
+    """
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def timing_header(timings: dict, total: float) -> str:
+    """
+    Format stage timings for the X-Timing header, in milliseconds,
+    e.g. "lookup;dur=0.041, exact_scoring;dur=12.503, total;dur=13.2".
+    """
+    stages = [*timings.items(), ("total", total)]
+    return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in stages)
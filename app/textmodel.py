@@ -0,0 +1,563 @@
+import logging
+import multiprocessing
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from .recommenderhelper import normalize_rows
+
+
+def smooth_idf(document_frequency, n_documents):
+    """
+    Compute IDF weights the way `TfidfVectorizer` does by default.
+
+    Parameters
+    ----------
+    document_frequency : numpy.ndarray
+        The number of documents containing each term.
+    n_documents : int
+        The number of documents.
+
+    Returns
+    -------
+    numpy.ndarray
+        `ln((1 + n) / (1 + df)) + 1` for every term.
+    """
+    return np.log((1 + n_documents) / (1 + np.asarray(document_frequency))) + 1
+
+
+def row_positions(indptr, rows):
+    """
+    Get the positions in `data` and `indices` of some CSR rows.
+
+    Parameters
+    ----------
+    indptr : numpy.ndarray
+        The CSR row pointer.
+    rows : array-like
+        The rows to gather.
+
+    Returns
+    -------
+    positions : numpy.ndarray
+        The stored entries of every row, concatenated in row order.
+    lengths : numpy.ndarray
+        The number of stored entries of every row.
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return positions, lengths
+
+
+def count_batch(documents, stop_words="english"):
+    """
+    Count the terms of a batch of documents in a vocabulary of its own.
+
+    Runs in the worker processes of `IncrementalTfidf.fit_batches`,
+    so it only takes and returns picklable arrays.
+
+    Parameters
+    ----------
+    documents : list of str
+        The texts to count.
+    stop_words : str, optional
+        The language of stop words. Default is "english".
+
+    Returns
+    -------
+    terms : numpy.ndarray
+        The sorted terms of the batch.
+    counts : scipy.sparse.csr.csr_matrix
+        The term counts of every document, one column per term in `terms`.
+    """
+    vectorizer = CountVectorizer(stop_words=stop_words)
+    try:
+        counts = vectorizer.fit_transform(documents).tocsr()
+    except ValueError:
+        # Every document of the batch is empty or stop words
+        return np.empty(0, dtype=object), sparse.csr_matrix((len(documents), 0))
+    return vectorizer.get_feature_names_out(), counts
+
+
+class IncrementalTfidf:
+    """
+    TF-IDF model whose documents can be added, replaced or removed
+    without refitting the whole corpus.
+
+    Alongside the L2-normalised TF-IDF rows the model keeps the raw
+    term counts of every document and the document frequency of every
+    term, so an update only tokenises the changed documents, adjusts
+    the frequencies of their terms and recomputes the IDF vector.
+    The vocabulary grows with unseen terms unless it is fixed.
+
+    Updated rows are weighted with the new IDF. Other rows keep the
+    weights they were last computed with, which drift slightly as
+    the corpus changes; `renormalize` reweights every row from the
+    stored counts, without tokenising anything, and runs on its own
+    once `renormalize_every` of the rows changed since the last time.
+
+    Rows are never modified in place, so matrices returned by
+    `matrix` stay valid after later updates and `copy` is cheap.
+
+    Parameters
+    ----------
+    stop_words : str, optional
+        The language of stop words. Default is "english".
+
+    vocabulary : dict, optional
+        A fixed mapping of term to column. Default is to learn
+        the vocabulary from the documents.
+
+    growable : bool, optional
+        Whether unseen terms are added to the vocabulary. If False
+        they are ignored, like `TfidfVectorizer.transform` does.
+        Default is True.
+
+    renormalize_every : float, optional
+        Fraction of rows that may be updated before all rows are
+        reweighted, e.g. 0.05. Default is None, only on request.
+    """
+
+    def __init__(
+        self, stop_words="english", vocabulary=None, growable=True,
+        renormalize_every=None,
+    ):
+        self.stop_words = stop_words
+        self.growable = growable
+        self.renormalize_every = renormalize_every
+        self.vocabulary = dict(vocabulary or {})
+        self.document_frequency = np.zeros(len(self.vocabulary), dtype=np.int64)
+        self.idf = smooth_idf(self.document_frequency, 0)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.stale_rows = 0
+        self._analyzer = CountVectorizer(stop_words=stop_words).build_analyzer()
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.empty(0, dtype=np.int32)
+        self._counts = np.empty(0, dtype=np.float32)
+        self._weights = np.empty(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.vocabulary)
+
+    @property
+    def matrix(self):
+        """The L2-normalised TF-IDF matrix, one row per document in `ids`."""
+        return sparse.csr_matrix(
+            (self._weights, self._indices, self._indptr),
+            shape=(len(self.ids), self.n_terms),
+            copy=False,
+        )
+
+    @property
+    def counts(self):
+        """The raw term counts, with the same rows and sparsity as `matrix`."""
+        return sparse.csr_matrix(
+            (self._counts, self._indices, self._indptr),
+            shape=(len(self.ids), self.n_terms),
+            copy=False,
+        )
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the model on top of the TF-IDF matrix it shares."""
+        return (
+            self._counts.nbytes + self.document_frequency.nbytes + self.idf.nbytes
+            + self.ids.nbytes + sum(
+                sys.getsizeof(term) + 64 for term in self.vocabulary
+            )
+        )
+
+    def copy(self):
+        """Copy the model, sharing the row arrays which are never modified."""
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        clone.vocabulary = dict(self.vocabulary)
+        return clone
+
+    def fit(self, documents, ids):
+        """
+        Build the model from scratch.
+
+        Parameters
+        ----------
+        documents : iterable of str
+            The text of every document.
+        ids : array-like
+            The id of every document.
+
+        Returns
+        -------
+        IncrementalTfidf
+            The fitted model.
+        """
+        documents = list(documents)
+        if self.vocabulary:
+            counts = self._count(documents)
+        else:
+            # Same sorted vocabulary as TfidfVectorizer when starting empty
+            vectorizer = CountVectorizer(stop_words=self.stop_words)
+            counts = vectorizer.fit_transform(documents).tocsr()
+            self.vocabulary = {
+                term: column for column, term in
+                enumerate(vectorizer.get_feature_names_out())
+            }
+        self._set_counts(counts.indptr, counts.indices, counts.data, ids)
+        logging.info(
+            f'TF-IDF model fitted with {len(self)} documents and {self.n_terms} terms'
+        )
+        return self
+
+    def restore(self, counts, ids, weights=None, idf=None):
+        """
+        Rebuild the model from stored term counts, e.g. those of a
+        model artifact, without tokenising anything.
+
+        The arrays are used as they are, so they may be memory-mapped
+        read-only: updates write to new arrays.
+
+        Parameters
+        ----------
+        counts : scipy.sparse.csr.csr_matrix
+            The term counts of every document, see `counts`, with
+            columns in the model vocabulary and sorted indices.
+        ids : array-like
+            The id of every document.
+        weights : numpy.ndarray, optional
+            The stored TF-IDF weights, the data of `matrix`, so rows
+            keep the weights they were saved with. Default is to
+            reweight every row, see `renormalize`.
+        idf : numpy.ndarray, optional
+            The IDF the weights were computed with. Default is
+            the IDF of `counts`.
+
+        Returns
+        -------
+        IncrementalTfidf
+            The restored model.
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._indptr = np.asarray(counts.indptr, dtype=np.int64)
+        self._indices = np.asarray(counts.indices, dtype=np.int32)
+        self._counts = np.asarray(counts.data, dtype=np.float32)
+        self.document_frequency = np.bincount(self._indices, minlength=self.n_terms)
+        if weights is None:
+            self.renormalize()
+        else:
+            self._weights = np.asarray(weights, dtype=np.float64)
+            self.idf = (
+                smooth_idf(self.document_frequency, len(self.ids)) if idf is None
+                else np.asarray(idf, dtype=np.float64)
+            )
+        return self
+
+    def fit_batches(self, batches, workers=1):
+        """
+        Build the model from scratch from documents arriving in batches,
+        e.g. read from the database, without holding all their text.
+
+        The first pass counts the terms of every batch, in `workers`
+        processes if more than one, and merges the counts into one
+        vocabulary as they arrive, keeping only the sparse counts and
+        the document frequencies. The second pass sorts the vocabulary
+        like `fit` does and weights the counts. The result is the same
+        model as `fit` on all documents at once.
+
+        Parameters
+        ----------
+        batches : iterable of (list of str, array-like)
+            The text and the id of the documents of every batch.
+        workers : int, optional
+            Processes counting batches, at most `workers + 1` batches are
+            read ahead of the merge. Default is 1, counting in this process.
+            The processes are spawned, so a script using more than one
+            needs the `if __name__ == "__main__"` guard.
+
+        Returns
+        -------
+        IncrementalTfidf
+            The fitted model.
+        """
+        fixed = bool(self.vocabulary)
+        terms = {} if not fixed else self.vocabulary
+        indptr, indices, counts, ids = [np.zeros(1, dtype=np.int64)], [], [], []
+        n_stored = 0
+
+        def merge(batch_ids, batch_terms, batch_counts):
+            nonlocal n_stored
+            batch_counts = batch_counts.tocsr()
+            batch_indices = batch_counts.indices.astype(np.int32)
+            if batch_terms is not None:
+                # Map the batch vocabulary onto the terms seen so far
+                columns = np.fromiter(
+                    (terms.setdefault(term, len(terms)) for term in batch_terms),
+                    dtype=np.int32, count=len(batch_terms),
+                )
+                batch_indices = columns[batch_indices]
+            indptr.append(batch_counts.indptr[1:].astype(np.int64) + n_stored)
+            indices.append(batch_indices)
+            counts.append(batch_counts.data.astype(np.float32))
+            ids.append(np.asarray(batch_ids, dtype=np.int64))
+            n_stored += batch_counts.nnz
+
+        if fixed or workers <= 1:
+            for documents, batch_ids in batches:
+                if fixed:
+                    merge(batch_ids, None, self._count(list(documents)))
+                else:
+                    merge(batch_ids, *count_batch(list(documents), self.stop_words))
+        else:
+            # Spawned, as forking a serving process with threads is unsafe
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                pending = deque()
+                for documents, batch_ids in batches:
+                    pending.append((
+                        batch_ids, pool.submit(count_batch, list(documents), self.stop_words)
+                    ))
+                    if len(pending) > workers:
+                        batch_ids, future = pending.popleft()
+                        merge(batch_ids, *future.result())
+                while pending:
+                    batch_ids, future = pending.popleft()
+                    merge(batch_ids, *future.result())
+
+        n_batches = len(ids)
+        indptr = np.concatenate(indptr)
+        indices = np.concatenate(indices) if indices else np.empty(0, dtype=np.int32)
+        counts = np.concatenate(counts) if counts else np.empty(0, dtype=np.float32)
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        if not fixed:
+            # Columns in sorted term order, like `fit`
+            seen = list(terms)
+            order = np.argsort(np.asarray(seen, dtype=object))
+            columns = np.empty(len(seen), dtype=np.int32)
+            columns[order] = np.arange(len(seen))
+            indices = columns[indices]
+            self.vocabulary = {seen[i]: column for column, i in enumerate(order)}
+        self._set_counts(indptr, indices, counts, ids)
+        logging.info(
+            f'TF-IDF model fitted with {len(self)} documents and {self.n_terms} terms'
+            f' in {n_batches} batches'
+        )
+        return self
+
+    def transform(self, documents):
+        """
+        Vectorize documents with the current vocabulary and IDF,
+        without adding them to the model.
+
+        Parameters
+        ----------
+        documents : iterable of str
+            The texts to vectorize.
+
+        Returns
+        -------
+        scipy.sparse.csr.csr_matrix
+            Their L2-normalised TF-IDF rows. Unknown terms are ignored.
+        """
+        counts = self._count(list(documents), grow=False)
+        return normalize_rows(counts.multiply(self.idf[np.newaxis, :]))
+
+    def upsert(self, ids, documents):
+        """
+        Add new documents and replace existing ones with the same id.
+
+        Replaced documents keep their row, new ones are appended.
+
+        Parameters
+        ----------
+        ids : array-like
+            The id of every document. Later duplicates win.
+        documents : iterable of str
+            The text of every document.
+
+        Returns
+        -------
+        numpy.ndarray
+            The rows of the upserted documents.
+        """
+        incoming = pd.Series(list(documents), index=np.asarray(ids, dtype=np.int64))
+        incoming = incoming[~incoming.index.duplicated(keep="last")]
+        if incoming.empty:
+            return np.empty(0, dtype=np.intp)
+
+        rows = self._rows(incoming.index.values)
+        replaced = rows >= 0
+        counts = self._count(incoming.tolist())
+        old_positions, _ = row_positions(self._indptr, rows[replaced])
+        self.document_frequency = (
+            self.document_frequency
+            - np.bincount(self._indices[old_positions], minlength=self.n_terms)
+            + np.bincount(counts.indices, minlength=self.n_terms)
+        )
+
+        # Every output row is a slice of either the current or the new arrays
+        n_stored = len(self._indices)
+        sources = np.arange(len(self.ids))
+        starts = self._indptr[:-1].copy()
+        lengths = np.diff(self._indptr)
+        new_lengths = np.diff(counts.indptr)
+        starts[rows[replaced]] = n_stored + counts.indptr[:-1][replaced]
+        lengths[rows[replaced]] = new_lengths[replaced]
+        appended = np.flatnonzero(~replaced)
+        starts = np.concatenate([starts, n_stored + counts.indptr[appended]])
+        lengths = np.concatenate([lengths, new_lengths[appended]])
+
+        new_rows = rows.copy()
+        new_rows[~replaced] = len(sources) + np.arange(len(appended))
+        self.ids = np.concatenate([self.ids, incoming.index.values[appended]])
+        self._gather(
+            starts, lengths,
+            indices=np.concatenate([self._indices, counts.indices.astype(np.int32)]),
+            counts=np.concatenate([self._counts, counts.data.astype(np.float32)]),
+            weights=np.concatenate([self._weights, np.zeros(counts.nnz)]),
+        )
+        self._refresh(new_rows)
+        logging.info(
+            f'TF-IDF model updated: {replaced.sum()} replaced, {len(appended)} added'
+        )
+        return new_rows
+
+    def remove(self, ids) -> int:
+        """
+        Remove documents by id, unknown ids are ignored.
+
+        Parameters
+        ----------
+        ids : array-like
+            The ids of the documents to remove.
+
+        Returns
+        -------
+        int
+            The number of removed documents.
+        """
+        rows = self._rows(np.asarray(ids, dtype=np.int64))
+        rows = np.unique(rows[rows >= 0])
+        if not len(rows):
+            return 0
+
+        old_positions, _ = row_positions(self._indptr, rows)
+        self.document_frequency = self.document_frequency - np.bincount(
+            self._indices[old_positions], minlength=self.n_terms
+        )
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[rows] = False
+        self.ids = self.ids[keep]
+        self._gather(
+            self._indptr[:-1][keep], np.diff(self._indptr)[keep],
+            indices=self._indices, counts=self._counts, weights=self._weights,
+        )
+        self._refresh(np.empty(0, dtype=np.intp))
+        logging.info(f'TF-IDF model updated: {len(rows)} removed')
+        return len(rows)
+
+    def renormalize(self, chunk_size=65536):
+        """
+        Reweight every row with the current IDF and L2-normalise it,
+        `chunk_size` rows at a time to bound the temporary arrays.
+        """
+        self.idf = smooth_idf(self.document_frequency, len(self.ids))
+        weights = np.empty(len(self._counts), dtype=np.float64)
+        for start in range(0, len(self.ids), chunk_size):
+            rows = np.arange(start, min(start + chunk_size, len(self.ids)))
+            weights[self._indptr[start]:self._indptr[rows[-1] + 1]] = self._weighted(rows)
+        self._weights = weights
+        self.stale_rows = 0
+
+    def to_vectorizer(self) -> TfidfVectorizer:
+        """
+        Get a `TfidfVectorizer` with the current vocabulary and IDF,
+        e.g. to save it in a model artifact.
+        """
+        vectorizer = TfidfVectorizer(
+            stop_words=self.stop_words, vocabulary=self.vocabulary
+        )
+        vectorizer.idf_ = self.idf
+        return vectorizer
+
+    def _set_counts(self, indptr, indices, counts, ids):
+        matrix = sparse.csr_matrix(
+            (counts, indices, indptr), shape=(len(indptr) - 1, self.n_terms), copy=False
+        )
+        matrix.sort_indices()
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._indptr = matrix.indptr.astype(np.int64, copy=False)
+        self._indices = matrix.indices.astype(np.int32, copy=False)
+        self._counts = matrix.data.astype(np.float32, copy=False)
+        self.document_frequency = np.bincount(self._indices, minlength=self.n_terms)
+        self.renormalize()
+
+    def _rows(self, ids):
+        index = pd.Index(self.ids)
+        if not index.is_unique:
+            raise ValueError("Document ids must be unique to update the model")
+        return index.get_indexer(ids)
+
+    def _count(self, documents, grow=None):
+        grow = self.growable if grow is None else grow
+        indptr, indices, values = [0], [], []
+        for document in documents:
+            for term, count in Counter(self._analyzer(document)).items():
+                column = self.vocabulary.get(term)
+                if column is None:
+                    if not grow:
+                        continue
+                    column = self.vocabulary[term] = len(self.vocabulary)
+                indices.append(column)
+                values.append(count)
+            indptr.append(len(indices))
+        counts = sparse.csr_matrix(
+            (np.asarray(values, dtype=np.float64),
+             np.asarray(indices, dtype=np.int32),
+             np.asarray(indptr, dtype=np.int64)),
+            shape=(len(documents), self.n_terms),
+        )
+        counts.sort_indices()
+        if len(self.document_frequency) < self.n_terms:
+            self.document_frequency = np.concatenate([
+                self.document_frequency,
+                np.zeros(self.n_terms - len(self.document_frequency), dtype=np.int64),
+            ])
+        return counts
+
+    def _gather(self, starts, lengths, indices, counts, weights):
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        self._indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self._indices = indices[positions]
+        self._counts = counts[positions]
+        self._weights = weights[positions]
+
+    def _refresh(self, rows):
+        self.stale_rows += len(rows)
+        if self.renormalize_every is not None and (
+            self.stale_rows > self.renormalize_every * max(len(self.ids), 1)
+        ):
+            logging.info(f'Reweighting all rows after {self.stale_rows} updates')
+            self.renormalize()
+            return
+        self.idf = smooth_idf(self.document_frequency, len(self.ids))
+        positions, _ = row_positions(self._indptr, rows)
+        # `_gather` just made these arrays, so writing to them is safe
+        self._weights[positions] = self._weighted(rows)
+
+    def _weighted(self, rows):
+        positions, lengths = row_positions(self._indptr, rows)
+        weights = self._counts[positions] * self.idf[self._indices[positions]]
+        segments = np.repeat(np.arange(len(lengths)), lengths)
+        norms = np.sqrt(np.bincount(segments, weights=weights ** 2, minlength=len(lengths)))
+        norms[norms == 0] = 1.0
+        return weights / norms[segments]
@@ -0,0 +1,301 @@
+import bisect
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalise a title for lookups: Unicode NFKC, case-folded,
+    with surrounding whitespace stripped and inner runs collapsed.
+
+    Parameters
+    ----------
+    title : str
+        The title as typed by a user or stored in the catalogue.
+
+    Returns
+    -------
+    str
+        The normalised title.
+    """
+    title = unicodedata.normalize("NFKC", title).casefold()
+    return _whitespace.sub(" ", title).strip()
+
+
+def trigrams(title: str) -> set:
+    """
+    Get the character trigrams of a normalised title, padded so
+    that the first and last characters form trigrams of their own.
+    """
+    padded = f"  {title} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int):
+    """
+    Levenshtein distance between two strings, giving up early.
+
+    Parameters
+    ----------
+    a, b : str
+        The strings to compare.
+    max_distance : int
+        The largest distance of interest.
+
+    Returns
+    -------
+    int or None
+        The edit distance, or None if it is larger than `max_distance`.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > max_distance:
+            return None
+        previous = current
+    distance = previous[-1]
+    return distance if distance <= max_distance else None
+
+
+class TitleIndex:
+    """
+    Prebuilt index for resolving movie titles to catalogue rows.
+
+    It combines a hash map for exact matches, a sorted array of
+    titles for prefix autocomplete and a trigram index for
+    bounded-edit-distance fuzzy matching. Titles shared by several
+    movies (e.g. remakes) keep all their rows; `resolve` picks the
+    one with the highest priority, e.g. vote count, instead of
+    whichever row happens to come first.
+
+    Parameters
+    ----------
+    titles : array-like
+        The title of every catalogue row.
+
+    priority : array-like, optional
+        A score per row used to choose between movies sharing a
+        title, higher wins. Default is to prefer the first row.
+    """
+
+    def __init__(self, titles, priority=None):
+        rows_by_title = defaultdict(list)
+        for row, title in enumerate(titles):
+            rows_by_title[normalize_title(title)].append(row)
+
+        if priority is None:
+            priority = -np.arange(len(titles))
+        priority = np.asarray(priority, dtype=np.float64)
+        # Most preferred row first, stable so the first row wins ties
+        self.exact = {
+            title: sorted(rows, key=lambda row: -priority[row])
+            for title, rows in rows_by_title.items()
+        }
+        self.sorted_titles = sorted(self.exact)
+
+        postings = defaultdict(list)
+        for title_id, title in enumerate(self.sorted_titles):
+            for gram in trigrams(title):
+                postings[gram].append(title_id)
+        self.postings = {
+            gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()
+        }
+        self.title_lengths = np.fromiter(
+            (len(title) for title in self.sorted_titles),
+            dtype=np.int32,
+            count=len(self.sorted_titles),
+        )
+        duplicates = sum(len(rows) > 1 for rows in self.exact.values())
+        logging.info(
+            f'Title index built with {len(self.exact)} titles, '
+            f'{duplicates} shared by several movies'
+        )
+
+    def __len__(self):
+        return len(self.exact)
+
+    def rows(self, title: str) -> list:
+        """
+        Get every row with exactly this title, most preferred first.
+
+        Parameters
+        ----------
+        title : str
+            The title, matched after normalisation.
+
+        Returns
+        -------
+        list
+            The rows, empty if the title is unknown.
+        """
+        return self.exact.get(normalize_title(title), [])
+
+    def prefix(self, prefix: str, limit=10) -> list:
+        """
+        Get the titles starting with a prefix, in alphabetical order.
+
+        Parameters
+        ----------
+        prefix : str
+            The prefix, matched after normalisation.
+        limit : int, optional
+            The maximum number of titles. Default is 10.
+
+        Returns
+        -------
+        list
+            The matching normalised titles.
+        """
+        prefix = normalize_title(prefix)
+        start = bisect.bisect_left(self.sorted_titles, prefix)
+        matches = []
+        for title in self.sorted_titles[start:start + limit]:
+            if not title.startswith(prefix):
+                break
+            matches.append(title)
+        return matches
+
+    def fuzzy(self, title: str, max_distance=2, limit=10) -> list:
+        """
+        Get the titles within an edit distance of `title`.
+
+        Candidates are found through shared trigrams: a title within
+        edit distance d shares at least `len(trigrams) - 3 * d` of
+        them, so only those few are compared character by character.
+
+        Parameters
+        ----------
+        title : str
+            The title, matched after normalisation.
+        max_distance : int, optional
+            The largest edit distance. Default is 2.
+        limit : int, optional
+            The maximum number of titles. Default is 10.
+
+        Returns
+        -------
+        list
+            (title, distance) pairs, closest first.
+        """
+        title = normalize_title(title)
+        grams = trigrams(title)
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not lists:
+            return []
+
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.sorted_titles))
+        threshold = max(1, len(grams) - 3 * max_distance)
+        candidates = np.flatnonzero(
+            (shared >= threshold)
+            & (np.abs(self.title_lengths - len(title)) <= max_distance)
+        )
+        # Check the most promising candidates first
+        candidates = candidates[np.argsort(-shared[candidates], kind="stable")]
+
+        matches = []
+        for title_id in candidates:
+            candidate = self.sorted_titles[title_id]
+            distance = bounded_edit_distance(title, candidate, max_distance)
+            if distance is not None:
+                matches.append((candidate, distance))
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches[:limit]
+
+    def resolve(self, title: str, max_distance=2):
+        """
+        Resolve a title to a single row.
+
+        Exact matches win. Otherwise the closest fuzzy match is used
+        if it is unambiguous. When several movies share the resolved
+        title, the most preferred one is returned.
+
+        Parameters
+        ----------
+        title : str
+            The title as typed by a user.
+        max_distance : int, optional
+            The largest edit distance for fuzzy matches. Default is 2.
+            Titles of at most 4 characters are only matched exactly
+            and titles of at most 8 characters allow one edit.
+
+        Returns
+        -------
+        int or None
+            The row, or None if the title cannot be resolved.
+        """
+        rows = self.rows(title)
+        if rows:
+            return rows[0]
+
+        # Short titles tolerate fewer typos before they become ambiguous
+        length = len(normalize_title(title))
+        if length <= 4:
+            return None
+        if length <= 8:
+            max_distance = min(max_distance, 1)
+
+        # Widen the search one edit at a time, since small distances
+        # have far fewer trigram candidates to verify
+        for distance in range(1, max_distance + 1):
+            matches = self.fuzzy(title, distance, limit=2)
+            if len(matches) == 1 or (
+                len(matches) == 2 and matches[0][1] < matches[1][1]
+            ):
+                return self.exact[matches[0][0]][0]
+            if matches:
+                return None
+        return None
+
+    def search(self, query: str, limit=10, max_distance=2) -> list:
+        """
+        Search titles for autocomplete and "did you mean" suggestions.
+
+        Parameters
+        ----------
+        query : str
+            The partial or misspelt title.
+        limit : int, optional
+            The maximum number of titles. Default is 10.
+        max_distance : int, optional
+            The largest edit distance for fuzzy matches. Default is 2.
+
+        Returns
+        -------
+        list
+            Dicts with the normalised "title", its "rows" (several for
+            shared titles), the kind of "match" (exact, prefix or fuzzy)
+            and the edit "distance".
+        """
+        results = {}
+        query_title = normalize_title(query)
+        if query_title in self.exact:
+            results[query_title] = ("exact", 0)
+        for title in self.prefix(query_title, limit):
+            results.setdefault(title, ("prefix", 0))
+        if len(results) < limit:
+            for title, distance in self.fuzzy(query_title, max_distance, limit):
+                results.setdefault(title, ("fuzzy", distance))
+
+        return [
+            {
+                "title": title,
+                "rows": self.exact[title],
+                "match": match,
+                "distance": distance,
+            }
+            for title, (match, distance) in list(results.items())[:limit]
+        ]
@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from .synthetic import write_database
+
+# Catalogue sizes benchmarked by default
+DEFAULT_SIZES = [10000, 100000, 500000]
+
+# Where generated databases and results are kept between runs
+DATA_DIR = os.path.join("benchmarks", "data")
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def summarize(timings, items=1) -> dict:
+    """
+    Summarize the durations of repeated runs of one operation.
+
+    Args:
+        timings (list): The duration of every run, in seconds.
+        items (int, optional): The items each run handles, e.g. the
+            movies of a batch, to report items per second. Defaults to 1.
+
+    Returns:
+        dict: The run count, mean and p50/p95/p99 latency in milliseconds,
+            and the throughput in items per second.
+    """
+    timings = np.asarray(timings, dtype=np.float64)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99]) * 1000
+    return {
+        "runs": len(timings),
+        "mean_ms": round(float(timings.mean()) * 1000, 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "throughput_per_s": round(items * len(timings) / float(timings.sum()), 2),
+    }
+
+
+def time_runs(function, runs, items=1) -> dict:
+    """Call `function(i)` for i in range(runs) and summarize the durations."""
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - start)
+    result = summarize(timings, items)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return result
+
+
+def measure(queries=200, batch_size=64, batches=20, requests=200, top_n=10, seed=0) -> dict:
+    """
+    Time the recommender hot paths against the database in MOVIE_REC_DATABASE.
+
+    Runs in a process of its own per catalogue size, see `run_size`, so
+    the peak RSS reported after every stage only covers this catalogue.
+    Rows and titles are drawn without repeats where possible, so the
+    recommendation cache of the API does not hide the scoring cost.
+
+    Args:
+        queries (int, optional): Single movies scored. Defaults to 200.
+        batch_size (int, optional): Movies per scored batch. Defaults to 64.
+        batches (int, optional): Batches scored. Defaults to 20.
+        requests (int, optional): Requests sent to /recommendations/. Defaults to 200.
+        top_n (int, optional): Recommendations per movie. Defaults to 10.
+        seed (int, optional): Seed of the sampled movies. Defaults to 0.
+
+    Returns:
+        dict: The summary of every stage, see `summarize`.
+    """
+    # Imported here so the settings are read from the worker's environment
+    from fastapi.testclient import TestClient
+
+    from app.app import app
+    from app.recommenderhelper import compute_metrics_from_rows, retrieve_and_transform_data
+    from app.textmodel import IncrementalTfidf
+
+    rng = np.random.default_rng(seed)
+    stages = {}
+
+    data = {}
+    stages["data_load"] = time_runs(
+        lambda i: data.update(df=retrieve_and_transform_data()), runs=3
+    )
+    df = data["df"]
+    n_movies = len(df)
+    stages["data_load"]["movies"] = n_movies
+
+    stages["tfidf_fit"] = time_runs(
+        lambda i: IncrementalTfidf("english").fit(df["combined"], df["id"]), runs=1
+    )
+    del df, data
+
+    # The API builds the engine it serves in its lifespan hook
+    start = time.perf_counter()
+    with TestClient(app) as client:
+        stages["engine_build"] = summarize([time.perf_counter() - start])
+        stages["engine_build"]["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        engine = app.state.engine
+
+        rows = rng.choice(n_movies, size=min(queries, n_movies), replace=False)
+        stages["single_query"] = time_runs(
+            lambda i: engine.similar_rows([rows[i]], top_n), runs=len(rows)
+        )
+
+        batch_rows = rng.integers(0, n_movies, size=(batches, batch_size))
+        similar = {}
+        stages["batch_query"] = time_runs(
+            lambda i: similar.update({i: engine.similar_rows(batch_rows[i], top_n)}),
+            runs=batches, items=batch_size,
+        )
+
+        stages["metrics"] = time_runs(
+            lambda i: compute_metrics_from_rows(engine.metrics, batch_rows[i], similar[i]),
+            runs=batches, items=batch_size,
+        )
+
+        title_rows = rng.choice(n_movies, size=min(requests, n_movies), replace=False)
+        titles = engine.movie_list[title_rows]
+
+        def request(i):
+            response = client.post(
+                "/recommendations/", json={"movie": titles[i], "num_rec": top_n}
+            )
+            response.raise_for_status()
+
+        stages["api_recommendations"] = time_runs(request, runs=len(titles))
+    return stages
+
+
+def run_size(n_movies, seed=0, data_dir=DATA_DIR, options=None) -> dict:
+    """
+    Generate (or reuse) the synthetic database of one catalogue size and
+    benchmark it in a fresh process.
+
+    Args:
+        n_movies (int): The number of movies.
+        seed (int, optional): The seed of the catalogue. Defaults to 0.
+        data_dir (str, optional): Where generated databases are kept.
+        options (dict, optional): Keyword arguments of `measure`.
+
+    Returns:
+        dict: The results of `measure`.
+    """
+    path = write_database(
+        os.path.join(data_dir, f"synthetic-{n_movies}-{seed}.duckdb"), n_movies, seed
+    )
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        env = {
+            **os.environ,
+            "MOVIE_REC_DATABASE": os.path.abspath(path),
+            "MOVIE_REC_ARTIFACT_DIR": artifact_dir,
+            "MOVIE_REC_RELOAD_INTERVAL": "0",
+        }
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", "--measure", json.dumps(options or {})],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def git_commit() -> str:
+    """The commit being benchmarked, with '-dirty' if the tree has changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def compare(baseline: dict, results: dict) -> list:
+    """
+    Compare the p50 latency of every stage between two result files.
+
+    Args:
+        baseline (dict): The results to compare against.
+        results (dict): The new results.
+
+    Returns:
+        list: One line per stage found in both, with the change in percent.
+    """
+    lines = []
+    for size, stages in results["sizes"].items():
+        for stage, result in stages.items():
+            before = baseline["sizes"].get(size, {}).get(stage, {}).get("p50_ms")
+            if before is None or "p50_ms" not in result:
+                continue
+            change = (result["p50_ms"] - before) / before * 100 if before else 0.0
+            lines.append(
+                f"{size:>8} {stage:<20} {before:>10.3f} ms -> {result['p50_ms']:>10.3f} ms"
+                f" ({change:+.1f}%)"
+            )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recommender hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--output", help="Results file, default benchmarks/results/<commit>.json")
+    parser.add_argument("--baseline", help="Results file to compare the p50 latencies with")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure is not None:
+        # Worker process started by `run_size`
+        print(json.dumps(measure(**json.loads(args.measure))))
+        return
+
+    options = {
+        "queries": args.queries,
+        "batch_size": args.batch_size,
+        "batches": args.batches,
+        "requests": args.requests,
+        "seed": args.seed,
+    }
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": options,
+        "sizes": {},
+    }
+    for n_movies in args.sizes:
+        print(f"Benchmarking {n_movies} movies", file=sys.stderr)
+        results["sizes"][str(n_movies)] = run_size(n_movies, args.seed, options=options)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print("\n".join(compare(json.load(f), results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+# TMDB movie genres and roughly how often they are tagged on popular movies
+GENRE_WEIGHTS = {
+    "Drama": 0.20,
+    "Comedy": 0.13,
+    "Thriller": 0.09,
+    "Action": 0.09,
+    "Horror": 0.06,
+    "Romance": 0.06,
+    "Adventure": 0.05,
+    "Crime": 0.05,
+    "Animation": 0.04,
+    "Family": 0.04,
+    "Fantasy": 0.04,
+    "Science Fiction": 0.04,
+    "Mystery": 0.03,
+    "Documentary": 0.02,
+    "History": 0.015,
+    "Music": 0.015,
+    "War": 0.01,
+    "TV Movie": 0.01,
+    "Western": 0.01,
+}
+
+# Share of movies tagged with 1, 2, 3 and 4 genres
+GENRE_COUNT_WEIGHTS = [0.3, 0.4, 0.2, 0.1]
+
+LANGUAGE_WEIGHTS = {
+    "en": 0.65, "fr": 0.06, "ja": 0.06, "es": 0.05, "ko": 0.04,
+    "it": 0.04, "de": 0.04, "zh": 0.03, "hi": 0.02, "ru": 0.01,
+}
+
+SYLLABLES = [
+    "ka", "lo", "mi", "ra", "ten", "vo", "sha", "dri", "un", "el", "por",
+    "ast", "ber", "cor", "den", "fa", "gri", "hol", "ish", "jun", "kel",
+    "lum", "mar", "nex", "ova", "pri", "qua", "ros", "sen", "tor",
+]
+
+
+def make_vocabulary(size, rng) -> np.ndarray:
+    """
+    Make `size` distinct pseudo-words of two to four syllables.
+
+    Args:
+        size (int): The number of words.
+        rng (numpy.random.Generator): The random generator.
+
+    Returns:
+        numpy.ndarray: The words, as an object array.
+    """
+    words = set()
+    while len(words) < size:
+        n_syllables = rng.integers(2, 5, size=size)
+        picks = rng.integers(0, len(SYLLABLES), size=(size, 4))
+        for count, row in zip(n_syllables, picks):
+            words.add("".join(SYLLABLES[i] for i in row[:count]))
+            if len(words) == size:
+                break
+    # Sorted first so the words only depend on the seed, then shuffled so
+    # word frequency does not follow the alphabet
+    return rng.permutation(np.array(sorted(words), dtype=object))
+
+
+def zipf_weights(size, exponent=1.1) -> np.ndarray:
+    """Word frequencies following Zipf's law, most frequent first."""
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def join_words(words, lengths) -> list:
+    """Join consecutive runs of `lengths` words into one string each."""
+    ends = np.cumsum(lengths)
+    return [" ".join(words[end - length:end]) for end, length in zip(ends, lengths)]
+
+
+def generate_movies(n_movies, seed=0, vocabulary_size=30000, topic_share=0.3) -> pd.DataFrame:
+    """
+    Generate a synthetic movie catalogue shaped like `movie_genre_data`.
+
+    Overview lengths follow a log-normal distribution around 35 words,
+    words follow Zipf's law and a share of every overview is drawn from
+    topic words of its first genre, so movies sharing a genre are
+    similar like real ones. Genres, languages and metrics follow the
+    rough distributions of the TMDB popular movies.
+
+    Args:
+        n_movies (int): The number of movies.
+        seed (int, optional): The random seed. Defaults to 0.
+        vocabulary_size (int, optional): The number of distinct words. Defaults to 30000.
+        topic_share (float, optional): The share of overview words drawn from
+            the topic words of the first genre. Defaults to 0.3.
+
+    Returns:
+        pd.DataFrame: The movies, with the columns of `movie_genre_data`.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    word_weights = zipf_weights(vocabulary_size)
+
+    genres = np.array(list(GENRE_WEIGHTS), dtype=object)
+    genre_weights = np.array(list(GENRE_WEIGHTS.values()))
+    genre_weights /= genre_weights.sum()
+    n_genres = rng.choice(
+        np.arange(1, len(GENRE_COUNT_WEIGHTS) + 1), size=n_movies, p=GENRE_COUNT_WEIGHTS
+    )
+    first_genre = rng.choice(len(genres), size=n_movies, p=genre_weights)
+    genre_names = []
+    for first, count in zip(first_genre, n_genres):
+        others = rng.choice(len(genres), size=count + 2, p=genre_weights)
+        picked = list(dict.fromkeys([first, *others]))[:count]
+        genre_names.append(", ".join(genres[picked]))
+
+    # Every genre gets its own slice of less common words as topic words
+    topic_size = max(1, vocabulary_size // (2 * len(genres)))
+    topic_start = vocabulary_size // 2 + first_genre * topic_size
+
+    lengths = np.clip(rng.lognormal(np.log(35), 0.5, size=n_movies), 5, 200).astype(int)
+    total = int(lengths.sum())
+    word_ids = rng.choice(vocabulary_size, size=total, p=word_weights)
+    from_topic = rng.random(total) < topic_share
+    word_topic = np.repeat(topic_start, lengths) + rng.integers(0, topic_size, size=total)
+    word_ids = np.where(from_topic, np.minimum(word_topic, vocabulary_size - 1), word_ids)
+    overviews = join_words(vocabulary[word_ids], lengths)
+
+    # Uniform title words keep duplicate titles to the few remakes of real data
+    title_lengths = rng.choice([1, 2, 3, 4], size=n_movies, p=[0.1, 0.4, 0.35, 0.15])
+    title_ids = rng.integers(0, vocabulary_size, size=int(title_lengths.sum()))
+    titles = [title.title() for title in join_words(vocabulary[title_ids], title_lengths)]
+
+    languages = np.array(list(LANGUAGE_WEIGHTS), dtype=object)
+    language_weights = np.array(list(LANGUAGE_WEIGHTS.values()))
+    language_weights /= language_weights.sum()
+
+    release_days = rng.integers(0, 75 * 365, size=n_movies)
+    return pd.DataFrame({
+        "genre_names": genre_names,
+        "id": rng.permutation(np.arange(1, 3 * n_movies + 1))[:n_movies].astype(np.int64),
+        "original_language": rng.choice(languages, size=n_movies, p=language_weights),
+        "overview": overviews,
+        "popularity": np.round(rng.lognormal(2.5, 1.0, size=n_movies), 3),
+        "release_date": pd.Timestamp("1950-01-01") + pd.to_timedelta(release_days, unit="D"),
+        "title": titles,
+        "vote_average": np.round(np.clip(rng.normal(6.3, 1.0, size=n_movies), 0, 10), 1),
+        "vote_count": np.maximum(1, rng.lognormal(5.0, 1.5, size=n_movies)).astype(np.int64),
+    })
+
+
+def write_database(path, n_movies, seed=0, table_name="movie_genre_data"):
+    """
+    Write a synthetic catalogue to a new DuckDB file, reusing the
+    file if a previous run already generated it.
+
+    Args:
+        path (str): The database file.
+        n_movies (int): The number of movies.
+        seed (int, optional): The random seed. Defaults to 0.
+        table_name (str, optional): The table to create. Defaults to 'movie_genre_data'.
+
+    Returns:
+        str: The path of the database file.
+    """
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    movies = generate_movies(n_movies, seed)
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with duckdb.connect(tmp_path) as conn:
+        conn.register("synthetic_movies", movies)
+        conn.execute(f"""
+            CREATE TABLE {table_name} AS
+            SELECT genre_names, id, original_language, overview, popularity,
+                   CAST(release_date AS DATE) AS release_date,
+                   title, vote_average, vote_count
+            FROM synthetic_movies
+        """)
+    os.replace(tmp_path, path)
+    return path
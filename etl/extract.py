@@ -1,13 +1,23 @@
 # + tags=["parameters"]
 # declare a list tasks whose products you want to use as inputs
 upstream = None
+# Upsert into the existing tables and log changes instead of reloading them
+incremental = False
+# In incremental mode, delete movies missing from this run. A run only sees the
+# top movies per language, so leave off unless it extracts the whole catalogue
+mark_deleted = False
 
 # -
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
-import tempfile
+import pandas as pd
+import threading
+import time
 import duckdb
 import os
 import logging
@@ -15,52 +25,375 @@ import logging
 logging.basicConfig(filename='app.log', level=logging.INFO)
 
 
-def extract_movies(api_key=None, lang='en', num_movies=100, conn=None, drop=False):
+TMDB_API_URL = "https://api.themoviedb.org/3"
+
+# Movies per page of the /movie/popular endpoint
+PAGE_SIZE = 20
+
+# HTTP statuses worth retrying: rate limited or temporary server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Buffered movies written to DuckDB per transaction
+FLUSH_ROWS = 10000
+
+# Declared table schemas, matching the fields returned by the API
+MOVIE_SCHEMA = {
+    'adult': 'BOOLEAN',
+    'backdrop_path': 'VARCHAR',
+    'genre_ids': 'INTEGER[]',
+    'id': 'BIGINT',
+    'original_language': 'VARCHAR',
+    'original_title': 'VARCHAR',
+    'overview': 'VARCHAR',
+    'popularity': 'DOUBLE',
+    'poster_path': 'VARCHAR',
+    'release_date': 'DATE',
+    'title': 'VARCHAR',
+    'video': 'BOOLEAN',
+    'vote_average': 'DOUBLE',
+    'vote_count': 'BIGINT',
+}
+# Bookkeeping columns added to the movies table by incremental runs
+TRACKING_COLUMNS = {
+    'content_hash': 'VARCHAR',
+    'first_seen': 'TIMESTAMP',
+    'last_seen': 'TIMESTAMP',
+    'updated_at': 'TIMESTAMP',
+}
+STAGING_TABLE = 'movies_staging'
+CHANGELOG_TABLE = 'movies_changelog'
+GENRE_SCHEMA = {
+    'id': 'BIGINT',
+    'name': 'VARCHAR',
+}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the request rate across workers.
+
+    Args:
+        rate (float): Tokens added per second, i.e. the sustained request rate.
+        capacity (int, optional): Largest burst allowed. Defaults to `rate`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+
+        Returns:
+            None
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size=4, retries=5, backoff_factor=0.5):
+    """
+    Creates an HTTP session with connection pooling and retries.
+
+    Requests answered with 429 or a 5xx status are retried with exponential
+    backoff, honouring the Retry-After header when the API sends one.
+
+    Args:
+        pool_size (int, optional): The number of pooled connections. Defaults to 4.
+        retries (int, optional): The number of retries per request. Defaults to 5.
+        backoff_factor (float, optional): The base of the exponential backoff in seconds. Defaults to 0.5.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def load_checkpoint(checkpoint_path):
+    """
+    Loads the pages completed by an earlier, interrupted run.
+
+    Args:
+        checkpoint_path (str): The path of the checkpoint file, or None.
+
+    Returns:
+        set: The completed page numbers, empty if there is no checkpoint.
+    """
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    try:
+        with open(checkpoint_path) as f:
+            return set(json.load(f).get('completed_pages', []))
+    except (OSError, ValueError) as e:
+        logging.error(f"An error occurred while reading the checkpoint: {e}")
+        return set()
+
+
+def save_checkpoint(checkpoint_path, completed_pages):
+    """
+    Atomically saves the completed page numbers.
+
+    Args:
+        checkpoint_path (str): The path of the checkpoint file, or None to skip checkpointing.
+        completed_pages (set): The completed page numbers.
+
+    Returns:
+        None
+    """
+    if not checkpoint_path:
+        return
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'completed_pages': sorted(completed_pages)}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def fetch_page(session, bucket, api_key, lang, page, base_url=TMDB_API_URL, timeout=10):
+    """
+    Fetches one page of popular movies, waiting for the rate limiter first.
+
+    Args:
+        session (requests.Session): The session to send the request with.
+        bucket (TokenBucket): The rate limiter shared by all workers.
+        api_key (str): The API key for accessing TheMovieDB.
+        lang (str): The language code for movie data.
+        page (int): The page number.
+        base_url (str, optional): The API root. Defaults to TMDB_API_URL.
+        timeout (float, optional): The request timeout in seconds. Defaults to 10.
+
+    Returns:
+        dict: The JSON response.
+
+    Raises:
+        requests.exceptions.RequestException: If the request still fails after retries.
+    """
+    bucket.acquire()
+    res = session.get(
+        f"{base_url}/movie/popular",
+        params={'api_key': api_key, 'with_original_language': lang, 'page': page},
+        timeout=timeout,
+    )
+    res.raise_for_status()
+    return res.json()
+
+
+def extract_movies(api_key=None, lang='en', num_movies=100, conn=None, drop=False,
+                   workers=4, rate_limit=40, checkpoint_path=None, base_url=TMDB_API_URL,
+                   flush_rows=FLUSH_ROWS, incremental=False, mark_deleted=False):
     """
     Extracts movies from TheMovieDB API and populates the DuckDB database.
 
+    Pages are fetched concurrently by a bounded number of workers sharing one
+    pooled session and a token-bucket rate limiter. The calling thread buffers
+    the movies in memory and writes them to DuckDB in batches of `flush_rows`,
+    each in a single transaction. Pages are recorded in a checkpoint file once
+    flushed, so an interrupted run resumes where it stopped; the checkpoint is
+    removed once every page has been extracted.
+
+    In incremental mode the movies are loaded into a staging table instead and,
+    once every page is in, upserted into the movies table by id with
+    `upsert_movies`, which records what changed in the changelog table.
+
     Args:
         api_key (str): The API key for accessing TheMovieDB.
         lang (str, optional): The language code for movie data. Defaults to 'en'.
         num_movies (int, optional): The number of movies to extract. Defaults to 100.
         conn: The DuckDB connection object.
-        drop (bool, optional): Whether to drop the existing table before insertion. Defaults to False.
+        drop (bool, optional): Whether to drop the existing table before insertion. Ignored when resuming. Defaults to False.
+        workers (int, optional): The number of concurrent requests. Defaults to 4.
+        rate_limit (float, optional): The maximum number of requests per second. Defaults to 40.
+        checkpoint_path (str, optional): The checkpoint file, or None to disable resuming. Defaults to None.
+        base_url (str, optional): The API root. Defaults to TMDB_API_URL.
+        flush_rows (int, optional): The number of buffered movies written per transaction. Defaults to FLUSH_ROWS.
+        incremental (bool, optional): Whether to upsert into the existing table instead of loading it. Defaults to False.
+        mark_deleted (bool, optional): In incremental mode, whether movies missing from this run are deleted. Defaults to False.
 
     Returns:
-        None
+        list: The pages that failed and will be retried by the next run.
+    """
+    completed = load_checkpoint(checkpoint_path)
+    table_name = STAGING_TABLE if incremental else 'movies'
+
+    # Drop table if drop = True, unless resuming into a partially loaded table
+    if completed:
+        logging.info(f"Resuming extraction, {len(completed)} pages already done")
+    else:
+        drop_table(conn, drop=drop or incremental, table_name=table_name)
+
+    num_pages = -(-num_movies // PAGE_SIZE)
+    pages = [page for page in range(1, num_pages + 1) if page not in completed]
+    failed = []
+    buffer = ColumnBuffer(MOVIE_SCHEMA)
+    buffered_pages = set()
+
+    def flush():
+        buffer.flush(conn, table_name)
+        completed.update(buffered_pages)
+        buffered_pages.clear()
+        save_checkpoint(checkpoint_path, completed)
+
+    session = create_session(pool_size=workers)
+    bucket = TokenBucket(rate_limit)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_page, session, bucket, api_key, lang, page, base_url): page
+            for page in pages
+        }
+        for future in as_completed(futures):
+            page = futures[future]
+            try:
+                json_data = future.result()
+            except requests.exceptions.RequestException as e:
+                logging.error(f"An error occurred during the request for page {page}: {e}")
+                failed.append(page)
+                continue
+
+            # Buffer the page and write full batches to the database
+            init_duck_db_movies(conn, json_data, table_name=table_name, buffer=buffer)
+            buffered_pages.add(page)
+            if len(buffer) >= flush_rows:
+                flush()
+
+            # Log progress
+            logging.info(f"Extracted page {page}, {len(completed) + len(buffered_pages)} out of {num_pages} pages.")
+
+    flush()
+
+    session.close()
+    if failed:
+        logging.error(f"Pages {sorted(failed)} failed, rerun to resume them")
+        return sorted(failed)
+
+    # Only a complete run can tell which movies disappeared
+    if incremental:
+        upsert_movies(conn, staging_table=table_name, mark_deleted=mark_deleted)
+        drop_table(conn, drop=True, table_name=table_name)
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return []
+
+
+def content_hash_sql(table):
     """
-    movies = 0
-    page = 1
+    Builds the SQL expression hashing the text the recommender is built from.
 
-    # Drop table if drop = True
-    drop_table(conn, drop=drop, table_name='movies')
+    Args:
+        table (str): The alias of the table holding the overview and genre_ids columns.
 
-    while movies < num_movies:
-        # Update the URL with the new page number
-        url = f"https://api.themoviedb.org/3/movie/popular?api_key={api_key}&with_original_language={lang}&page={page}"
+    Returns:
+        str: The SQL expression.
+    """
+    return (f"md5(coalesce({table}.overview, '') || '|' || "
+            f"coalesce(CAST(list_sort({table}.genre_ids) AS VARCHAR), ''))")
 
-        # Make a request
-        try:
-            res = requests.get(url)
-        except requests.exceptions.RequestException as e:
-            logging.error(f"An error occurred during the request: {e}")
-            break
 
-        if res.status_code != 200:
-            logging.error(f"Received non-200 status code: {res.status_code}")
-            break
+def upsert_movies(conn, staging_table=STAGING_TABLE, table_name='movies',
+                  changelog_table=CHANGELOG_TABLE, mark_deleted=False):
+    '''
+    Upserts staged movies by id and records the changes in a changelog
 
-        # Transform content to JSON
-        json_data = res.json()
+    Every movie carries a content hash of its overview and genres, the time it
+    was first and last seen and the time its content last changed. A movie is
+    logged as 'inserted' if its id is new, as 'updated' if its content hash
+    changed and, with `mark_deleted`, as 'deleted' if it is missing from the
+    staging table. Downstream stages can read the changelog of a run to refresh
+    only the TF-IDF rows and neighbour lists of the changed movies.
 
-        # Initialize or update the database
-        init_duck_db_movies(conn, json_data, table_name='movies')
+    Args:
+        conn: The DuckDB connection object.
+        staging_table (str, optional): The table holding this run's movies. Defaults to STAGING_TABLE.
+        table_name (str, optional): The table to upsert into. Defaults to 'movies'.
+        changelog_table (str, optional): The changelog table. Defaults to CHANGELOG_TABLE.
+        mark_deleted (bool, optional): Whether movies missing from the staging table are deleted. Defaults to False.
 
-        # Log progress
-        movies += len(json_data.get('results', []))
-        logging.info(f"Extracted {movies} out of {num_movies} movies.")
+    Returns:
+        dict: The run id and the number of inserted, updated and deleted movies.
+    '''
+    columns = ", ".join(MOVIE_SCHEMA)
+    assignments = ", ".join(f"{column} = incoming.{column}" for column in MOVIE_SCHEMA if column != 'id')
+    now = "CAST(current_timestamp AS TIMESTAMP)"
 
-        page += 1
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} AS SELECT * FROM {staging_table} LIMIT 0")
+        for column, dtype in TRACKING_COLUMNS.items():
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column} {dtype}")
+        conn.execute(f"UPDATE {table_name} SET content_hash = {content_hash_sql(table_name)} "
+                     f"WHERE content_hash IS NULL")
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {changelog_table} (
+                run_id BIGINT, movie_id BIGINT, change VARCHAR, changed_at TIMESTAMP
+            )""")
+        run_id = conn.execute(f"SELECT coalesce(max(run_id), 0) + 1 FROM {changelog_table}").fetchone()[0]
+
+        # Pages can overlap when popularity shifts during a run, keep one row per id
+        conn.execute("DROP TABLE IF EXISTS incoming")
+        conn.execute(
+            f"""CREATE TEMP TABLE incoming AS
+            SELECT {columns}, {content_hash_sql(staging_table)} AS content_hash
+            FROM {staging_table}
+            QUALIFY row_number() OVER (PARTITION BY id ORDER BY popularity DESC) = 1""")
+
+        conn.execute(
+            f"""INSERT INTO {changelog_table}
+            SELECT ?, incoming.id,
+                   CASE WHEN current.id IS NULL THEN 'inserted' ELSE 'updated' END, {now}
+            FROM incoming LEFT JOIN {table_name} AS current ON incoming.id = current.id
+            WHERE current.id IS NULL OR current.content_hash != incoming.content_hash""", [run_id])
+        if mark_deleted:
+            conn.execute(
+                f"""INSERT INTO {changelog_table}
+                SELECT DISTINCT ?, id, 'deleted', {now} FROM {table_name}
+                WHERE id NOT IN (SELECT id FROM incoming)""", [run_id])
+            conn.execute(f"DELETE FROM {table_name} WHERE id NOT IN (SELECT id FROM incoming)")
+
+        conn.execute(
+            f"""UPDATE {table_name} SET {assignments},
+                content_hash = incoming.content_hash,
+                last_seen = {now},
+                updated_at = CASE WHEN {table_name}.content_hash != incoming.content_hash
+                                  THEN {now} ELSE {table_name}.updated_at END
+            FROM incoming WHERE {table_name}.id = incoming.id""")
+        conn.execute(
+            f"""INSERT INTO {table_name} ({columns}, content_hash, first_seen, last_seen, updated_at)
+            SELECT {columns}, content_hash, {now}, {now}, {now} FROM incoming
+            WHERE id NOT IN (SELECT id FROM {table_name})""")
+
+        counts = dict(conn.execute(
+            f"SELECT change, count(*) FROM {changelog_table} WHERE run_id = ? GROUP BY change",
+            [run_id]).fetchall())
+        conn.execute("DROP TABLE incoming")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    summary = {'run_id': run_id, **{change: counts.get(change, 0) for change in ('inserted', 'updated', 'deleted')}}
+    logging.info(f"Upserted movies: {summary}")
+    return summary
 
 
 def extract_genre(api_key=None, lang='en', drop=False, conn=None):
@@ -113,79 +446,110 @@ def drop_table(conn, drop=False, table_name=None):
         logging.info(f'Sucessfully dropped {table_name}')
 
 
-def write_json_to_temp_file(json_data, json_key):
+class ColumnBuffer:
     """
-    Writes the provided JSON data to a temporary file and returns the file's name.
+    Buffers API records in memory as one list per column of a fixed schema.
 
-    Args:
-        json_data (dict): The JSON data to write to the file.
+    Records from many pages are accumulated and written to DuckDB by `flush`
+    in a single INSERT inside one transaction, instead of one temporary JSON
+    file, schema inference and INSERT per page.
 
-    Returns:
-        str: The name of the temporary file containing the JSON data, or None if an error occurs.
+    Args:
+        schema (dict): Maps each column name to its DuckDB type, in table order.
     """
-    # Write JSON string to a temporary file
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, mode='w') as temp_file:
-            # Get the correct key so that only the results are written to the file
-            json.dump(json_data[f'{json_key}'], temp_file) 
-            return temp_file.name
-    except Exception as e:
-        logging.error(f"An error occurred while writing the JSON file: {e}")
-        return None
 
+    def __init__(self, schema):
+        self.schema = schema
+        self.columns = {column: [] for column in schema}
+
+    def __len__(self):
+        return len(self.columns[next(iter(self.schema))])
+
+    def add(self, records):
+        """
+        Appends records, ignoring unknown keys and filling missing ones with None.
 
-def create_table(conn, table_name, temp_file_path):
+        Args:
+            records (list): The records as returned by the API.
+
+        Returns:
+            None
+        """
+        for column, values in self.columns.items():
+            values.extend(record.get(column) for record in records)
+
+    def flush(self, conn, table_name):
+        """
+        Writes the buffered records to a table and empties the buffer.
+
+        The table is created with the declared schema if it does not exist.
+
+        Args:
+            conn: The DuckDB connection object.
+            table_name (str): The name of the table to insert into.
+
+        Returns:
+            int: The number of rows written.
+        """
+        rows = len(self)
+        if not rows:
+            return 0
+
+        columns = ", ".join(f"{column} {dtype}" for column, dtype in self.schema.items())
+        casts = ", ".join(cast_column(column, dtype) for column, dtype in self.schema.items())
+        conn.register('column_buffer', pd.DataFrame(self.columns))
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns})")
+            conn.execute(f"INSERT INTO {table_name} ({', '.join(self.schema)}) "
+                         f"SELECT {casts} FROM column_buffer")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.unregister('column_buffer')
+
+        self.columns = {column: [] for column in self.schema}
+        logging.info(f"Successfully flushed {rows} rows into {table_name}.")
+        return rows
+
+
+def cast_column(column, dtype):
     """
-    Creates a new table in DuckDB if it does not already exist, or inserts data into an existing table.
-    Optionally drops the table if it already exists.
+    Builds the SQL expression casting a buffered column to its declared type.
 
     Args:
-        conn: The DuckDB connection object.
-        table_name (str): The name of the table to create or update.
-        temp_file_path (str): The path to the temporary file containing the JSON data to populate the table.
+        column (str): The column name.
+        dtype (str): The DuckDB type.
 
     Returns:
-        None
+        str: The SQL expression, mapping empty dates to NULL.
     """
-    # If table do NOT exists create a new one, else insert data
-    try:
-        tables = conn.execute("SHOW TABLES;").fetchall()
-
-        if (f"{table_name}",) not in tables:
-            conn.execute(
-                f"CREATE TABLE {table_name} AS SELECT * FROM read_json_auto('{temp_file_path}')")
-        else:
-            conn.execute(
-                f"INSERT INTO {table_name} SELECT * FROM read_json_auto('{temp_file_path}')")
-    except Exception as e:
-        logging.error(f"An error occurred while creating the table: {e}")
-        return
+    if dtype == 'DATE':
+        return f"TRY_CAST(NULLIF({column}, '') AS DATE) AS {column}"
+    return f"CAST({column} AS {dtype}) AS {column}"
 
 
-def init_duck_db_movies(conn, json_data=None, table_name='movies'):
+def init_duck_db_movies(conn, json_data=None, table_name='movies', buffer=None):
     '''
     Initilizes the 'movies' table and populates it with JSON data
 
     Args:
         conn : The DuckDB connection object.
-        json_data (dict, optional) : The JSON data to populate the table with. If None, data will be extracted
-        using the extract_movies function. Defaults to None. 
+        json_data (dict, optional) : The JSON data to populate the table with.
         table_name (str, optional): The name of the table to initialize. Defaults to 'movies'.
+        buffer (ColumnBuffer, optional): A buffer to add the movies to, flushed later by the caller.
+            If None, the movies are written right away. Defaults to None.
 
     Returns:
         None
     '''
-
-    # Write JSON string to a temporary file
     if json_data:
-        temp_file_path = write_json_to_temp_file(json_data, json_key='results')
-
-        # If table do NOT exists create a new one, else insert data
-        if temp_file_path:
-            create_table(conn, table_name, temp_file_path)
-            os.remove(temp_file_path)
-            logging.info(
-                f"Successfully initialized and populated the table {table_name}.")
+        pending = buffer if buffer is not None else ColumnBuffer(MOVIE_SCHEMA)
+        pending.add(json_data.get('results', []))
+        if buffer is None:
+            pending.flush(conn, table_name)
 
 
 def init_duck_db_genres(conn, json_data=None, table_name='genres'):
@@ -194,24 +558,16 @@ def init_duck_db_genres(conn, json_data=None, table_name='genres'):
 
     Args:
         conn : The DuckDB connection object.
-        path (str, optional) : The path to the DuckDB file. Defaults to "movies_data.duckdb".
-        json_data (dict, optional) : The JSON data to populate the table with. If None, data will be extracted
+        json_data (dict, optional) : The JSON data to populate the table with.
         table_name (str, optional): The name of the table to initialize. Defaults to 'genres'.
 
     Returns:
         None
     '''
-
-    # Write JSON string to a temporary file
     if json_data:
-        temp_file_path = write_json_to_temp_file(json_data, json_key='genres')
-
-        # If table do NOT exists create a new one, else insert data
-        if temp_file_path:
-            create_table(conn, table_name, temp_file_path)
-            os.remove(temp_file_path)
-            logging.info(
-                f"Successfully initialized and populated the table {table_name}.")
+        buffer = ColumnBuffer(GENRE_SCHEMA)
+        buffer.add(json_data.get('genres', []))
+        buffer.flush(conn, table_name)
 
 
 if __name__ == "__main__":
@@ -233,7 +589,9 @@ if __name__ == "__main__":
         for key in language_count:
         # print(key,language_count[key])
             print("Downloading", key, end=": ")
-            movies = extract_movies(api_key, key, language_count[key],conn,drop=True)  # noqa E501
+            failed = extract_movies(api_key, key, language_count[key], conn, drop=not incremental,
+                                    checkpoint_path=f"extract_{key}.checkpoint.json",
+                                    incremental=incremental, mark_deleted=mark_deleted)  # noqa E501
             genres = extract_genre(api_key, key,drop=True, conn=conn)
 
     except Exception as e:
@@ -0,0 +1,132 @@
+# + tags=["parameters"]
+# declare a list tasks whose products you want to use as inputs
+upstream = ['eda']
+top_k = 50
+chunk_size = 1000
+stop_words = 'english'
+
+# -
+
+import duckdb
+import logging
+import pandas as pd
+
+from app.recommenderhelper import (
+    retrieve_and_transform_data,
+    fit_tfidf_vectorizer,
+    normalize_rows,
+    compute_top_k_neighbors,
+)
+
+logging.basicConfig(filename='app.log', level=logging.INFO)
+
+
+def create_neighbor_table(conn, table_name='movie_neighbors'):
+    '''
+    Creates an empty neighbour table, replacing any existing one
+
+    Args:
+        conn: The DuckDB connection object.
+        table_name (str, optional): The name of the table to create. Defaults to 'movie_neighbors'.
+
+    Returns:
+        None
+    '''
+    conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+    conn.execute(
+        f"""CREATE TABLE {table_name} (
+            movie_id BIGINT,
+            rank INTEGER,
+            neighbor_id BIGINT,
+            score FLOAT
+        )""")
+    logging.info(f'Successfully created {table_name}')
+
+
+def insert_neighbors(conn, movie_ids, start, neighbors, scores, table_name='movie_neighbors'):
+    '''
+    Inserts one block of neighbours into the neighbour table
+
+    Args:
+        conn: The DuckDB connection object.
+        movie_ids (numpy.ndarray): The movie id of every matrix row.
+        start (int): The matrix row of the first movie in the block.
+        neighbors (numpy.ndarray): The neighbour rows of each movie in the block, best first.
+        scores (numpy.ndarray): The cosine similarity of each neighbour.
+        table_name (str, optional): The name of the table to insert into. Defaults to 'movie_neighbors'.
+
+    Returns:
+        None
+    '''
+    block_size, k = neighbors.shape
+    block = pd.DataFrame({
+        'movie_id': movie_ids[start:start + block_size].repeat(k),
+        'rank': list(range(1, k + 1)) * block_size,
+        'neighbor_id': movie_ids[neighbors.ravel()],
+        'score': scores.ravel().astype('float32'),
+    })
+    conn.register('neighbor_block', block)
+    conn.execute(f"INSERT INTO {table_name} SELECT * FROM neighbor_block")
+    conn.unregister('neighbor_block')
+
+
+def build_neighbors(conn, top_k=50, chunk_size=1000, stop_words='english', table_name='movie_neighbors'):
+    '''
+    Computes every movie's top-k neighbours and stores them in DuckDB
+
+    The similarities are computed in blocks of `chunk_size` movies, so the
+    build needs about `chunk_size * number of movies * 8` bytes of memory
+    for the scores regardless of the catalogue size.
+
+    Args:
+        conn: The DuckDB connection object.
+        top_k (int, optional): The number of neighbours per movie. Defaults to 50.
+        chunk_size (int, optional): The number of movies scored per block. Defaults to 1000.
+        stop_words (str, optional): The stop words used by the vectorizer. Defaults to 'english'.
+        table_name (str, optional): The name of the table to write. Defaults to 'movie_neighbors'.
+
+    Returns:
+        None
+    '''
+    df = retrieve_and_transform_data(conn)
+    if df.empty:
+        logging.error('No movie data available, neighbours not built')
+        return
+
+    _, tfidf_matrix = fit_tfidf_vectorizer(df, stop_words)
+    tfidf_matrix = normalize_rows(tfidf_matrix)
+    movie_ids = df['id'].values
+
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        create_neighbor_table(conn, table_name)
+        # Fewer than top_k columns if the catalogue has at most top_k movies
+        stored_k = 0
+        for start, neighbors, scores in compute_top_k_neighbors(tfidf_matrix, top_k, chunk_size):
+            insert_neighbors(conn, movie_ids, start, neighbors, scores, table_name)
+            stored_k = neighbors.shape[1]
+        conn.execute(f"CREATE INDEX {table_name}_movie_id ON {table_name} (movie_id)")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logging.info(f'Stored {stored_k} neighbours for {len(movie_ids)} movies in {table_name}')
+
+
+if __name__ == "__main__":
+    conn = None
+
+    # Initialize connection path
+    duckdb_file_path = "movies_data.duckdb"
+    try:
+        conn = duckdb.connect(duckdb_file_path, read_only=False)
+        logging.info('Connection opened')
+        build_neighbors(conn, top_k, chunk_size, stop_words)
+
+    except Exception as e:
+        logging.error(f'An error occurred: {e}')
+
+    finally:
+        if conn:
+            conn.close()
+            logging.info('Connection closed')
@@ -0,0 +1,75 @@
+import numpy as np
+from scipy import sparse
+from movie_rec_system.app.ann import AnnIndex, recall_at_k
+from movie_rec_system.app.recommender import recommendation_key
+from movie_rec_system.app.recommenderhelper import (
+    content_movie_recommender,
+    normalize_rows,
+    similar_movie_rows_batch,
+)
+from movie_rec_system.tests.test_engine import make_engine
+
+
+def make_clustered_matrix(n_movies=600, n_terms=300, n_topics=12, seed=0):
+    # Movies about the same topic share most of their terms
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(0, n_topics, n_movies)
+    topic_terms = rng.integers(0, n_terms, (n_topics, 20))
+    rows = np.repeat(np.arange(n_movies), 12)
+    columns = np.concatenate([
+        np.concatenate([rng.choice(topic_terms[topic], 8), rng.integers(0, n_terms, 4)])
+        for topic in topics
+    ])
+    matrix = sparse.csr_matrix(
+        (rng.random(len(rows)), (rows, columns)), shape=(n_movies, n_terms)
+    )
+    return normalize_rows(matrix)
+
+
+def test_full_probe_matches_exact_search():
+    matrix = make_clustered_matrix()
+    index = AnnIndex.build(matrix, n_components=32, n_lists=10)
+    queries = np.arange(0, 600, 37)
+    exact, _ = similar_movie_rows_batch(queries, matrix, 5)
+    approximate, _ = index.similar_rows(queries, matrix, 5, nprobe=10, oversample=40)
+    assert (approximate == exact).all()
+
+
+def test_recall_grows_with_nprobe():
+    engine = make_engine()
+    engine.tfidf_matrix = make_clustered_matrix()
+    engine.movie_list = np.arange(600).astype(str)
+    index = AnnIndex.build(engine.tfidf_matrix, n_components=32, n_lists=20)
+    report = recall_at_k(engine, index, k=10, nprobes=(1, 4, 20), n_queries=100)
+    recalls = [entry["recall"] for entry in report]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] > 0.9
+
+
+def test_index_round_trip_is_memory_mapped(tmp_path):
+    matrix = make_clustered_matrix()
+    index = AnnIndex.build(matrix, n_components=16, n_lists=8)
+    index.save(str(tmp_path / "ann"), report=[{"nprobe": 1, "recall": 0.5}])
+    loaded = AnnIndex.load(str(tmp_path / "ann"))
+
+    assert isinstance(loaded.vectors, np.memmap)
+    titles = np.arange(600).astype(str)
+    assert content_movie_recommender(3, matrix, titles, 5, ann_index=loaded, nprobe=4) == (
+        content_movie_recommender(3, matrix, titles, 5, ann_index=index, nprobe=4)
+    )
+    query = index.embed(matrix[[3]])
+    rows, _ = loaded.search(query, 1, nprobe=8)
+    assert rows[0][0] == 3
+
+
+def test_nprobe_can_be_set_per_call():
+    engine = make_engine()
+    engine.tfidf_matrix = make_clustered_matrix()
+    engine.ann_index = AnnIndex.build(engine.tfidf_matrix, n_components=32, n_lists=10)
+    engine.nprobe, engine.ann_oversample = 1, 40
+    queries = np.arange(0, 600, 37)
+    exact, _ = similar_movie_rows_batch(queries, engine.tfidf_matrix, 5)
+
+    assert (engine.similar_rows(queries, 5, nprobe=10) == exact).all()
+    assert engine.nprobe == 1
+    assert recommendation_key("alien", nprobe=10) != recommendation_key("alien")
@@ -1,16 +1,69 @@
+import threading
+import time
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
 from fastapi.testclient import TestClient
 from movie_rec_system.app.app import app
+from movie_rec_system.app.database import get_database
+from movie_rec_system.app.pool import PoolSaturated
 
-client = TestClient(app)
+TITLES = [
+    "Inception", "Interstellar", "The Dark Knight", "Oppenheimer", "Star Wars",
+    "Memento", "Tenet", "Dunkirk", "Titanic", "Avatar",
+]
+GENRES = ["Action", "Comedy", "Crime", "Drama", "Horror", "Romance", "Science Fiction"]
+WORDS = (
+    "alien city crime dragon dream family forest friend ghost heist house journey "
+    "killer king love magic mind ocean police robot school ship space spy thief time war"
+).split()
 
-def test_root_endpoint():
+
+def write_catalogue(path, n_movies=300, seed=0):
+    rng = np.random.default_rng(seed)
+    movies = pd.DataFrame({
+        "id": np.arange(1, n_movies + 1),
+        "title": TITLES + [f"Movie {i}" for i in range(len(TITLES), n_movies)],
+        "overview": [" ".join(rng.choice(WORDS, rng.integers(10, 40))) for _ in range(n_movies)],
+        "genre_names": [
+            ", ".join(rng.choice(GENRES, rng.integers(1, 4), replace=False))
+            for _ in range(n_movies)
+        ],
+        "release_date": pd.Timestamp("1970-01-01")
+        + pd.to_timedelta(rng.integers(0, 50 * 365, n_movies), unit="D"),
+        "original_language": rng.choice(["en", "es", "fr"], n_movies),
+        "popularity": np.round(rng.uniform(1, 500, n_movies), 3),
+        "vote_average": np.round(rng.uniform(1, 10, n_movies), 1),
+        "vote_count": rng.integers(3, 30000, n_movies),
+    })
+    with duckdb.connect(str(path)) as conn:
+        conn.register("movies", movies)
+        conn.execute(
+            """CREATE TABLE movie_genre_data AS SELECT * EXCLUDE (release_date),
+                CAST(release_date AS DATE) AS release_date FROM movies""")
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # The app reads movies_data.duckdb and writes artifacts in the working directory
+    directory = tmp_path_factory.mktemp("app")
+    write_catalogue(directory / "movies_data.duckdb")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(directory)
+        # Entering the client runs the lifespan hook that builds the engine
+        with TestClient(app) as client:
+            yield client
+        get_database().close()
+
+def test_root_endpoint(client):
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {
         "message": "Welcome! You can use this API to get movie recommendations based on viewers' votes. Visit /docs for more information and to try it out!"  # noqa E501
     }
 
-def test_recommendation_endpoint():
+def test_recommendation_endpoint(client):
     test_data = {"movie": "Inception", "num_rec": 5}
     response = client.post("/recommendations/", json=test_data)
     assert response.status_code == 200
@@ -18,12 +71,12 @@ def test_recommendation_endpoint():
     response_data = response.json()
     assert response_data["movie"] == "inception"
 
-def test_recommendation_for_nonexistent_movie():
+def test_recommendation_for_nonexistent_movie(client):
     test_data = {"movie": "NonExistentMovie", "num_rec": 5}
     response = client.post("/recommendations/", json=test_data)
     assert response.status_code == 404
 
-def test_recommendation_result():
+def test_recommendation_result(client):
     test_data = {"movie": "Inception", "num_rec": 5}
     response = client.post("/recommendations/", json=test_data)
     assert response.status_code == 200
@@ -44,3 +97,233 @@ def test_recommendation_result():
 
     assert isinstance(metrics["popularity"], float)
     assert isinstance(metrics["vote_avg"], float)
+
+def test_engine_is_shared_between_requests(client):
+    engine = app.state.engine
+    assert len(engine) > 0
+
+    client.post("/recommendations/", json={"movie": "Inception", "num_rec": 5})
+    client.post("/recommendations/", json={"movie": "Inception", "num_rec": 3})
+    assert app.state.engine is engine
+
+def test_batch_recommendation_endpoint(client):
+    test_data = {"movies": ["Inception", "NonExistentMovie"], "num_rec": 5}
+    response = client.post("/recommendations/batch", json=test_data)
+    assert response.status_code == 200
+
+    found, missing = response.json()["results"]
+    single = client.post(
+        "/recommendations/", json={"movie": "Inception", "num_rec": 5}
+    ).json()
+    assert found == single
+    assert missing == {"movie": "nonexistentmovie", "error": "Movie not found"}
+
+def test_batch_without_known_movies(client):
+    response = client.post(
+        "/recommendations/batch", json={"movies": ["NopeNope", "Zzzzzzqq"], "num_rec": 5}
+    )
+    assert response.status_code == 200
+    assert [result["error"] for result in response.json()["results"]] == [
+        "Movie not found", "Movie not found"
+    ]
+
+    response = client.post("/recommendations/batch", json={"movies": []})
+    assert response.status_code == 200
+    assert response.json() == {"results": []}
+
+def test_invalid_num_rec_is_rejected(client):
+    for endpoint, data in [
+        ("/recommendations/", {"movie": "Inception", "num_rec": 0}),
+        ("/recommendations/batch", {"movies": ["Inception"], "num_rec": 0}),
+        ("/recommendations/text", {"query": "a movie", "num_rec": -1}),
+        ("/recommendations/", {"movie": "Inception", "nprobe": 0}),
+    ]:
+        assert client.post(endpoint, json=data).status_code == 422
+
+def test_nprobe_is_accepted_per_request(client):
+    data = {"movie": "Inception", "num_rec": 5, "nprobe": 4}
+    response = client.post("/recommendations/", json=data)
+    assert response.status_code == 200
+    assert len(response.json()["recommendations"]) == 5
+    data = {"movies": ["Inception"], "num_rec": 5, "nprobe": 4}
+    assert client.post("/recommendations/batch", json=data).status_code == 200
+
+def test_batch_reports_movies_the_filter_leaves_without_recommendations(client):
+    data = {"movies": ["Inception", "NopeNope"], "genres": ["No Such Genre"]}
+    results = client.post("/recommendations/batch", json=data).json()["results"]
+    assert results == [
+        {"movie": "inception", "error": "No recommendations match the filter"},
+        {"movie": "nopenope", "error": "Movie not found"},
+    ]
+
+def test_repeated_recommendation_is_cached(client):
+    cache = app.state.cache
+    cache.invalidate()
+    first = client.post(
+        "/recommendations/", json={"movie": "Inception", "num_rec": 8}
+    ).json()
+    hits = cache.hits
+    second = client.post(
+        "/recommendations/", json={"movie": "Inception", "num_rec": 5}
+    ).json()
+    assert cache.hits == hits + 1
+    assert second["recommendations"] == first["recommendations"][:5]
+
+def test_title_search_endpoint(client):
+    response = client.get("/titles/search", params={"q": "incep"})
+    assert response.status_code == 200
+
+    match = response.json()["matches"][0]
+    assert match["title"] == "inception"
+    assert match["match"] == "prefix"
+    assert len(match["ids"]) == 1
+
+    for limit in (0, 101):
+        response = client.get("/titles/search", params={"q": "incep", "limit": limit})
+        assert response.status_code == 422
+
+def test_recommendation_for_misspelt_movie(client):
+    response = client.post(
+        "/recommendations/", json={"movie": "Incepton", "num_rec": 5}
+    )
+    assert response.status_code == 200
+    assert response.json()["movie"] == "inception"
+
+def test_health_endpoint(client):
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+def test_saturated_pool_returns_429(client, monkeypatch):
+    def saturated(*args, **kwargs):
+        raise PoolSaturated(retry_after=2)
+
+    monkeypatch.setattr(app.state.pool, "submit", saturated)
+    response = client.post(
+        "/recommendations/", json={"movie": "Inception", "num_rec": 5}
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+def test_model_version_is_reported(client):
+    version = client.get("/model/version").json()
+    assert version["version"] == app.state.engine.version
+    assert version["movies"] == len(app.state.engine)
+    assert not version["reloading"]
+
+    response = client.post(
+        "/recommendations/", json={"movie": "Inception", "num_rec": 5}
+    )
+    assert response.headers["X-Model-Version"] == version["version"]
+    response = client.get("/titles/search", params={"q": "incep"})
+    assert response.headers["X-Model-Version"] == version["version"]
+
+def test_recommendation_response_schema_is_documented(client):
+    schema = client.get("/openapi.json").json()
+    response = schema["paths"]["/recommendations/"]["post"]["responses"]["200"]
+    assert response["content"]["application/json"]["schema"] == {
+        "$ref": "#/components/schemas/RecommendationResult"
+    }
+
+
+def test_timing_header_is_opt_in(client):
+    data = {"movie": "Inception", "num_rec": 5}
+    assert "X-Timing" not in client.post("/recommendations/", json=data).headers
+
+    response = client.post("/recommendations/", json=data, headers={"X-Timing": "1"})
+    stages = [part.split(";")[0] for part in response.headers["X-Timing"].split(", ")]
+    assert {"queue", "lookup", "serialize", "total"} <= set(stages)
+
+
+def test_metrics_endpoint(client):
+    client.post("/recommendations/", json={"movie": "NonExistentMovie", "num_rec": 5})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    text = response.text
+    assert 'movie_rec_requests_total{endpoint="/recommendations/",status="404"}' in text
+    assert 'movie_rec_stage_seconds_bucket{stage="lookup",le="+Inf"}' in text
+    assert f'movie_rec_model_info{{version="{app.state.engine.version}"}} 1' in text
+    assert f"movie_rec_catalogue_movies {len(app.state.engine)}" in text
+    assert "movie_rec_cache_hits_total" in text
+    assert "movie_rec_coalesced_requests_total" in text
+
+
+def test_recommendations_can_be_filtered(client):
+    engine = app.state.engine
+    facets = engine.catalogue.facets
+    genre = facets.genre_names[0]
+    data = {"movie": "Inception", "num_rec": 5, "genres": [genre.title()], "min_votes": 1}
+    response = client.post("/recommendations/", json=data)
+    assert response.status_code == 200
+
+    bit = np.uint64(1) << np.uint64(0)
+    for title in response.json()["recommendations"]:
+        row = engine.lookup(title)
+        assert facets.genres[row] & bit
+
+    data = {"movie": "Inception", "num_rec": 5, "genres": ["No Such Genre"]}
+    assert client.post("/recommendations/", json=data).status_code == 404
+
+
+def test_text_recommendation_endpoint(client):
+    engine = app.state.engine
+    query = f"a {engine.catalogue.facets.genre_names[0]} movie"
+    response = client.post("/recommendations/text", json={"query": query, "num_rec": 3})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["query"] == query
+    assert 0 < len(result["recommendations"]) <= 3
+    assert result["scores"] == sorted(result["scores"], reverse=True)
+
+    data = {"query": "zzzz qqqq", "num_rec": 3}
+    assert client.post("/recommendations/text", json=data).status_code == 404
+    data = {"query": query, "hybrid": {"votes": 1}}
+    assert client.post("/recommendations/text", json=data).status_code == 422
+
+
+def test_identical_concurrent_requests_are_coalesced(client, monkeypatch):
+    pool = app.state.pool
+    submit = pool.submit
+    release = threading.Event()
+    submitted = []
+
+    def slow_submit(fn, *args, **kwargs):
+        submitted.append(fn)
+        return submit(lambda: (release.wait(timeout=5), fn(*args, **kwargs))[1])
+
+    monkeypatch.setattr(pool, "submit", slow_submit)
+    flights = app.state.flights
+    before = flights.stats()
+    data = {"movie": "the dark knight", "num_rec": 3, "min_votes": 1}
+    responses = []
+    threads = [
+        threading.Thread(target=lambda: responses.append(client.post("/recommendations/", json=data)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    while flights.stats()["coalesced"] < before["coalesced"] + 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert [response.status_code for response in responses] == [200] * 4
+    assert len({response.text for response in responses}) == 1
+    assert len(submitted) == 1
+    assert flights.stats()["leaders"] == before["leaders"] + 1
+
+def test_model_reload_needs_configured_token(client, monkeypatch):
+    response = client.post("/model/reload")
+    assert response.status_code == 403
+    assert "disabled" in response.json()["detail"]
+
+    monkeypatch.setattr("movie_rec_system.app.app.ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(app.state.reloader, "reload", lambda force: False)
+    response = client.post("/model/reload", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403
+    response = client.post("/model/reload", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 202
+    assert response.json()["started"] is False
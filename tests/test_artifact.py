@@ -0,0 +1,167 @@
+import duckdb
+import numpy as np
+import pandas as pd
+from movie_rec_system.app.ann import AnnIndex
+from movie_rec_system.app.catalogue import memory_report, sparse_nbytes
+from movie_rec_system.app.database import get_database
+from movie_rec_system.app.filters import MovieFilter
+from movie_rec_system.app.artifact import (
+    find_artifact,
+    load_artifact,
+    load_or_build_engine,
+    save_artifact,
+)
+from movie_rec_system.app.recommenderhelper import create_combined, similar_movie_rows_batch
+from movie_rec_system.app.reloader import ModelReloader
+from movie_rec_system.tests.test_engine import make_engine, make_updatable_engine
+
+
+def test_artifact_round_trip(tmp_path):
+    engine = make_engine()
+    path = save_artifact(engine, "checksum", root=str(tmp_path))
+    loaded = load_artifact(path)
+
+    assert list(loaded.movie_list) == list(engine.movie_list)
+    assert not loaded.tfidf_matrix.data.flags.writeable  # memory-mapped
+    np.testing.assert_allclose(
+        loaded.tfidf_matrix.toarray(), engine.tfidf_matrix.toarray()
+    )
+    # Exact scoring reads the stored transpose instead of building a copy
+    assert not loaded.term_matrix.data.flags.writeable
+    np.testing.assert_allclose(
+        loaded.term_matrix.toarray(), engine.tfidf_matrix.T.toarray()
+    )
+    assert memory_report(loaded)["term_matrix"] == sparse_nbytes(loaded.term_matrix)
+    query = ["aliens on a ship"]
+    np.testing.assert_allclose(
+        loaded.vectorizer.transform(query).toarray(),
+        engine.vectorizer.transform(query).toarray(),
+    )
+    horror = MovieFilter.create(genres=["horror"])
+    assert loaded.catalogue.facets.genre_names == engine.catalogue.facets.genre_names
+    assert list(loaded.filter_rows(horror)) == list(engine.filter_rows(horror)) == [0]
+
+
+def test_artifact_keeps_updatable_text_model(tmp_path):
+    engine = make_updatable_engine()
+    engine.run_id = 3
+    loaded = load_artifact(save_artifact(engine, "checksum", root=str(tmp_path)))
+    assert loaded.run_id == 3
+
+    changed = create_combined(pd.DataFrame({
+        "id": [40], "title": ["wall-e"], "overview": ["a robot alone on earth"],
+        "genre_names": ["Animation"], "popularity": [4.0], "vote_average": [8.4],
+        "vote_count": [400],
+    }))
+    expected = engine.apply_changes(changed, removed_ids=[10])
+    updated = loaded.apply_changes(changed, removed_ids=[10])
+    assert list(updated.catalogue.ids) == list(expected.catalogue.ids) == [20, 30, 40]
+    np.testing.assert_allclose(
+        updated.tfidf_matrix.toarray(), expected.tfidf_matrix.toarray()
+    )
+
+
+def test_stale_artifact_is_not_found(tmp_path):
+    save_artifact(make_engine(), "old-checksum", root=str(tmp_path))
+    assert find_artifact("old-checksum", root=str(tmp_path)) is not None
+    assert find_artifact("new-checksum", root=str(tmp_path)) is None
+
+
+def test_incremental_updates_survive_restart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = str(tmp_path / "artifacts")
+    with duckdb.connect("movies_data.duckdb") as conn:
+        conn.execute("CREATE TABLE genres (id BIGINT, name VARCHAR)")
+        conn.execute("INSERT INTO genres VALUES (1, 'Horror'), (2, 'Animation')")
+        conn.execute(
+            """CREATE TABLE movies AS SELECT * FROM (VALUES
+                (10, 'Alien', 'alien on a ship', [1], 1.0, 8.0, 100, 'en', DATE '1979-05-25'),
+                (20, 'Aliens', 'aliens on a planet', [1], 2.0, 7.5, 200, 'en', DATE '1986-07-18'),
+                (40, 'WALL-E', 'a robot alone on earth', [2], 4.0, 8.4, 400, 'en', DATE '2008-06-27')
+            ) AS t(id, title, overview, genre_ids, popularity, vote_average,
+                   vote_count, original_language, release_date)""")
+        # Built before run 2 and never rebuilt, like etl/eda.ipynb does
+        conn.execute(
+            """CREATE TABLE movie_genre_data AS
+            SELECT m.id, m.title, m.overview, 'Horror' AS genre_names, m.release_date,
+                   m.original_language, m.popularity, m.vote_average, m.vote_count
+            FROM movies m WHERE m.id != 40""")
+        conn.execute(
+            """CREATE TABLE movies_changelog AS SELECT * FROM (VALUES
+                (1, 10, 'inserted'), (1, 20, 'inserted'), (2, 40, 'inserted')
+            ) AS t(run_id, movie_id, change)""")
+
+    engine = load_or_build_engine(root=root)
+    assert engine.run_id == 2
+    assert engine.lookup("wall-e") is not None
+
+    restarted = load_or_build_engine(root=root)
+    assert find_artifact(restarted.source_checksum, root=root) is not None
+    assert restarted.run_id == 2 and restarted.text_model is not None
+    assert list(restarted.catalogue.ids) == list(engine.catalogue.ids) == [10, 20, 40]
+    np.testing.assert_allclose(
+        restarted.tfidf_matrix.toarray(), engine.tfidf_matrix.toarray()
+    )
+
+    get_database().close()
+    with duckdb.connect("movies_data.duckdb") as conn:
+        conn.execute("INSERT INTO movies_changelog VALUES (3, 20, 'deleted')")
+    assert ModelReloader(restarted, root=root).pending_change() == "incremental"
+    assert list(restarted.refresh().catalogue.ids) == [10, 40]
+    get_database().close()
+
+
+def test_neighbors_and_ann_index_survive_changelog_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = str(tmp_path / "artifacts")
+    with duckdb.connect("movies_data.duckdb") as conn:
+        conn.execute(
+            """CREATE TABLE movie_genre_data AS SELECT * FROM (VALUES
+                (10, 'Alien', 'alien on a ship', 'Horror', DATE '1979-05-25', 'en', 1.0, 8.0, 100),
+                (20, 'Aliens', 'aliens on a planet', 'Horror', DATE '1986-07-18', 'en', 2.0, 7.5, 200),
+                (30, 'Up', 'a house flies with balloons', 'Animation', DATE '2009-05-29', 'en', 3.0, 8.3, 300)
+            ) AS t(id, title, overview, genre_names, release_date, original_language,
+                   popularity, vote_average, vote_count)""")
+        conn.execute(
+            """CREATE TABLE movies AS
+            SELECT id, title, overview, [1] AS genre_ids, popularity, vote_average,
+                   vote_count, original_language, release_date
+            FROM movie_genre_data""")
+        conn.execute("CREATE TABLE genres (id BIGINT, name VARCHAR)")
+        conn.execute("INSERT INTO genres VALUES (1, 'Horror')")
+        conn.execute(
+            """CREATE TABLE movie_neighbors AS SELECT * FROM (VALUES
+                (10, 1, 20, 0.5), (20, 1, 10, 0.5), (30, 1, 10, 0.0)
+            ) AS t(movie_id, rank, neighbor_id, score)""")
+        conn.execute("CREATE TABLE movies_changelog (run_id BIGINT, movie_id BIGINT, change VARCHAR)")
+    engine = load_or_build_engine(root=root)
+    assert engine.neighbors is not None and engine.run_id == 0
+    path = find_artifact(engine.source_checksum, root=root)
+    AnnIndex.build(engine.tfidf_matrix, n_components=2, n_lists=1).save(f"{path}/ann")
+    get_database().close()
+
+    # A new movie and a changed one, as logged by an incremental extraction
+    with duckdb.connect("movies_data.duckdb") as conn:
+        conn.execute(
+            """INSERT INTO movies VALUES
+                (40, 'Alien Ship', 'a ship of aliens', [1], 4.0, 6.0, 50, 'en', DATE '2020-01-01')""")
+        conn.execute("UPDATE movies SET overview = 'a robot alone on earth' WHERE id = 30")
+        conn.execute("INSERT INTO movies_changelog VALUES (1, 40, 'inserted'), (1, 30, 'updated')")
+
+    for _ in range(2):
+        # The second start loads the artifact of run 1 instead of replaying it
+        engine = load_or_build_engine(root=root, nprobe=1)
+        assert engine.run_id == 1 and engine.version.endswith("+run1")
+        assert find_artifact(engine.source_checksum, root=root).endswith("+run1")
+        assert engine.neighbors is not None and engine.ann_index is not None
+        assert not engine.neighbors.flags.writeable  # memory-mapped
+        assert len(engine.ann_index) == len(engine) == 4
+        exact_rows, exact_scores = similar_movie_rows_batch(
+            np.arange(len(engine)), engine.tfidf_matrix, 1
+        )
+        np.testing.assert_array_equal(engine.neighbors, exact_rows)
+        np.testing.assert_allclose(engine.neighbor_scores, exact_scores, rtol=1e-6)
+        # More than the precomputed neighbours, so the ANN index answers
+        rows, _ = engine.scored_rows([engine.lookup("alien ship")], 2)
+        assert sorted(engine.movie_list[rows[0]]) == ["alien", "aliens"]
+        get_database().close()
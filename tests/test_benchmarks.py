@@ -0,0 +1,37 @@
+import duckdb
+from movie_rec_system.benchmarks.run import compare, summarize
+from movie_rec_system.benchmarks.synthetic import generate_movies, write_database
+
+
+def test_synthetic_movies_are_reproducible():
+    movies = generate_movies(500, seed=1, vocabulary_size=2000)
+    assert len(movies) == 500
+    assert movies["id"].is_unique
+    assert (movies["vote_count"] > 0).all()
+    assert movies["overview"].str.split().str.len().between(5, 200).all()
+    assert movies.equals(generate_movies(500, seed=1, vocabulary_size=2000))
+
+
+def test_synthetic_database_matches_movie_genre_data(tmp_path):
+    path = write_database(str(tmp_path / "movies.duckdb"), 200)
+    with duckdb.connect(path, read_only=True) as conn:
+        columns = [row[0] for row in conn.execute("DESCRIBE movie_genre_data").fetchall()]
+        count = conn.execute("SELECT count(*) FROM movie_genre_data").fetchone()[0]
+    assert columns == [
+        "genre_names", "id", "original_language", "overview", "popularity",
+        "release_date", "title", "vote_average", "vote_count",
+    ]
+    assert count == 200
+
+
+def test_summary_and_comparison():
+    summary = summarize([0.001] * 98 + [0.010, 0.020], items=2)
+    assert summary["runs"] == 100
+    assert summary["p50_ms"] == 1.0
+    assert summary["p99_ms"] > summary["p95_ms"]
+    assert summary["throughput_per_s"] > 0
+
+    baseline = {"sizes": {"10": {"single_query": {"p50_ms": 2.0}}}}
+    results = {"sizes": {"10": {"single_query": {"p50_ms": 1.0}, "new_stage": {"p50_ms": 1.0}}}}
+    lines = compare(baseline, results)
+    assert len(lines) == 1 and "-50.0%" in lines[0]
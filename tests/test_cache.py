@@ -0,0 +1,44 @@
+import time
+from movie_rec_system.app.cache import RecommendationCache
+
+
+class Engine:
+    pass
+
+
+def test_larger_answer_serves_smaller_request():
+    cache = RecommendationCache()
+    cache.put("inception", 20, list(range(20)))
+    assert cache.get("inception", 5) == list(range(20))
+    assert cache.get("inception", 30) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A smaller answer does not replace a larger one
+    cache.put("inception", 5, list(range(5)))
+    assert cache.get("inception", 20) == list(range(20))
+
+
+def test_lru_eviction_and_ttl():
+    cache = RecommendationCache(maxsize=2, ttl=0.05)
+    cache.put("a", 5, "a")
+    cache.put("b", 5, "b")
+    cache.get("a", 5)
+    cache.put("c", 5, "c")
+    assert cache.get("b", 5) is None
+    assert cache.evictions == 1
+
+    time.sleep(0.06)
+    assert cache.get("a", 5) is None
+
+
+def test_binding_new_engine_invalidates():
+    cache = RecommendationCache()
+    old_engine, new_engine = Engine(), Engine()
+    cache.bind(old_engine)
+    cache.put("inception", 5, "old")
+    cache.bind(old_engine)
+    assert cache.get("inception", 5) == "old"
+
+    cache.bind(new_engine)
+    assert cache.get("inception", 5) is None
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from movie_rec_system.app.catalogue import Catalogue, StringColumn, memory_report
+from movie_rec_system.tests.test_engine import make_engine, make_movies
+
+
+def test_string_column_decodes_on_demand():
+    titles = StringColumn.from_values(["alien", "amélie", "up"])
+    assert len(titles) == 3
+    assert titles[1] == "amélie"
+    assert titles[-1] == "up"
+    assert list(titles[[2, 0]]) == ["up", "alien"]
+    assert list(titles[1:]) == ["amélie", "up"]
+    assert list(titles.take([1, 1, 2])) == ["amélie", "amélie", "up"]
+
+
+def test_catalogue_upsert_orders_by_ids():
+    catalogue = Catalogue.from_frame(make_movies())
+    assert catalogue.metrics.dtype == np.float32
+    assert list(catalogue.rows_of([30, 99, 10])) == [2, -1, 0]
+
+    changed = Catalogue.from_frame(pd.DataFrame({
+        "id": [40, 20],
+        "title": ["wall-e", "aliens 2"],
+        "popularity": [4.0, 5.0],
+        "vote_average": [8.4, 7.0],
+        "vote_count": [400, 500],
+    }))
+    merged = catalogue.upsert(changed, [10, 20, 40])
+    assert list(merged.ids) == [10, 20, 40]
+    assert list(merged.titles) == ["alien", "aliens 2", "wall-e"]
+    assert list(merged.metrics[:, 2]) == [100, 500, 400]
+
+
+def test_memory_report_compares_with_dataframe():
+    frame = make_movies()
+    report = memory_report(make_engine(), frame)
+    assert report["catalogue"] < report["dataframe"]
+    assert report["total"] == sum(
+        value for key, value in report.items() if key not in ("total", "dataframe")
+    )
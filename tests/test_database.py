@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+import duckdb
+import pytest
+from movie_rec_system.app.database import Database, get_database
+from movie_rec_system.app.recommenderhelper import MODEL_COLUMNS, get_data
+
+
+def write_database(path, n_rows):
+    with duckdb.connect(str(path)) as conn:
+        conn.execute(
+            """CREATE TABLE movie_genre_data AS SELECT
+                range AS id, 'movie ' || range AS title, 'an overview' AS overview,
+                'Drama' AS genre_names, 1.0 AS popularity, 7.0 AS vote_average,
+                10 AS vote_count, 'en' AS original_language,
+                DATE '2001-01-01' AS release_date, 'poster.jpg' AS poster_path
+            FROM range(?)""", [n_rows])
+
+
+def test_cursors_are_per_thread_and_read_only(tmp_path):
+    write_database(tmp_path / "movies.duckdb", 3)
+    database = Database(str(tmp_path / "movies.duckdb"))
+    cursors = []
+
+    def borrow():
+        with database.cursor() as cursor:
+            cursors.append(cursor)
+            assert cursor.execute("SELECT count(*) FROM movie_genre_data").fetchone() == (3,)
+
+    threads = [threading.Thread(target=borrow) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(map(id, cursors))) == 3
+    assert database.opens == 1
+
+    with database.cursor() as cursor:
+        with pytest.raises(duckdb.Error):
+            cursor.execute("DELETE FROM movie_genre_data")
+    database.close()
+
+
+def test_idle_connection_is_released_and_replaced_file_reopened(tmp_path):
+    path = tmp_path / "movies.duckdb"
+    write_database(path, 3)
+    database = Database(str(path), linger=0.05)
+    with database.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    time.sleep(0.3)
+    # The file is no longer locked, so a new version can be written
+    os.remove(path)
+    write_database(path, 5)
+
+    with database.cursor() as cursor:
+        assert cursor.execute("SELECT count(*) FROM movie_genre_data").fetchone() == (5,)
+    assert database.opens == 2
+    database.close()
+
+
+def test_get_data_reads_only_model_columns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_database(tmp_path / "movies_data.duckdb", 4)
+    df = get_data()
+    get_database().close()
+
+    assert list(df.columns) == MODEL_COLUMNS
+    assert len(df) == 4
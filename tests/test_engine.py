@@ -0,0 +1,172 @@
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+from movie_rec_system.app.database import get_database
+from movie_rec_system.app.engine import RecommenderEngine
+from movie_rec_system.app.filters import MovieFilter
+from movie_rec_system.app.ranking import HybridWeights
+from movie_rec_system.app.recommenderhelper import (
+    create_combined,
+    fit_tfidf_vectorizer,
+    get_movie_changes,
+)
+from movie_rec_system.app.textmodel import IncrementalTfidf
+
+
+def make_movies():
+    df = pd.DataFrame({
+        "id": [10, 20, 30],
+        "title": ["alien", "aliens", "up"],
+        "overview": ["alien on a ship", "aliens on a planet", "a flying house"],
+        "genre_names": ["Horror", "Action", "Animation"],
+        "popularity": [1.0, 2.0, 3.0],
+        "vote_average": [8.0, 7.5, 8.2],
+        "vote_count": [100, 200, 300],
+    })
+    return create_combined(df)
+
+
+def make_engine():
+    df = make_movies()
+    vectorizer, tfidf_matrix = fit_tfidf_vectorizer(df)
+    return RecommenderEngine(df, vectorizer, tfidf_matrix)
+
+
+def test_attach_neighbors_maps_ids_to_rows():
+    engine = make_engine()
+    table = pd.DataFrame({
+        "movie_id": [10, 10, 20, 20, 30, 30],
+        "rank": [2, 1, 1, 2, 1, 2],
+        "neighbor_id": [30, 20, 10, 30, 10, 20],
+        "score": [0.1, 0.5, 0.5, 0.1, 0.1, 0.1],
+    })
+    assert engine.attach_neighbors(table)
+    assert list(engine.precomputed_neighbors(0, 2)) == [1, 2]
+    assert engine.precomputed_neighbors(0, 3) is None
+    assert list(engine.precomputed_neighbors(0, 3, live_fallback=False)) == [1, 2]
+
+
+def test_stale_neighbor_table_is_ignored():
+    engine = make_engine()
+    table = pd.DataFrame({
+        "movie_id": [10, 20, 99],
+        "rank": [1, 1, 1],
+        "neighbor_id": [20, 10, 10],
+        "score": [0.5, 0.5, 0.1],
+    })
+    assert not engine.attach_neighbors(table)
+    assert engine.precomputed_neighbors(0, 1) is None
+
+
+def make_updatable_engine():
+    df = make_movies()
+    text_model = IncrementalTfidf().fit(df["combined"], df["id"])
+    engine = RecommenderEngine(df, text_model.to_vectorizer(), text_model.matrix)
+    engine.text_model = text_model
+    return engine
+
+
+def test_text_query_uses_fitted_model():
+    engine = make_engine()
+    vocabulary = dict(engine.vectorizer.vocabulary_)
+
+    rows, scores = engine.text_rows("an alien ship full of aliens", 3)
+    assert list(engine.movie_list[rows]) == ["alien", "aliens"]
+    assert scores[0] > scores[1] > 0
+    # Queries are vectorized without refitting the model
+    assert engine.vectorizer.vocabulary_ == vocabulary
+
+    action = MovieFilter.create(genres=["Action"])
+    rows, _ = engine.text_rows("an alien ship full of aliens", 3, action)
+    assert list(engine.movie_list[rows]) == ["aliens"]
+    assert not len(engine.text_rows("zeppelin", 3)[0])
+    with pytest.raises(ValueError):
+        engine.text_rows("aliens", 3, weights=HybridWeights(votes=1))
+
+
+def test_apply_changes_returns_updated_engine():
+    engine = make_updatable_engine()
+    changed = create_combined(pd.DataFrame({
+        "id": [20, 40],
+        "title": ["aliens", "wall-e"],
+        "overview": ["aliens on a ship", "a robot alone on earth"],
+        "genre_names": ["Horror", "Animation"],
+        "popularity": [2.0, 4.0],
+        "vote_average": [7.5, 8.4],
+        "vote_count": [200, 400],
+    }))
+    updated = engine.apply_changes(changed, removed_ids=[30])
+
+    assert list(updated.catalogue.ids) == [10, 20, 40]
+    assert updated.lookup("up") is None
+    assert updated.lookup("wall-e") == 2
+    assert updated.lookup("", movie_id=40) == 2
+    assert updated.tfidf_matrix.shape[0] == 3
+    assert list(updated.metrics[:, 0]) == [1.0, 2.0, 4.0]
+    # The serving engine is untouched
+    assert list(engine.catalogue.ids) == [10, 20, 30]
+    assert engine.tfidf_matrix.shape[0] == 3
+
+
+def test_apply_changes_needs_text_model():
+    with pytest.raises(ValueError):
+        make_engine().apply_changes(pd.DataFrame(), removed_ids=[10])
+
+
+def test_get_movie_changes_reads_latest_change_per_movie(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with duckdb.connect("movies_data.duckdb") as conn:
+        conn.execute("CREATE TABLE genres (id BIGINT, name VARCHAR)")
+        conn.execute("INSERT INTO genres VALUES (1, 'Horror'), (2, 'Action')")
+        conn.execute(
+            """CREATE TABLE movies AS SELECT * FROM (VALUES
+                (10, 'Alien', 'alien on a ship', [1], 1.0, 8.0, 100, 'en', DATE '1979-05-25'),
+                (20, 'Aliens', 'aliens on a planet', [1, 2], 2.0, 7.5, 0, 'en', NULL)
+            ) AS t(id, title, overview, genre_ids, popularity, vote_average,
+                   vote_count, original_language, release_date)""")
+        conn.execute(
+            """CREATE TABLE movies_changelog AS SELECT * FROM (VALUES
+                (1, 10, 'inserted'), (1, 30, 'inserted'), (2, 30, 'deleted'),
+                (2, 20, 'updated')
+            ) AS t(run_id, movie_id, change)""")
+
+    changed, removed_ids, run_id = get_movie_changes(since_run_id=0)
+    assert run_id == 2
+    assert list(changed["id"]) == [10]
+    assert changed.loc[0, "title"] == "alien"
+    assert "combined" in changed
+    # 30 was deleted and 20 has no votes any more
+    assert list(removed_ids) == [20, 30]
+
+    changed, removed_ids, run_id = get_movie_changes(since_run_id=2)
+    assert run_id == 2 and changed.empty and len(removed_ids) == 0
+
+
+def test_batched_build_matches_in_memory_build(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with duckdb.connect("movies_data.duckdb") as conn:
+        conn.execute(
+            """CREATE TABLE movie_genre_data AS SELECT
+                range AS id, 'Movie ' || range AS title,
+                'plot ' || ['heist', 'space', 'love', 'ghost'][range % 4 + 1]
+                    || ' story' || range % 3 AS overview,
+                ['Crime', 'Drama', 'Horror, Comedy'][range % 3 + 1] AS genre_names,
+                range * 0.5 AS popularity, 7.0 AS vote_average, range AS vote_count,
+                ['en', 'fr'][range % 2 + 1] AS original_language,
+                DATE '2001-01-01' + INTERVAL (range) YEAR AS release_date
+            FROM range(20)""")
+        # Deleted rows leave gaps in the row ids batches are read by
+        conn.execute("DELETE FROM movie_genre_data WHERE id IN (4, 5, 6)")
+
+    expected = RecommenderEngine.from_database(use_neighbors=False, batch_size=0)
+    engine = RecommenderEngine.from_database(use_neighbors=False, batch_size=4)
+    get_database().close()
+
+    assert len(engine) == len(expected) == 17
+    np.testing.assert_array_equal(engine.catalogue.ids, expected.catalogue.ids)
+    assert list(engine.movie_list) == list(expected.movie_list)
+    assert engine.catalogue.facets.genre_names == expected.catalogue.facets.genre_names
+    np.testing.assert_array_equal(engine.catalogue.facets.genres, expected.catalogue.facets.genres)
+    np.testing.assert_array_equal(engine.tfidf_matrix.toarray(), expected.tfidf_matrix.toarray())
+    assert engine.text_model.vocabulary == expected.text_model.vocabulary
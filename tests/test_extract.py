@@ -0,0 +1,154 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import duckdb
+import pytest
+from movie_rec_system.etl.extract import (
+    MOVIE_SCHEMA,
+    ColumnBuffer,
+    extract_movies,
+    save_checkpoint,
+    upsert_movies,
+)
+
+
+def make_movie(movie_id):
+    return {
+        "adult": False, "backdrop_path": None, "genre_ids": [18],
+        "id": movie_id, "original_language": "en", "original_title": f"Movie {movie_id}",
+        "overview": "A movie", "popularity": 1.5, "poster_path": None,
+        "release_date": "2020-01-01", "title": f"Movie {movie_id}", "video": False,
+        "vote_average": 7.0, "vote_count": 10,
+    }
+
+
+class StubTMDB(BaseHTTPRequestHandler):
+    """Serves /movie/popular, rate limiting the first request for page 2."""
+
+    requested_pages = []
+    throttled = set()
+
+    def do_GET(self):
+        page = int(parse_qs(urlparse(self.path).query)["page"][0])
+        self.requested_pages.append(page)
+        if page == 2 and page not in self.throttled:
+            self.throttled.add(page)
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        body = json.dumps({
+            "page": page,
+            "results": [make_movie(page * 100 + i) for i in range(20)],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    StubTMDB.requested_pages = []
+    StubTMDB.throttled = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubTMDB)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_concurrent_extraction_retries_throttled_pages(stub_url, tmp_path):
+    conn = duckdb.connect()
+    checkpoint = tmp_path / "checkpoint.json"
+    failed = extract_movies("key", num_movies=100, conn=conn, drop=True, workers=3,
+                            checkpoint_path=str(checkpoint), base_url=stub_url)
+
+    assert failed == []
+    assert conn.execute("SELECT count(DISTINCT id) FROM movies").fetchone()[0] == 100
+    assert StubTMDB.requested_pages.count(2) == 2
+    assert not checkpoint.exists()
+
+
+def test_extraction_resumes_from_checkpoint(stub_url, tmp_path):
+    conn = duckdb.connect()
+    checkpoint = tmp_path / "checkpoint.json"
+    save_checkpoint(str(checkpoint), {1, 3})
+
+    extract_movies("key", num_movies=100, conn=conn, drop=True,
+                   checkpoint_path=str(checkpoint), base_url=stub_url)
+
+    assert sorted(StubTMDB.requested_pages) == [2, 2, 4, 5]
+
+
+def test_buffered_pages_are_flushed_with_declared_schema(stub_url):
+    conn = duckdb.connect()
+    extract_movies("key", num_movies=100, conn=conn, flush_rows=40, base_url=stub_url)
+
+    columns = dict(conn.execute("SELECT column_name, column_type FROM (DESCRIBE movies)").fetchall())
+    assert columns == MOVIE_SCHEMA
+    assert conn.execute("SELECT count(*) FROM movies").fetchone()[0] == 100
+
+
+def test_column_buffer_handles_missing_fields():
+    conn = duckdb.connect()
+    buffer = ColumnBuffer(MOVIE_SCHEMA)
+    buffer.add([dict(make_movie(1), release_date=""), {"id": 2, "title": "Sparse"}])
+    assert buffer.flush(conn, "movies") == 2
+    assert len(buffer) == 0
+    assert conn.execute(
+        "SELECT id, release_date, genre_ids FROM movies ORDER BY id"
+    ).fetchall() == [(1, None, [18]), (2, None, None)]
+
+
+def stage(conn, movies):
+    conn.execute("DROP TABLE IF EXISTS movies_staging")
+    buffer = ColumnBuffer(MOVIE_SCHEMA)
+    buffer.add(movies)
+    buffer.flush(conn, "movies_staging")
+
+
+def test_upsert_tracks_inserts_updates_and_deletes():
+    conn = duckdb.connect()
+    stage(conn, [make_movie(1), make_movie(2), make_movie(3)])
+    assert upsert_movies(conn) == {"run_id": 1, "inserted": 3, "updated": 0, "deleted": 0}
+
+    # Vote changes are upserted but only overview and genre changes count as updates
+    stage(conn, [
+        dict(make_movie(1), vote_count=99),
+        dict(make_movie(2), overview="A new overview"),
+        make_movie(4),
+    ])
+    assert upsert_movies(conn, mark_deleted=True) == {
+        "run_id": 2, "inserted": 1, "updated": 1, "deleted": 1
+    }
+
+    assert conn.execute(
+        "SELECT id, vote_count FROM movies ORDER BY id"
+    ).fetchall() == [(1, 99), (2, 10), (4, 10)]
+    assert conn.execute(
+        "SELECT movie_id, change FROM movies_changelog WHERE run_id = 2 ORDER BY movie_id"
+    ).fetchall() == [(2, "updated"), (3, "deleted"), (4, "inserted")]
+    first_seen, updated_at = conn.execute(
+        "SELECT first_seen, updated_at FROM movies WHERE id = 1"
+    ).fetchone()
+    assert first_seen == updated_at
+
+
+def test_incremental_extraction_upserts_into_existing_table(stub_url):
+    conn = duckdb.connect()
+    extract_movies("key", num_movies=40, conn=conn, drop=True, base_url=stub_url)
+    extract_movies("key", num_movies=60, conn=conn, incremental=True, base_url=stub_url)
+
+    assert conn.execute("SELECT count(*), count(DISTINCT id) FROM movies").fetchone() == (60, 60)
+    assert conn.execute(
+        "SELECT change, count(*) FROM movies_changelog GROUP BY change"
+    ).fetchall() == [("inserted", 20)]
+    assert "movies_staging" not in [t for (t,) in conn.execute("SHOW TABLES").fetchall()]
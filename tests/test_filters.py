@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+from movie_rec_system.app.ann import AnnIndex
+from movie_rec_system.app.filters import Facets, MovieFilter
+from movie_rec_system.app.recommender import get_batch_recommendations, get_recommendation
+from movie_rec_system.app.recommenderhelper import similar_movie_rows_batch
+from movie_rec_system.tests.test_ann import make_clustered_matrix
+from movie_rec_system.tests.test_engine import make_engine
+
+
+def make_facets():
+    return Facets.from_frame(pd.DataFrame({
+        "genre_names": ["Comedy, Drama", "Horror", None, "Drama"],
+        "release_date": pd.to_datetime(["2012-01-01", "1999-05-01", None, "2015-07-04"]),
+        "original_language": ["en", "fr", "en", None],
+    }))
+
+
+def test_filters_combine_as_masks():
+    facets = make_facets()
+    votes = np.array([10, 500, 50, 300])
+    assert facets.genre_names == ["comedy", "drama", "horror"]
+
+    def rows(**conditions):
+        return list(facets.rows(MovieFilter.create(**conditions), votes))
+
+    assert rows(genres=["drama"]) == [0, 3]
+    assert rows(genres=["Comedy", "horror"]) == [0, 1]
+    assert rows(genres=["western"]) == []
+    assert rows(year_min=2010) == [0, 3]
+    assert rows(year_max=2010) == [1]
+    assert rows(min_votes=100, languages=["en", "fr"]) == [1]
+    assert rows(genres=["drama"], year_min=2013) == [3]
+    assert not MovieFilter.create()
+
+
+def test_concat_merges_genre_and_language_names():
+    facets = make_facets().concat(Facets.from_frame(pd.DataFrame({
+        "genre_names": ["Western, Comedy"], "original_language": ["de"],
+    })))
+    votes = np.zeros(5)
+    assert list(facets.rows(MovieFilter.create(genres=["comedy"]), votes)) == [0, 4]
+    assert list(facets.rows(MovieFilter.create(languages=["en"]), votes)) == [0, 2]
+    assert list(facets.take([4, 1]).rows(MovieFilter.create(genres=["western"]), votes)) == [0]
+
+
+@pytest.mark.parametrize("n_candidates", [40, 500])
+def test_filtered_scoring_matches_brute_force(n_candidates):
+    # 40 candidates score only them, 500 mask the scores of all movies
+    matrix = make_clustered_matrix()
+    rng = np.random.default_rng(1)
+    candidates = np.sort(rng.choice(600, n_candidates, replace=False))
+    queries = np.array([candidates[0], 1, 2, 599])
+
+    rows, scores = similar_movie_rows_batch(queries, matrix, 5, candidates=candidates)
+    dense = (matrix[queries] @ matrix.T).toarray()
+    for i, query in enumerate(queries):
+        allowed = [row for row in candidates if row != query]
+        expected = sorted(allowed, key=lambda row: (-dense[i, row], row))[:5]
+        assert list(rows[i]) == expected
+        assert np.allclose(scores[i], dense[i, expected])
+
+
+def test_filter_leaves_fewer_rows_than_asked():
+    matrix = make_clustered_matrix()
+    index = AnnIndex.build(matrix, n_components=32, n_lists=10)
+    candidates = np.array([1, 7])
+    for search in (
+        lambda rows: similar_movie_rows_batch(rows, matrix, 5, candidates=candidates),
+        lambda rows: index.similar_rows(rows, matrix, 5, nprobe=2, candidates=candidates),
+    ):
+        rows, scores = search([0, 1])
+        # Movie 1 cannot recommend itself, which only shortens its own row
+        assert rows.shape == (2, 2)
+        assert sorted(rows[0]) == [1, 7] and list(rows[1]) == [7, -1]
+        assert scores[1, 1] == -np.inf
+        assert list(rows[0]) == list(search([0])[0][0])
+
+
+def test_batch_matches_single_recommendations_with_uneven_matches():
+    engine = make_engine()
+    horror_or_action = MovieFilter.create(genres=["horror", "action"])
+    batch = get_batch_recommendations(
+        ["alien", "up"], 5, engine=engine, movie_filter=horror_or_action
+    ).results
+    for item in batch:
+        single = get_recommendation(item.movie, 5, engine=engine, movie_filter=horror_or_action)
+        assert item.recommendations == single.recommendations
+        assert item.metrics == single.metrics
+    assert [item.recommendations for item in batch] == [["aliens"], ["alien", "aliens"]]
+
+
+def test_ann_search_respects_candidates():
+    matrix = make_clustered_matrix()
+    index = AnnIndex.build(matrix, n_components=32, n_lists=10)
+    candidates = np.arange(0, 600, 3)
+    rows, _ = index.similar_rows([1, 3], matrix, 5, nprobe=2, candidates=candidates)
+    assert rows.shape == (2, 5)
+    assert np.isin(rows, candidates).all() and 3 not in rows[1]
+
+
+def test_engine_filters_precomputed_neighbors():
+    engine = make_engine()
+    engine.neighbors = np.array([[1, 2], [0, 2], [0, 1]])
+    engine.neighbor_scores = np.array([[0.5, 0.1], [0.5, 0.1], [0.1, 0.1]])
+    only_up = MovieFilter.create(genres=["animation"])
+    assert engine.similar_rows([0], 1, movie_filter=only_up).tolist() == [[2]]
+    # Too few matching neighbours fall back to scoring the matching movies
+    only_alien = MovieFilter.create(genres=["horror"])
+    assert engine.similar_rows([1, 2], 2, movie_filter=only_alien).tolist() == [[0], [0]]
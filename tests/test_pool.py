@@ -0,0 +1,33 @@
+import asyncio
+import threading
+import pytest
+from movie_rec_system.app.pool import ComputePool, PoolSaturated
+
+
+def test_saturated_pool_rejects_instead_of_queueing():
+    pool = ComputePool(max_workers=1, max_queue=1, retry_after=3)
+    release = threading.Event()
+    running = pool.submit(release.wait)
+    queued = pool.submit(lambda: "queued")
+
+    with pytest.raises(PoolSaturated) as excinfo:
+        pool.submit(lambda: "rejected")
+    assert excinfo.value.retry_after == 3
+    assert pool.rejected == 1
+
+    release.set()
+    assert queued.result(timeout=1) == "queued"
+    running.result(timeout=1)
+    assert pool.submit(lambda: "accepted").result(timeout=1) == "accepted"
+    pool.shutdown()
+    assert pool.pending == 0
+
+
+def test_run_awaits_without_blocking_the_loop():
+    pool = ComputePool(max_workers=1, max_queue=0)
+
+    async def main():
+        return await pool.run(sum, [1, 2, 3])
+
+    assert asyncio.run(main()) == 6
+    pool.shutdown()
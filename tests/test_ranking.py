@@ -0,0 +1,74 @@
+import numpy as np
+from movie_rec_system.app.cache import RecommendationCache
+from movie_rec_system.app.ranking import HybridWeights, RankingFeatures
+from movie_rec_system.app.recommender import get_recommendation
+from movie_rec_system.tests.test_ann import make_clustered_matrix
+from movie_rec_system.tests.test_engine import make_engine
+
+
+def test_bayesian_average_shrinks_movies_with_few_votes():
+    metrics = np.array([
+        [10.0, 10.0, 1],
+        [5.0, 8.0, 1000],
+        [1.0, 6.0, 1000],
+    ])
+    features = RankingFeatures(metrics)
+    # A single perfect vote ranks below a well-voted 8
+    assert features.quality[0] < features.quality[1]
+    assert features.popularity.max() == 1
+    assert not HybridWeights(similarity=2)
+    assert HybridWeights(quality=0.1).key() == "s=1;p=0;q=0.1;v=0"
+
+
+def test_rerank_matches_per_candidate_scores():
+    rng = np.random.default_rng(0)
+    metrics = np.column_stack([
+        rng.random(50) * 100, rng.random(50) * 10, rng.integers(0, 5000, 50)
+    ])
+    features = RankingFeatures(metrics)
+    weights = HybridWeights(similarity=1, popularity=0.3, quality=0.5, votes=0.2)
+    movie_rows = np.array([0, 1])
+    candidates = np.array([rng.permutation(np.arange(2, 50))[:20] for _ in movie_rows])
+    similarities = rng.random(candidates.shape)
+
+    rows, scores = features.rerank(movie_rows, candidates, similarities, weights, 5)
+    for i, movie in enumerate(movie_rows):
+        expected = {
+            row: weights.similarity * similarity
+            + weights.popularity * features.popularity[row]
+            + weights.quality * features.quality[row]
+            + weights.votes * (
+                1 - abs(features.log_votes[row] - features.log_votes[movie])
+                / features.log_votes_range
+            )
+            for row, similarity in zip(candidates[i], similarities[i])
+        }
+        best = sorted(expected, key=expected.get, reverse=True)[:5]
+        assert list(rows[i]) == best
+        assert np.allclose(scores[i], [expected[row] for row in best], atol=1e-5)
+
+
+def test_engine_reranks_the_most_similar_movies():
+    engine = make_engine()
+    engine.tfidf_matrix = make_clustered_matrix(n_movies=3)
+    popular = HybridWeights(similarity=0, popularity=1)
+    # Popularity 1, 2, 3: up is the most popular of the two candidates of alien
+    assert engine.similar_rows([0], 1, weights=popular).tolist() == [[2]]
+    # With a single candidate there is nothing to re-rank
+    engine.hybrid_candidates = 1
+    assert engine.similar_rows([0], 1, weights=popular).tolist() == (
+        engine.similar_rows([0], 1).tolist()
+    )
+
+
+def test_cached_hybrid_recommendations_match_fresh_ones():
+    engine = make_engine()
+    engine.tfidf_matrix = make_clustered_matrix(n_movies=3)
+    # The pool is one movie for the top-1 but both candidates for the top-2
+    engine.hybrid_candidates = 1
+    popular = HybridWeights(similarity=0, popularity=1)
+    fresh = get_recommendation("alien", 1, engine=engine, weights=popular)
+    cache = RecommendationCache()
+    get_recommendation("alien", 2, engine=engine, cache=cache, weights=popular)
+    cached = get_recommendation("alien", 1, engine=engine, cache=cache, weights=popular)
+    assert cached.recommendations == fresh.recommendations
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+from movie_rec_system.app.recommenderhelper import (
+    compute_metrics,
+    compute_metrics_from_rows,
+    compute_top_k_neighbors,
+    metric_matrix,
+    normalize_rows,
+    similar_movie_rows,
+    similar_movie_rows_batch,
+    similar_query_rows,
+    top_k_indices,
+)
+
+
+def make_tfidf_matrix(n_movies=200, n_terms=50, seed=0):
+    rng = np.random.default_rng(seed)
+    return sparse.random(
+        n_movies, n_terms, density=0.1, format="csr", random_state=rng
+    )
+
+
+def test_top_k_indices_excludes_and_sorts():
+    scores = np.array([0.1, 0.9, 0.5, 1.0, 0.7])
+    assert list(top_k_indices(scores, 3, exclude=3)) == [1, 4, 2]
+    assert list(top_k_indices(scores, 10, exclude=3)) == [1, 4, 2, 0]
+
+
+def test_sparse_scoring_matches_dense_ranking():
+    matrix = make_tfidf_matrix()
+    normalized = normalize_rows(matrix)
+    dense_similarity = cosine_similarity(matrix)
+
+    for movie_row in (0, 17, 199):
+        rows, scores = similar_movie_rows(movie_row, normalized, top_n=10)
+        expected = dense_similarity[movie_row].copy()
+        expected[movie_row] = -np.inf
+        np.testing.assert_allclose(scores, np.sort(expected)[::-1][:10])
+        np.testing.assert_allclose(scores, expected[rows])
+
+
+def test_chunked_neighbors_match_row_scoring():
+    normalized = normalize_rows(make_tfidf_matrix(n_movies=50))
+    blocks = list(compute_top_k_neighbors(normalized, k=5, chunk_size=16))
+    assert [start for start, _, _ in blocks] == [0, 16, 32, 48]
+
+    neighbors = np.vstack([block for _, block, _ in blocks])
+    scores = np.vstack([block for _, _, block in blocks])
+    assert neighbors.shape == (50, 5)
+    for movie_row in range(50):
+        rows, row_scores = similar_movie_rows(movie_row, normalized, top_n=5)
+        np.testing.assert_array_equal(neighbors[movie_row], rows)
+        np.testing.assert_allclose(scores[movie_row], row_scores)
+
+
+def test_batch_scoring_matches_row_scoring():
+    normalized = normalize_rows(make_tfidf_matrix())
+    movie_rows = [3, 150, 3, 42]
+    rows, scores = similar_movie_rows_batch(
+        movie_rows, normalized, top_n=7, chunk_size=3
+    )
+    assert rows.shape == (4, 7)
+    for i, movie_row in enumerate(movie_rows):
+        expected_rows, expected_scores = similar_movie_rows(
+            movie_row, normalized, top_n=7
+        )
+        np.testing.assert_array_equal(rows[i], expected_rows)
+        np.testing.assert_allclose(scores[i], expected_scores)
+
+
+def test_query_scoring_matches_dense_ranking():
+    normalized = normalize_rows(make_tfidf_matrix())
+    queries = normalize_rows(make_tfidf_matrix(n_movies=3, seed=1))
+    expected = (queries @ normalized.T).toarray()
+    candidates = np.arange(0, 200, 5)
+
+    for term_matrix in (None, normalized.T.tocsr()):
+        rows, scores = similar_query_rows(
+            queries, normalized, top_n=6, chunk_size=2, term_matrix=term_matrix
+        )
+        np.testing.assert_allclose(scores, -np.sort(-expected, axis=1)[:, :6])
+        np.testing.assert_allclose(scores, np.take_along_axis(expected, rows, axis=1))
+
+        rows, scores = similar_query_rows(
+            queries, normalized, top_n=6, candidates=candidates, term_matrix=term_matrix
+        )
+        assert np.isin(rows, candidates).all()
+        np.testing.assert_allclose(scores, -np.sort(-expected[:, candidates], axis=1)[:, :6])
+
+
+def test_vectorized_metrics_match_per_column_rmse():
+    df = pd.DataFrame({
+        "title": ["a", "b", "c", "d"],
+        "popularity": [10.0, 12.0, 7.0, 30.0],
+        "vote_average": [7.0, 6.5, 8.0, 5.0],
+        "vote_count": [100, 250, 40, 1000],
+    })
+    recommendations = ["b", "d"]
+    expected = tuple(
+        round(float(np.sqrt(np.mean((df[column].iloc[[1, 3]] - df[column].iloc[0]) ** 2))), 3)
+        for column in ["popularity", "vote_average", "vote_count"]
+    )
+    metrics = metric_matrix(df)
+    assert compute_metrics_from_rows(metrics, 0, [1, 3]) == [expected]
+    assert compute_metrics_from_rows(metrics, [0, 0], [[1, 3], [3, 1]]) == [
+        expected, expected
+    ]
+    assert compute_metrics_from_rows(metrics, [], []) == []
+    assert compute_metrics(df, "a", recommendations) == expected
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+import pytest
+from movie_rec_system.app import reloader as reloader_module
+from movie_rec_system.app.reloader import ModelReloader, validate_engine
+from movie_rec_system.tests.test_engine import make_engine
+
+
+def test_validate_engine_rejects_shrunken_catalogue():
+    engine = make_engine()
+    validate_engine(engine)
+
+    small = make_engine()
+    small.movie_list = small.movie_list[:1]
+    with pytest.raises(ValueError):
+        validate_engine(small, reference=engine)
+
+
+def test_reload_swaps_engine_atomically(monkeypatch):
+    current = make_engine()
+    current.version = "v1-old"
+    new = make_engine()
+    new.version = "v1-new"
+    monkeypatch.setattr(reloader_module, "load_or_build_engine", lambda *args: new)
+    swapped = []
+    reloader = ModelReloader(current, on_swap=swapped.append)
+
+    assert reloader.reload(force=True)
+    reloader.wait()
+    assert reloader.engine is new
+    assert swapped == [new]
+    assert reloader.status()["version"] == "v1-new"
+    assert reloader.status()["reloads"] == 1
+
+
+def test_failed_validation_keeps_serving_engine(monkeypatch):
+    current = make_engine()
+    broken = make_engine()
+    broken.tfidf_matrix = broken.tfidf_matrix[:2]
+    monkeypatch.setattr(reloader_module, "load_or_build_engine", lambda *args: broken)
+    reloader = ModelReloader(current)
+
+    reloader.reload(force=True)
+    reloader.wait()
+    assert reloader.engine is current
+    assert reloader.failures == 1
+    assert "do not match" in reloader.status()["last_error"]
+    assert not reloader.reloading
+
+
+def test_polling_checksums_only_after_database_changed(monkeypatch):
+    engine = make_engine()
+    engine.source_checksum = "old"
+    database = {"signature": "written-once", "checksum": "old", "checksums": 0}
+
+    def get_source_checksum():
+        database["checksums"] += 1
+        return database["checksum"]
+
+    monkeypatch.setattr(reloader_module, "get_source_checksum", get_source_checksum)
+    monkeypatch.setattr(
+        reloader_module, "get_database",
+        lambda: SimpleNamespace(signature=lambda: database["signature"]),
+    )
+    reloader = ModelReloader(engine)
+
+    assert reloader.pending_change(probe=True) is None
+    assert reloader.pending_change(probe=True) is None
+    assert database["checksums"] == 1
+
+    database.update(signature="written-twice", checksum="new")
+    assert reloader.pending_change(probe=True) == "full"
+    assert reloader.pending_change() == "full"
+    assert database["checksums"] == 3
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import pytest
+from movie_rec_system.app.singleflight import SingleFlight
+
+
+def test_concurrent_threads_share_one_call():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", compute)))
+    leader.start()
+    started.wait(timeout=5)
+    followers = [
+        threading.Thread(target=lambda: results.append(flights.do("key", compute)))
+        for _ in range(3)
+    ]
+    for follower in followers:
+        follower.start()
+    while flights.coalesced < 3:
+        pass
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(timeout=5)
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flights.stats() == {"leaders": 1, "coalesced": 3, "in_flight": 0}
+    # Finished keys are computed again
+    assert flights.do("key", lambda: "again") == "again"
+
+
+def test_concurrent_tasks_share_one_call_and_its_error():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value is None:
+            raise ValueError("failed")
+        return value
+
+    async def main():
+        shared = await asyncio.gather(*(flights.run("a", lambda: compute(1)) for _ in range(3)))
+        other = await flights.run("b", lambda: compute(2))
+        errors = await asyncio.gather(
+            *(flights.run("c", lambda: compute(None)) for _ in range(2)),
+            return_exceptions=True,
+        )
+        return shared, other, errors
+
+    shared, other, errors = asyncio.run(main())
+    assert shared == [1, 1, 1]
+    assert other == 2
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert calls == [1, 2, None]
+    assert flights.stats() == {"leaders": 3, "coalesced": 3, "in_flight": 0}
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    flights = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.run("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.run("key", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "done"
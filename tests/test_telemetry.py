@@ -0,0 +1,35 @@
+from movie_rec_system.app.telemetry import Telemetry, start_request_timing, timing_header
+
+
+def test_histograms_render_cumulative_buckets():
+    telemetry = Telemetry(buckets=(0.01, 0.1))
+    telemetry.observe("movie_rec_stage_seconds", 0.005, stage="lookup")
+    telemetry.observe("movie_rec_stage_seconds", 0.05, stage="lookup")
+    telemetry.observe("movie_rec_stage_seconds", 5.0, stage="lookup")
+    telemetry.inc("movie_rec_requests_total", endpoint="/", status=200)
+    text = telemetry.render({
+        "movie_rec_model_info": ("gauge", "Model version.", [({"version": 'v"1'}, 1)]),
+    })
+
+    assert "# TYPE movie_rec_stage_seconds histogram" in text
+    assert 'movie_rec_stage_seconds_bucket{stage="lookup",le="0.01"} 1' in text
+    assert 'movie_rec_stage_seconds_bucket{stage="lookup",le="0.1"} 2' in text
+    assert 'movie_rec_stage_seconds_bucket{stage="lookup",le="+Inf"} 3' in text
+    assert 'movie_rec_stage_seconds_count{stage="lookup"} 3' in text
+    assert 'movie_rec_requests_total{endpoint="/",status="200"} 1' in text
+    assert 'movie_rec_model_info{version="v\\"1"} 1' in text
+
+
+def test_spans_fill_the_request_timings():
+    telemetry = Telemetry()
+    with telemetry.span("outside"):
+        pass
+    timings = start_request_timing()
+    with telemetry.span("score"):
+        pass
+    with telemetry.span("score"):
+        pass
+
+    assert list(timings) == ["score"]
+    assert telemetry.histogram_count("movie_rec_stage_seconds", stage="score") == 2
+    assert timing_header(timings, 0.002).endswith("total;dur=2.000")
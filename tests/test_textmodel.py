@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from movie_rec_system.app.textmodel import IncrementalTfidf
+
+DOCUMENTS = [
+    "alien on a ship",
+    "aliens on a planet",
+    "a flying house",
+    "a ship lost in space",
+]
+
+
+def similarities(matrix):
+    return (matrix @ matrix.T).toarray()
+
+
+def test_fit_matches_tfidf_vectorizer():
+    model = IncrementalTfidf().fit(DOCUMENTS, [1, 2, 3, 4])
+    expected = TfidfVectorizer(stop_words="english").fit_transform(DOCUMENTS)
+    np.testing.assert_allclose(model.matrix.toarray(), expected.toarray())
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batched_fit_matches_fit(workers):
+    documents = [*DOCUMENTS, "the and of", "a house on a planet"]
+    batches = [
+        (documents[:1], [1]), (documents[1:4], [2, 3, 4]), (documents[4:5], [5]),
+        (documents[5:], [6]),
+    ]
+    model = IncrementalTfidf().fit_batches(batches, workers=workers)
+    expected = IncrementalTfidf().fit(documents, [1, 2, 3, 4, 5, 6])
+
+    assert list(model.vocabulary.items()) == list(expected.vocabulary.items())
+    assert list(model.ids) == [1, 2, 3, 4, 5, 6]
+    np.testing.assert_array_equal(model.document_frequency, expected.document_frequency)
+    np.testing.assert_array_equal(model.matrix.toarray(), expected.matrix.toarray())
+    # Reweighting in chunks of rows changes nothing either
+    expected.renormalize(chunk_size=4)
+    np.testing.assert_array_equal(model.matrix.toarray(), expected.matrix.toarray())
+
+
+def test_updates_match_a_full_refit_after_renormalize():
+    model = IncrementalTfidf().fit(DOCUMENTS, [1, 2, 3, 4])
+    rows = model.upsert([2, 5], ["aliens attack the planet", "a house in space"])
+    assert list(rows) == [1, 4]
+    assert model.remove([3, 99]) == 1
+    model.renormalize()
+
+    documents = [
+        "alien on a ship",
+        "aliens attack the planet",
+        "a ship lost in space",
+        "a house in space",
+    ]
+    assert list(model.ids) == [1, 2, 4, 5]
+    expected = TfidfVectorizer(stop_words="english").fit_transform(documents)
+    # Columns are ordered differently once the vocabulary grows
+    np.testing.assert_allclose(similarities(model.matrix), similarities(expected))
+
+
+def test_only_updated_rows_are_reweighted_until_renormalize():
+    model = IncrementalTfidf().fit(DOCUMENTS, [1, 2, 3, 4])
+    before = model.matrix
+    model.upsert([5], ["a flying ship"])
+    np.testing.assert_allclose(model.matrix[:4].toarray(), before.toarray())
+
+    model = IncrementalTfidf(renormalize_every=0.1).fit(DOCUMENTS, [1, 2, 3, 4])
+    model.upsert([5], ["a flying ship"])
+    assert model.stale_rows == 0
+    assert not np.allclose(model.matrix[:4].toarray(), before.toarray())
+
+
+def test_fixed_vocabulary_ignores_unseen_terms():
+    model = IncrementalTfidf(growable=False).fit(DOCUMENTS, [1, 2, 3, 4])
+    n_terms = model.n_terms
+    model.upsert([5], ["a submarine ship"])
+    assert model.n_terms == n_terms
+    assert model.transform(["submarine"]).nnz == 0
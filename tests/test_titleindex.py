@@ -0,0 +1,26 @@
+from movie_rec_system.app.titleindex import TitleIndex, normalize_title
+
+TITLES = ["the thing", "the thing", "thor", "the matrix", "inception", "interstellar"]
+
+
+def test_duplicate_titles_prefer_priority():
+    index = TitleIndex(TITLES, priority=[10, 500, 1, 1, 1, 1])
+    assert index.rows("The  Thing ") == [1, 0]
+    assert index.resolve("the thing") == 1
+
+
+def test_prefix_and_fuzzy_matching():
+    index = TitleIndex(TITLES)
+    assert index.prefix("th") == ["the matrix", "the thing", "thor"]
+    assert index.fuzzy("inceptoin") == [("inception", 2)]
+    assert index.resolve("Intersteller") == 5
+    assert index.resolve("completely unknown") is None
+
+
+def test_search_reports_match_kind():
+    index = TitleIndex(TITLES)
+    results = index.search("the thing")
+    assert results[0] == {
+        "title": "the thing", "rows": [0, 1], "match": "exact", "distance": 0
+    }
+    assert normalize_title("ＴＨＥ\tMatrix") == "the matrix"